@@ -1,52 +1,109 @@
 import os
+import csv
 import hashlib
 import json
+import itertools
+import textwrap
+import threading
+import time
+import tempfile
 from timeit import default_timer as timer
 import datetime
 from datetime import timedelta
 
-from pathlib import Path, WindowsPath
+from pathlib import Path, PureWindowsPath
 
-from dbf_reader import get_data
+from dbf_reader import iter_records, count_records
 
 from subprocess import PIPE, run
 
-from mssql_data import MSSQLData, read_registry
+from mssql_data import MSSQLData, SQLiteData, read_registry, make_insert_stmt
 
+from scheduler import ConversionScheduler, parse_workers
 
-class Node:
-    def __init__(self, name, parent=None):
-        self.name = name
-        self.path = None
-        self.children = {}
-        self.parent = parent
-        self.is_file = False
-        self.is_dir = False
+from ffmpeg_runner import run_ffmpeg, cleanup_partial_outputs, probe_audio
+
+from manifest import ConversionManifest
+
+from id3_reader import read_mp3_info
+
+from probe_cache import ProbeCache
+
+from pipeline import Pipeline, PipelineStage, SequenceBuffer
+
+from dedup import SourceIndex
+
+from placement import place_file
+
+from metrics import Metrics
+
+from progress import ProgressReporter, write_line
+
+from encoder_profiles import parse_profiles, parse_profile_map, ProfileStats, OGG_EXTENSIONS
+
+from scratch import ScratchSpace, is_network_path
 
-    def add_child(self, child_node):
-        self.children[child_node.name] = child_node
 
-    def __repr__(self):
-        return f"Node(name='{self.name}', type='{'file' if self.is_file else 'dir'}')"
+# Tracks columns written by process_import_data
+TRACK_IMPORT_COLUMNS = ['tracktitle', 'artistsearch', 'filepath', 'class', 'duration', 'year',
+                        'fadein', 'fadeout', 'fadedelay', 'intro', 'extro', 'folderid', 'onstartevent',
+                        'onstopevent', 'disablenotify', 'physicalstorageused', 'trackmediatype',
+                        'artistID_1', 'old_filename']
+
+# Tracks columns written by convert_mp3_to_ogg
+MP3_TRACK_COLUMNS = ['trackreference'] + TRACK_IMPORT_COLUMNS[:-1]
+
+# Tracks columns written by convert_prepared_files
+PREPARED_TRACK_COLUMNS = ['trackreference'] + TRACK_IMPORT_COLUMNS
+
+ARTIST_COLUMNS = ['ArtistID', 'ArtistSurname', 'ArtistType']
+
+AUDIO_FILES_LIST_COLUMNS = ['unique_id', 'song_id', 'path', 'title', 'artist', 'album', 'genre', 'lyrics',
+                            'isrc', 'playlist', 'length', 'amplify', 'fade_in', 'fade_out', 'cue_in',
+                            'cue_out', 'cross_start_next']
+
+
+class NodeIdAllocator:
+    # Hands out node ids for one walk: folders and files are numbered from
+    # their own counters, with the file counter also advanced for folders
+    __slots__ = ("folder_id", "file_id")
+
+    def __init__(self):
+        self.folder_id = 1
+        self.file_id = 1
+
+    def next_id(self, is_file: bool) -> int:
+        self.file_id += 1
+        if is_file:
+            node_id = self.file_id
+            self.file_id += 1
+        else:
+            node_id = self.folder_id
+            self.folder_id += 1
+        return node_id
 
 
 class TreeNode:
-    Folder_ID_COUNTER = 1
-    File_ID_COUNTER = 1
-    def __init__(self, name, is_file=False, filepath="", parent=None):
+    # Only the root keeps its path, the path of any other node is rebuilt
+    # from the names up to the root when it is asked for
+    __slots__ = ("name", "is_file", "parent", "children", "node_id", "root_path")
+
+    def __init__(self, name, node_id, is_file=False, parent=None, root_path=None):
         self.name = name
         self.is_file = is_file
-        self.filepath = filepath
         self.parent = parent
         self.children = []
-        self.node_id = TreeNode.File_ID_COUNTER
-        TreeNode.File_ID_COUNTER += 1
-        if is_file:
-             self.node_id = TreeNode.File_ID_COUNTER
-             TreeNode.File_ID_COUNTER += 1
-        else:
-            self.node_id = TreeNode.Folder_ID_COUNTER
-            TreeNode.Folder_ID_COUNTER += 1
+        self.node_id = node_id
+        self.root_path = root_path
+
+    @property
+    def filepath(self) -> str:
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return os.path.join(node.root_path, *reversed(names))
 
     def add_child(self, child_node):
         child_node.parent = self
@@ -69,6 +126,14 @@ class AudioConverter:
         self.sql_folder = kwargs.get("sql_folder", "sql/")
         self.include_folders = kwargs.get("include_folders", "")  # For mp3 folders
         self.chamgei_music_folder = kwargs.get("chamgei_music_folder", "")
+        self.files_list_file = kwargs.get("files_list_file", "files.jsonl")  # Written by --w, read by --t
+        self.workers = parse_workers(kwargs.get("workers"))  # Defaults to the number of cores
+        self.probe_workers = parse_workers(kwargs.get("probe_workers", self.workers))
+        self.fast_mp3_probe = kwargs.get("fast_mp3_probe", "True") == "True"
+
+        # Seconds a single ffmpeg run may take before it is killed, empty for no limit
+        timeout = kwargs.get("ffmpeg_timeout", "")
+        self.ffmpeg_timeout = float(timeout) if timeout != "" else None
 
         converted = kwargs.get("keep_converted", "False")
         if converted == "True":
@@ -76,10 +141,110 @@ class AudioConverter:
         else:
             self.keep_converted = False
 
+        # SQLite record of finished conversions, used to resume runs
+        self.manifest_file = kwargs.get("manifest_file", f"{self.log_folder}/manifest.db")
+        self.manifest = None
+
+        # Cache of mp3 tags and durations keyed on path, size and mtime
+        self.use_probe_cache = kwargs.get("probe_cache", "True") == "True"
+        self.probe_cache_file = kwargs.get("probe_cache_file", f"{self.log_folder}/probe_cache.db")
+        self.probe_cache_size = int(kwargs.get("probe_cache_size", "500000"))   # entries
+        self.probe_cache = None
+        self._probe_cache_lock = threading.Lock()
+
+        # sql (default) writes insert statements to .sql files as a dry run,
+        # direct loads the rows into the database in batches
+        self.import_mode = kwargs.get("import_mode", "sql")
+        self.import_batch_size = int(kwargs.get("import_batch_size", "1000"))
+        self.db_backend = kwargs.get("db_backend", "mssql")    # mssql or sqlite
+        self.sqlite_file = kwargs.get("sqlite_file", "studioone.db")
+        self.list_batch_size = int(kwargs.get("list_batch_size", "5000"))   # Rows per fetch in list_audio_files
+
+        # Time and bytes per stage and category, written on close() as JSON
+        # lines (metrics_format=jsonl) or a Prometheus textfile (prometheus)
+        self.metrics = Metrics()
+        self.metrics_format = kwargs.get("metrics_format", "jsonl")
+        default_metrics_file = "metrics.prom" if self.metrics_format == "prometheus" else "metrics.jsonl"
+        self.metrics_file = kwargs.get("metrics_file", f"{self.log_folder}/{default_metrics_file}")
+
+        # Moving outputs falls back to hard links, reflinks and a verified
+        # copy when a rename is not possible, e.g. across volumes
+        self.placement_workers = parse_workers(kwargs.get("placement_workers", self.workers))
+        self.placement_verify = kwargs.get("placement_verify", "True") == "True"
+
+        # Convert sources with the same content only once, the copies get a
+        # hard link (or a copy when dedup_link=False) of the first output
+        self.dedup_sources = kwargs.get("dedup_sources", "False") == "True"
+        self.dedup_link = kwargs.get("dedup_link", "True") == "True"
+        self.source_index = SourceIndex() if self.dedup_sources else None
+
+        # --pipeline runs the stages of --m and --w/--t at the same time,
+        # connected by queues of pipeline_queue_size items
+        self.pipeline_queue_size = int(kwargs.get("pipeline_queue_size", "100"))
+        self.pipeline_report_interval = float(kwargs.get("pipeline_report_interval", "10"))   # seconds
+
+        # The --pipeline modes keep I/O work (stat, probing and prefetching
+        # sources) on io_workers and ffmpeg on workers. With autotune_workers
+        # a stage gets another worker (up to max_io_workers / max_workers)
+        # while its items wait over autotune_wait seconds in its queue, and
+        # loses one while its workers are mostly idle.
+        self.io_workers = parse_workers(kwargs.get("io_workers", "4"))
+        self.max_io_workers = parse_workers(kwargs.get("max_io_workers", "16"))
+        self.max_workers = parse_workers(kwargs.get("max_workers", self.workers))
+        self.autotune_workers = kwargs.get("autotune_workers", "True") == "True"
+        self.autotune_interval = float(kwargs.get("autotune_interval", "5"))   # seconds
+        self.autotune_wait = float(kwargs.get("autotune_wait", "1"))   # seconds
+
+        # Sources on network shares (//server/share, or under one of
+        # network_roots) are copied to scratch_folder before ffmpeg reads them,
+        # holding at most scratch_size_mb at a time
+        self.prefetch_sources = kwargs.get("prefetch_sources", "True") == "True"
+        network_roots = kwargs.get("network_roots", "").split(",")
+        self.network_roots = tuple(root.strip().replace("\\", "/") for root in network_roots if root.strip() != "")
+        self.scratch_folder = kwargs.get("scratch_folder", os.path.join(tempfile.gettempdir(), "audio_convert_scratch"))
+        self.scratch_size = int(kwargs.get("scratch_size_mb", "2048")) * 1024 * 1024
+
+        # Every mode prints its files/s, MB/s, realtime factor and ETA each
+        # progress_interval seconds (0 for only the final numbers) and writes
+        # them to status_file. print_files=False leaves out the line per file.
+        self.progress_interval = float(kwargs.get("progress_interval", "5"))    # seconds
+        self.status_file = kwargs.get("status_file", f"{self.log_folder}/status.json")
+        self.print_files = kwargs.get("print_files", "True") == "True"
+        self.progress = ProgressReporter("idle")     # Replaced by start_progress()
+
+        # Encoder profiles (see encoder_profiles.py) picked by DBF category,
+        # mp3 folder or the folder of a prepared file, their realtime factor
+        # is written to profile_stats.json
+        self.profiles = parse_profiles(kwargs)
+        self.default_profile = kwargs.get("default_profile", "vorbis")
+        self.profile_map = parse_profile_map(kwargs.get("profile_map", ""))
+        for name in [self.default_profile, *self.profile_map.values()]:
+            if name not in self.profiles:
+                raise Exception(f"Unknown encoder profile: {name}")
+        self.profile_stats = ProfileStats()
+
+        # Files picked up by --w and --m, e.g. .mp3,.ogg. Ogg sources that
+        # already match their profile are copied instead of encoded unless
+        # skip_matching_sources=False.
+        source_extensions = kwargs.get("source_extensions", ".mp3").split(",")
+        self.source_extensions = tuple(ext.strip().lower() for ext in source_extensions)
+        self.skip_matching_sources = kwargs.get("skip_matching_sources", "True") == "True"
+        self.total_skipped_transcodes = 0
+        self._skipped_lock = threading.Lock()
+
+        removed = cleanup_partial_outputs(self.output_folder)
+        if removed > 0:
+            print(f"Removed {removed} partial output files from: {self.output_folder}")
+
         self.artists = self.fetch_data(self.artists_file)
+        self._artists_lock = threading.Lock()   # New artists are added by the pipeline probe workers
         self.folders = {}
+        self.failed_conversions = []
 
+        # One connection is kept open for the whole run, see close()
         self.mssql_con = self._make_mssql_connection()
+        self.mssql_con.metrics = self.metrics
+        self.audio_location = None
 
         self.max_artist_id = self.get_max_artist_id()
 
@@ -90,10 +255,15 @@ class AudioConverter:
         self.total_missing_files = 0
         self.total_conversion_time = 0
         self.total_conversion_time_str = ""
+        self.total_cpu_time = 0.0
         self.total_zero_bytes_files = 0
+        self.total_deduplicated_files = 0
 
 
     def _make_mssql_connection(self):
+        if self.db_backend == "sqlite":
+            return SQLiteData(self.sqlite_file)
+
         reg = read_registry()
         server = reg['server']
         database = reg['database']
@@ -101,6 +271,88 @@ class AudioConverter:
         password = reg['password']
         return MSSQLData(server, database, username, password)
 
+    def close(self):
+        self.progress.stop()
+        self.write_metrics()
+        self.write_profile_stats()
+        self.mssql_con.disconnect()
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+        if self.probe_cache is not None:
+            print(f"Probe cache hits: {self.probe_cache.hits}, misses: {self.probe_cache.misses}")
+            self.probe_cache.close()
+            self.probe_cache = None
+
+    def start_progress(self, mode: str, total: int = None) -> ProgressReporter:
+        self.progress.stop()
+        self.progress = ProgressReporter(mode, self.status_file, self.progress_interval)
+        self.progress.start(total)
+        return self.progress
+
+    def counted(self, items):
+        # Passes items through and adds each one to the progress total, for
+        # modes that find their files while converting them
+        for item in items:
+            self.progress.add_total()
+            yield item
+
+    def print_file(self, message: str):
+        if self.print_files:
+            write_line(message)
+
+    def write_metrics(self):
+        if self.metrics_format == "none":
+            return
+
+        try:
+            if self.metrics_format == "prometheus":
+                self.metrics.write_prometheus(self.metrics_file)
+            else:
+                self.metrics.write_jsonl(self.metrics_file)
+        except OSError as e:
+            print(f"Failed to write metrics to {self.metrics_file}: {e}")
+            return
+
+        print(f"Stage metrics written to: {self.metrics_file}")
+
+    def write_profile_stats(self):
+        rows = self.profile_stats.summary()
+        if len(rows) == 0:
+            return
+
+        for row in rows:
+            print(f"Profile {row['profile']}: {row['files']} files, {row['failed']} failed, "
+                  f"{row['realtime_factor']}x realtime, {row['cpu_realtime_factor']}x realtime per CPU second")
+
+        filename = f"{self.log_folder}/profile_stats.json"
+        try:
+            with open(filename, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False, indent=4)
+        except OSError as e:
+            print(f"Failed to write profile stats to {filename}: {e}")
+
+    def get_probe_cache(self) -> ProbeCache:
+        # None when probe_cache=False
+        if not self.use_probe_cache:
+            return None
+
+        with self._probe_cache_lock:
+            if self.probe_cache is None:
+                cache_folder = os.path.dirname(self.probe_cache_file)
+                if cache_folder != "" and not os.path.exists(cache_folder):
+                    os.makedirs(cache_folder)
+                self.probe_cache = ProbeCache(self.probe_cache_file, self.probe_cache_size)
+        return self.probe_cache
+
+    def get_manifest(self) -> ConversionManifest:
+        if self.manifest is None:
+            manifest_folder = os.path.dirname(self.manifest_file)
+            if manifest_folder != "" and not os.path.exists(manifest_folder):
+                os.makedirs(manifest_folder)
+            self.manifest = ConversionManifest(self.manifest_file)
+        return self.manifest
+
     def fetch_artists(self, file) ->dict[int, str]:
         # Check if the file exists
         if not os.path.exists(file):
@@ -147,10 +399,10 @@ class AudioConverter:
 
         for name, id in tree.items():
             tracks = self.prepare_tracks_import_data(name, id)
+            self.progress.update(files=len(tracks))
             if len(tracks) > 0:
-                stmts =self.make_sql_import_stmts(tracks)
-                # Write data to a json file
-                self.write_sql_stmts(stmts, name)
+                rows = self.make_import_track_rows(tracks)
+                self.import_rows([("Tracks", TRACK_IMPORT_COLUMNS, rows)], name)
 
     def prepare_tracks_import_data(self, tree_name:str, tree_id:int) -> list:
         tracks = []
@@ -194,22 +446,24 @@ class AudioConverter:
 
         return tracks
 
+    def make_import_track_rows(self, tracks:list) -> list:
+        return [tuple(track[column] for column in TRACK_IMPORT_COLUMNS) for track in tracks]
+
     def make_sql_import_stmts(self, tracks:list)-> list:
-        stmts = []
-        for track in tracks:
-            ins_stmt = (f'Insert into Tracks (tracktitle,artistsearch,filepath,class,duration,year,'
-                        f'fadein,fadeout,fadedelay,intro,extro,folderid,onstartevent,onstopevent,'
-                        f'disablenotify,physicalstorageused,trackmediatype,artistID_1, old_filename)'
-                        f' VALUES ( '
-                        f'"{track["tracktitle"]}","{track["artistsearch"]}","{track["filepath"]}", '
-                        f'"{track["class"]}",{track["duration"]},{track["year"]},{track["fadein"]},{track["fadeout"]},'
-                        f'{track["fadedelay"]},{track["intro"]},{track["extro"]},{track["folderid"]},'
-                        f'{track["onstartevent"]},{track["onstopevent"]},{track["disablenotify"]},'
-                        f'{track["physicalstorageused"]},"{track["trackmediatype"]}",{track["artistID_1"]},"{track["old_filename"]}" );')
-
-            stmts.append(ins_stmt)
-
-        return stmts
+        rows = self.make_import_track_rows(tracks)
+        return [make_insert_stmt("Tracks", TRACK_IMPORT_COLUMNS, row) for row in rows]
+
+    def import_rows(self, inserts: list, name: str) ->bool:
+        # inserts is a list of (table, columns, rows). With import_mode=direct
+        # they are loaded into the database in one transaction, otherwise they
+        # are written as insert statements to {sql_folder}/{name}.sql
+        if self.import_mode == "direct":
+            row_count = sum(len(rows) for _, _, rows in inserts)
+            print(f"Importing {row_count} rows for `{name}` ...")
+            return self.mssql_con.bulk_insert(inserts, self.import_batch_size)
+
+        stmts = [make_insert_stmt(table, columns, row) for table, columns, rows in inserts for row in rows]
+        return self.write_sql_stmts(stmts, name)
 
     def write_sql_stmts(self, stmts:list, tree_name:str) ->bool:
         filename = f"{self.sql_folder}/{tree_name}.sql"
@@ -234,17 +488,58 @@ class AudioConverter:
         print("Renaming converted files")
 
         tracks = self.fetch_data(self.tracks_export_file)
-        for old_name, id in tracks.items():
-            new_name = f"{str(id).zfill(8)}.ogg"
-            print(f"Old name: {old_name} =>  New name: {new_name}")
-            try:
-                os.rename(f"{self.output_folder}/{old_name}", f"{self.converted_files_folder}/{new_name}")
-            except:
-                print(f"Failed to rename {old_name} to {new_name}")
+
+        scheduler = ConversionScheduler(self.placement_workers)
+        print(f"Moving {len(tracks)} files with {scheduler.workers} workers")
+        self.progress.set_total(len(tracks))
+
+        start = timer()
+        placed_bytes = 0
+        methods = {}
+        failed = []
+        for index, (old_name, id), result in scheduler.run(self.place_converted_file, tracks.items()):
+            if result is None:
+                failed.append(old_name)
+                self.progress.update(failed=True)
                 continue
 
+            method, size = result
+            self.progress.update(source_bytes=size)
+            methods[method] = methods.get(method, 0) + 1
+            placed_bytes += size
+
+        elapsed = timer() - start
+        placed = len(tracks) - len(failed)
+        megabytes = placed_bytes / (1024 * 1024)
 
-    def convert(self):
+        print(f"Files moved...................: {placed} {methods}")
+        print(f"Failed moves..................: {len(failed)}")
+        print(f"Time..........................: {timedelta(seconds=elapsed)}")
+        if elapsed > 0:
+            print(f"Throughput....................: {placed / elapsed:.1f} files/s, {megabytes / elapsed:.1f} MB/s")
+
+        if len(failed) > 0:
+            with open(f"{self.log_folder}/rename_failed.json", "w", encoding="utf-8") as f:
+                json.dump(failed, f, ensure_ascii=False, indent=4)
+
+    def place_converted_file(self, index: int, track: tuple) -> tuple:
+        # Runs on a scheduler worker, returns (method, bytes) or None
+        old_name, id = track
+        new_name = f"{str(id).zfill(8)}.ogg"
+        old_file = f"{self.output_folder}/{old_name}"
+        self.print_file(f"Old name: {old_name} =>  New name: {new_name}")
+
+        try:
+            size = os.path.getsize(old_file)
+            method = place_file(old_file, f"{self.converted_files_folder}/{new_name}", verify=self.placement_verify)
+        except OSError as e:
+            print(f"Failed to rename {old_name} to {new_name}: {e}")
+            return None
+
+        return method, size
+
+
+    def convert(self, workers=None):
         # Loop through a folder and read all files with extension .dbf
         print(f"Reading data from......: {self.dbf_folder}")
 
@@ -268,28 +563,40 @@ class AudioConverter:
             exclude_dbfs = [dbf.upper()+".DBF" for dbf in exclude_dbfs]
 
         for dbf in dbf_files:
-
             if dbf in exclude_dbfs:
                 print(f"Excluding.......: {dbf}")
-                continue
+
+        dbf_files = [dbf for dbf in dbf_files if dbf not in exclude_dbfs]
+        self.progress.set_total(sum(count_records(f"{self.dbf_folder}/{dbf}") for dbf in dbf_files))
+
+        for dbf in dbf_files:
 
             print(f"Reading data from.......: {dbf}")
-            data = get_data(self.dbf_folder,dbf, self.audio_folder)
+            dbf_path = f"{self.dbf_folder}/{dbf}"
+            records = self.metrics.timed_iter("dbf_read", iter_records(dbf_path, dbf, self.audio_folder),
+                                              dbf[:-4], os.path.getsize(dbf_path))
 
-            if len(data) == 0:
+            first_record = next(records, None)
+            if first_record is None:
                 continue
 
-            print(f"{len(data)} records found")
-
-            self.write_data(data, dbf)
+            # Records are converted as they are read from the DBF, the JSON
+            # snapshot is written as they pass through.
+            data = self.stream_data(itertools.chain([first_record], records), dbf)
 
             print(f"Converting audio files to ogg")
-            self.convert_audio(data, dbf)
+            self.convert_audio(data, dbf, workers)
+
+            # convert_audio stops early when the audio folder is missing,
+            # finish the snapshot anyway
+            for _ in data:
+                pass
 
+        self.write_duplicate_groups()
         self.print_summary()
     
 
-    def convert_audio(self, data: list, dbf: str):
+    def convert_audio(self, data, dbf: str, workers=None):
         # Convert audio files from MTS to ogg
         missing_files = []
         converted_files = []
@@ -307,111 +614,121 @@ class AudioConverter:
 
         mts_files = [f for f in os.listdir(dbf_folder) if f.endswith('.MTS')]
 
-        total_conversion_time = 0.0
-        total_converted_files = 0
+        # Check if output folder exists
+        if not os.path.exists(self.output_folder):
+            os.makedirs(self.output_folder)
 
-        for i, record in enumerate(data):
-            # Get .MTS file count in the audio folder
-
-            #input_file = f"{self.audio_folder}/{dbf}/{record['audio_file']}"
-            input_file = record['audio_file']
-
-            # Check if audio file exists
-            if not os.path.exists(f"{input_file}"):
-                missing_files.append(record)
-                print(f"Missing audio file: {input_file}  ... skipping")
-                continue
+        # Check if ffmpeg is installed
+        if not os.path.exists("ffmpeg.exe"):
+            raise Exception("ffmpeg is not installed")
 
-            file_in_bytes = 0
+        # Checking and prefetching sources runs on the I/O workers, ffmpeg
+        # on the conversion workers, see convert_mp3_pipeline
+        if workers is None:
+            workers, max_cpu = self.workers, max(self.workers, self.max_workers)
+        else:
+            workers = max_cpu = parse_workers(workers)
+        max_io = max(self.io_workers, self.max_io_workers)
+        print(f"Converting with {workers} workers, checking sources with {self.io_workers} workers")
+
+        manifest = self.get_manifest()
+        results = []
+
+        def fetch(item):
+            index, record = item
+            status, input_stat = self.check_record(record)
+            local_file = None
+            if status is None:
+                local_file = self.prefetch_source(record['audio_file'], input_stat, record['category'], "mts",
+                                                  scratch, manifest)
+            return index, record, status, input_stat, local_file
+
+        def transcode(item):
+            index, record, status, input_stat, local_file = item
             try:
-                # Get size in KB of input_file
-                file_in_bytes = os.path.getsize(input_file)
-            except OSError as e:
-                print(f"Failed to get size of {input_file}: {e}")
-                continue
-
-            input_file_size_kb = file_in_bytes / 1024
-
-            if input_file_size_kb == 0:
-                zero_bytes_files.append(record)
-                print(f"Zero bytes file: {input_file}  ... skipping")
-                continue
-
-            record["input_file_size_kb"] = input_file_size_kb
-
-            # Check if output folder exists
-            if not os.path.exists(self.output_folder):
-                os.makedirs(self.output_folder)
-
-            output_file = f"{record['category']}{record['code']}.ogg"
-            output_filepath = f"{self.output_folder}//{output_file}"
-
-            if self.keep_converted:
-                if os.path.exists(output_filepath):
-                    print(f"Output file already exists: {output_filepath}  ... skipping")
-                    continue
-
-            # Check if ffmpeg is installed
-            if not os.path.exists("ffmpeg.exe"):
-                raise Exception("ffmpeg is not installed")
+                if status is None:
+                    status = self.convert_record(index, record, input_stat, local_file)
+            finally:
+                if local_file is not None:
+                    scratch.release(local_file)
+            return index, record, status
+
+        def collect(item):
+            index, record, status = item
+            results.append(item)
+            self.progress.update(source_bytes=int(record.get("input_file_size_kb", 0) * 1024),
+                                 audio_seconds=record.get("duration_ms", 0) / 1000,
+                                 failed=status in ("failed", "missing", "size_error"))
+
+        wall_start = timer()
+
+        size = self.pipeline_queue_size
+        scratch = self.make_scratch()
+        pipeline = self.make_pipeline(enumerate(data),
+                                      [PipelineStage("fetch", fetch, self.io_workers, size, max_workers=max_io,
+                                                     blocked=scratch.waiting_fetches if scratch is not None else None),
+                                       PipelineStage("transcode", transcode, workers, size, max_workers=max_cpu),
+                                       PipelineStage("collect", collect, 1, size)],
+                                      source_name="dbf_read")
+        try:
+            stats = pipeline.run()
+        finally:
+            self.close_scratch(scratch)
 
-            conversion_msg = f"{i+1}.Converting: {input_file} ({input_file_size_kb:.2f} KB) => {output_filepath}"
-            print(conversion_msg, end="\r")
-            
-            audio_converted = False
+        wall_time = timedelta(seconds=timer() - wall_start)
+        self.write_pipeline_stats(f"{dbf}_pipeline_stats.json", stats)
 
-            start_time = timer()
+        # Jobs finish in any order, put them back in DBF order so the logs
+        # and artist ids come out the same as a sequential run.
+        results.sort(key=lambda result: result[0])
 
-            try:
-                os.system(f"ffmpeg -y -i {input_file} -nostats -loglevel 0 -c:a libvorbis -q:a 4 -vsync 2 {output_filepath}")
-                audio_converted = True
-            except:
-                failed_conversions.append(record)
-                continue
+        print(f"{len(results)} records found")
 
-            end_time = timer()
-            time_diff = timedelta(seconds=end_time - start_time)
-            print(f"{conversion_msg}... Done. Time: {time_diff}")
-
-            total_conversion_time += time_diff.total_seconds()
-            total_converted_files += 1
+        total_conversion_time = 0.0
+        total_cpu_time = 0.0
+        total_converted_files = 0
+        previously_converted_files = 0
+        deduplicated_files = 0
 
-            # Get size in KB of input_file
-            try:
-                output_file_size_kb = os.path.getsize(output_filepath) / 1024
-            except OSError as e:
-                print(f"Failed to get size of {output_filepath}: {e}")
+        for index, record, status in results:
+            if status == "missing":
+                missing_files.append(record)
+            elif status == "zero_bytes":
+                zero_bytes_files.append(record)
+            elif status == "failed":
                 failed_conversions.append(record)
-                continue
-
-            record["conversion_time"] = time_diff.total_seconds()
-            record["converted_filename"] = output_file
-            record["converted_file_size_kb"] = output_file_size_kb
+            elif status in ("converted", "failed_probe", "previously_converted", "deduplicated"):
+                if status == "previously_converted":
+                    previously_converted_files += 1
+                elif status == "deduplicated":
+                    deduplicated_files += 1
+                else:
+                    total_conversion_time += record["conversion_time"]
+                    total_cpu_time += record["cpu_time"]
+                    total_converted_files += 1
 
-            duration = 0
-            if audio_converted:
-                try:
-                    duration = self.probe_audio_duration(output_filepath)
-                except:
+                if status == "failed_probe":
                     failed_probes.append(record)
 
-            record["duration_ms"] = duration * 1000 # milliseconds
-            converted_files.append(record)
+                converted_files.append(record)
 
-            # check if the record 'artist' is in the artists dictionary if not add it
-            if record['artist'] not in self.artists:
-                self.artists[record['artist']] = len(self.artists)
+                # check if the record 'artist' is in the artists dictionary if not add it
+                if record['artist'] not in self.artists:
+                    self.artists[record['artist']] = len(self.artists)
+
+        total_time = timedelta(seconds=total_conversion_time)
 
         print("")
         print(f"...................[ {dbf} ]........................")
         print(f"Category Files Converted.........: {total_converted_files}")
+        print(f"Category Previously Converted....: {previously_converted_files}")
+        print(f"Category Deduplicated Files......: {deduplicated_files}")
 
         print(f"Category Missing Files...........: {len(missing_files)}")
 
         print(f"Category Zero Byte Files.........: {len(zero_bytes_files)}")
 
         # Print total conversion time as "hh:mm:ss" format
-        total_time = timedelta(seconds=total_conversion_time)
         print(f"Category conversion time.........: {total_time}")
 
         average_conversion_time = 0
@@ -423,6 +740,8 @@ class AudioConverter:
         average_conversion_time = timedelta(seconds=average_conversion_time)
 
         print(f"Average conversion time..........: {average_conversion_time}")
+        print(f"Category wall clock time.........: {wall_time}")
+        print(f"Category ffmpeg CPU time.........: {timedelta(seconds=total_cpu_time)}")
 
         print("................................................")
         print("")
@@ -431,16 +750,21 @@ class AudioConverter:
 
         log = {"category":dbf,
                 "dbf_file":dbf+".DBF",
-                "dbf_records":len(data),
+                "dbf_records":len(results),
                 "audio_files":len(mts_files),
                 "output_folder":self.output_folder,
                 "converted_files_count":len(converted_files),
+                "previously_converted_count":previously_converted_files,
+                "deduplicated_count":deduplicated_files,
                 "converted_files":converted_files,
                 "missing_files_count":len(missing_files),
                 "zero_bytes_files_count":len(zero_bytes_files),
                 "zero_bytes_files":zero_bytes_files,
                 "total_conversion_time":(dt0+total_time).strftime('%H:%M:%S'), 
                 "average_conversion_time":(dt0+average_conversion_time).strftime('%H:%M:%S'),
+                "wall_clock_time":(dt0+wall_time).strftime('%H:%M:%S'),
+                "total_cpu_time_seconds":total_cpu_time,
+                "workers":workers,
                 "failed_conversions":failed_conversions,
                 "failed_probes":failed_probes,
                 "missing_files":missing_files
@@ -452,11 +776,18 @@ class AudioConverter:
         self.total_failed_probes += len(failed_probes)
         self.total_missing_files += len(missing_files)
         self.total_zero_bytes_files += len(zero_bytes_files)
+        self.total_deduplicated_files += deduplicated_files
         self.total_conversion_time += total_time.total_seconds()
+        self.total_cpu_time += total_cpu_time
         self.total_conversion_time_str = (dt0+timedelta(seconds=self.total_conversion_time)).strftime('%H:%M:%S')
 
         conversion_log.append(log)
-        
+
+        with self.metrics.timed("json_write", dbf):
+            self.write_category_logs(dbf, converted_files, missing_files, zero_bytes_files, conversion_log)
+
+    def write_category_logs(self, dbf: str, converted_files: list, missing_files: list, zero_bytes_files: list,
+                            conversion_log: list):
         # Write converted files to a json file
         # Remove extension .DBF
         with open(f"{self.log_folder}/{dbf}_converted.json", "w") as f:
@@ -481,10 +812,254 @@ class AudioConverter:
             for artist, id in self.artists.items():
                 f.write(f"{id}|{artist}\n")
 
+    def check_record(self, record: dict) -> tuple:
+        # Runs on the I/O workers. Returns (status, stat) of the source of a
+        # record, the status is None when it is to be converted.
+        input_file = record['audio_file']
+
+        input_stat = self.stat_source(input_file, record['category'])
+        if input_stat is None:
+            # Check if audio file exists
+            if not os.path.exists(f"{input_file}"):
+                print(f"Missing audio file: {input_file}  ... skipping")
+                return "missing", None
+
+            print(f"Failed to get size of {input_file}")
+            return "size_error", None
+
+        input_file_size_kb = input_stat.st_size / 1024
+
+        if input_file_size_kb == 0:
+            print(f"Zero bytes file: {input_file}  ... skipping")
+            return "zero_bytes", input_stat
+
+        record["input_file_size_kb"] = input_file_size_kb
+        return None, input_stat
+
+    def convert_record(self, index: int, record: dict, input_stat: os.stat_result = None,
+                       local_file: str = None) -> str:
+        # Runs on a conversion worker, returns the outcome for the record.
+        # local_file is a prefetched copy of the source.
+        input_file = record['audio_file']
+
+        if input_stat is None:
+            status, input_stat = self.check_record(record)
+            if status is not None:
+                return status
+
+        output_file = f"{record['category']}{record['code']}.ogg"
+        output_filepath = f"{self.output_folder}//{output_file}"
+
+        source = self.claim_source(input_file, input_stat)
+        status = "failed"
+        try:
+            if source is not None and source.leader is not None and \
+                    self.place_duplicate_record(source, record, input_stat, output_file, output_filepath):
+                status = "deduplicated"
+            else:
+                status = self.transcode_record(index, record, input_file, input_stat, output_file, output_filepath,
+                                               local_file)
+        finally:
+            if source is not None:
+                converted = status in ("converted", "failed_probe", "previously_converted", "deduplicated")
+                self.source_index.finish(source, output_filepath if converted else None, record)
+
+        return status
+
+    def place_duplicate_record(self, source, record: dict, input_stat: os.stat_result, output_file: str,
+                               output_filepath: str) -> bool:
+        leader = self.place_duplicate(source, output_filepath)
+        if leader is None:
+            return False
+
+        for key in ("converted_file_size_kb", "duration_ms", "bitrate_kbps"):
+            if key in leader.details:
+                record[key] = leader.details[key]
+        record["conversion_time"] = 0
+        record["cpu_time"] = 0
+        record["converted_filename"] = output_file
+        record["duplicate_of"] = leader.path
+
+        self.get_manifest().mark_done("mts", source.path, input_stat, output_filepath, record.get("duration_ms", 0))
+        return True
+
+    def transcode_record(self, index: int, record: dict, input_file: str, input_stat: os.stat_result,
+                         output_file: str, output_filepath: str, local_file: str = None) -> str:
+        input_file_size_kb = record["input_file_size_kb"]
+        manifest = self.get_manifest()
+
+        if self.keep_converted:
+            entry = manifest.finished("mts", input_file, input_stat)
+            if entry is not None:
+                print(f"Output file already converted: {output_filepath}  ... skipping")
+                record["conversion_time"] = 0
+                record["cpu_time"] = 0
+                record["converted_filename"] = output_file
+                record["converted_file_size_kb"] = entry["output_size"] / 1024
+                record["duration_ms"] = entry["duration_ms"]
+                return "previously_converted"
+
+        conversion_msg = f"{index+1}.Converting: {input_file} ({input_file_size_kb:.2f} KB) => {output_filepath}"
+
+        result = self.transcode(local_file or input_file, output_filepath, record['category'], input_stat.st_size)
+        if not result.ok:
+            record.update(result.failure_details())
+            manifest.mark_failed("mts", input_file, input_stat, result.error_message())
+            print(f"{conversion_msg}... Failed: {result.error_message()}")
+            return "failed"
+
+        time_diff = timedelta(seconds=result.wall_time)
+        self.print_file(f"{conversion_msg}... Done. Time: {time_diff} CPU: {result.cpu_time:.2f}s")
+
+        # Get size in KB of output_file
+        try:
+            output_file_size_kb = self.converted_file_size(result, output_filepath) / 1024
+        except OSError as e:
+            print(f"Failed to get size of {output_filepath}: {e}")
+            return "failed"
+
+        record["conversion_time"] = time_diff.total_seconds()
+        record["cpu_time"] = result.cpu_time
+        record["converted_filename"] = output_file
+        record["converted_file_size_kb"] = output_file_size_kb
+        record["bitrate_kbps"] = result.bitrate
+
+        status = "converted"
+        duration = 0
+        try:
+            duration = self.converted_file_duration(result, output_filepath)
+        except:
+            status = "failed_probe"
+
+        record["duration_ms"] = duration * 1000 # milliseconds
+
+        if status == "converted":
+            manifest.mark_done("mts", input_file, input_stat, output_filepath, record["duration_ms"])
+
+        return status
+
+    def stat_source(self, input_file: str, category: str) -> os.stat_result:
+        # os.stat of a source file, None when it is missing or can't be read
+        with self.metrics.timed("source_check", category) as timing:
+            try:
+                return os.stat(input_file)
+            except OSError:
+                timing.ok = False
+                return None
+
+    def copy_matching_source(self, input_file: str, output_file: str, category: str, input_size: int,
+                             profile) -> tuple:
+        # Copies a source that is already what profile would encode to
+        # output_file. Returns (duration in ms, bytes), or None when the
+        # source has to be transcoded.
+        if not self.skip_matching_sources or not input_file.lower().endswith(OGG_EXTENSIONS):
+            return None
+
+        probe = probe_audio(input_file, self.ffmpeg_timeout)
+        if probe is None or not profile.accepts(probe):
+            return None
+
+        with self.metrics.timed("source_copy", category, input_size) as timing:
+            try:
+                place_file(input_file, output_file, move=False, link=False, verify=self.placement_verify)
+            except OSError as e:
+                timing.ok = False
+                print(f"Failed to copy {input_file} to {output_file}: {e}")
+                return None
+            timing.bytes_out = input_size
+
+        with self._skipped_lock:
+            self.total_skipped_transcodes += 1
+
+        try:
+            duration = float(probe.get("duration", 0))
+        except ValueError:
+            duration = 0.0
+
+        self.print_file(f"Source already matches profile {profile.name}: {input_file} => {output_file} (copied)")
+        return int(duration * 1000), input_size
+
+    def get_profile(self, key: str):
+        # Encoder profile for a DBF category or folder name
+        return self.profiles[self.profile_map.get(key, self.default_profile)]
+
+    def transcode(self, input_file: str, output_file: str, category: str, input_size: int = 0, profile=None):
+        # The profile is picked by category unless given
+        if profile is None:
+            profile = self.get_profile(category)
+
+        with self.metrics.timed("transcode", category, input_size) as timing:
+            result = run_ffmpeg(input_file, output_file, profile.codec_args(), timeout=self.ffmpeg_timeout)
+            timing.ok = result.ok
+            timing.bytes_out = result.output_size or 0
+
+        self.profile_stats.add(profile, result, input_size)
+        return result
+
+    def claim_source(self, input_file: str, input_stat: os.stat_result):
+        # None when dedup_sources=False
+        if self.source_index is None:
+            return None
+        return self.source_index.claim(input_file, input_stat.st_size)
+
+    def place_duplicate(self, source, output_filepath: str):
+        # Waits for the first copy of the source to be converted and links its
+        # output to output_filepath. Returns the first copy, or None when the
+        # source has to be converted after all.
+        leader = self.source_index.wait(source)
+        if leader is None:
+            print(f"Conversion of {source.leader.path} failed, converting duplicate: {source.path}")
+            return None
+
+        try:
+            method = place_file(leader.output, output_filepath, move=False, link=self.dedup_link)
+        except OSError as e:
+            print(f"Failed to place duplicate {output_filepath}: {e}")
+            return None
+
+        self.print_file(f"Duplicate of {leader.path}: {source.path} => {output_filepath} ({method})")
+        return leader
+
+    def write_duplicate_groups(self):
+        # Sources that were converted once for several copies, so the import
+        # can point their Tracks rows at one file
+        if self.source_index is None:
+            return
+
+        groups = self.source_index.duplicate_groups()
+        print(f"Duplicate source groups: {len(groups)}")
+        with open(f"{self.log_folder}/duplicates.json", "w", encoding="utf-8") as f:
+            json.dump(groups, f, ensure_ascii=False, indent=4)
+
+    def converted_file_duration(self, result, output_file: str) -> float:
+        # Duration in seconds reported by the ffmpeg run, ffprobe is only
+        # started when ffmpeg didn't report one
+        if result.duration is not None:
+            return result.duration
+        return self.probe_audio_duration(output_file)
+
+    def converted_file_size(self, result, output_file: str) -> int:
+        # Size in bytes reported by the ffmpeg run, falls back to the file system
+        if result.output_size is not None:
+            return result.output_size
+        return os.path.getsize(output_file)
+
     def probe_audio_duration(self, audio_file: str)-> float:
         # Get audio duration in seconds
-        result = run(["ffprobe", "-v", "quiet", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", audio_file], stdout=PIPE, stderr=PIPE)
-        return float(result.stdout.decode("utf-8"))
+        cache = self.get_probe_cache()
+        stat = os.stat(audio_file)
+        if cache is not None:
+            duration = cache.get("duration", audio_file, stat)
+            if duration is not None:
+                return duration
+
+        with self.metrics.timed("probe", "duration", stat.st_size):
+            result = run(["ffprobe", "-v", "quiet", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", audio_file], stdout=PIPE, stderr=PIPE)
+            duration = float(result.stdout.decode("utf-8"))
+
+        if cache is not None:
+            cache.put("duration", audio_file, stat, duration)
+        return duration
 
     def print_summary(self):
         print(f"Total MTS files...............: {self.total_mts_files}")
@@ -493,14 +1068,29 @@ class AudioConverter:
         print(f"Total failed probes...........: {self.total_failed_probes}")
         print(f"Total missing files...........: {self.total_missing_files}")
         print(f"Total zero bytes files........: {self.total_zero_bytes_files}")
+        print(f"Total deduplicated files......: {self.total_deduplicated_files}")
         print(f"Total conversion time.........: {self.total_conversion_time_str}")
+        print(f"Total ffmpeg CPU time.........: {timedelta(seconds=self.total_cpu_time)}")
 
-    def write_data(self, data: list, dbf: str):
-        # Write data to a json file, remove extension .DBF
+    def stream_data(self, data, dbf: str):
+        # Write records to the json file while passing them on, the file ends
+        # up the same as json.dump(records, f, indent=4) of the full list
         dbf = dbf[:-4]
         print(f"Writing data to: {self.dbf_folder}/{dbf}.json")
+        write_time = 0.0
         with open(f"{self.dbf_folder}/{dbf}.json", "w") as f:
-            json.dump(data, f, indent=4)
+            f.write("[")
+            count = 0
+            for record in data:
+                start = timer()
+                f.write(",\n" if count > 0 else "\n")
+                f.write(textwrap.indent(json.dumps(record, indent=4), "    "))
+                write_time += timer() - start
+                count += 1
+                yield record
+            f.write("\n]" if count > 0 else "]")
+            size = f.tell()
+        self.metrics.record("json_write", write_time, dbf, bytes_out=size)
 
 
     def list_audio_files(self):
@@ -517,74 +1107,65 @@ class AudioConverter:
               f'Where tracks.FolderID = Tree.NodeID '
               f'order by TrackReference ')
 
+        # Rows are pulled from the cursor a batch at a time and written out
+        # straight away, memory use doesn't depend on the size of Tracks.
+        filename = f"{self.log_folder}/audio_files_list.csv"
+        print(f"Writing audio files list to: {filename}")
+
         cursor = self.mssql_con.conn.cursor()
         cursor.execute(sql)
-        rows = cursor.fetchall()
 
-        trcks = []
+        records_read = 0
+        records_written = 0
 
-        for index, row in enumerate(rows):
-            track =  {}
+        with open(filename, "w", encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(AUDIO_FILES_LIST_COLUMNS)
 
-            print(f"Processing record {index+1} / {len(rows)}", end="\r")
+            while True:
+                rows = cursor.fetchmany(self.list_batch_size)
+                if not rows:
+                    break
 
-            filepath = row[0]
-            track_reference = row[1]
-            track_title = row[2]
-            artist_search = row[3]
-            node_name = row[4]
-            duration = row[5]
-            ogg_filename = f"{str(track_reference).zfill(8)}.ogg"
-            ogg_filepath = f"{filepath}{ogg_filename}"
+                for row in rows:
+                    track = self.make_audio_list_row(row)
+                    if track is None:
+                        continue
+                    writer.writerow(track)
+                    records_written += 1
 
-            # Generate hash of track_reference + track_title + artist_search
-            if track_title is None:
-                continue
-            if artist_search is None:
-                continue
-            unique_id = hashlib.sha256(str(track_reference).encode() + track_title.encode()).hexdigest()[0:24]
-
-            # Create hash of ogg_filepath
-            song_id = hashlib.sha256(ogg_filename.encode()).hexdigest()[0:32]
-
-            track["unique_id"] = unique_id
-            track["song_id"] = song_id
-            track["path"] = ogg_filepath
-            track["title"] = track_title
-            track["artist"] = artist_search
-            track["album"] = ""
-            track["genre"] = node_name
-            track["lyrics"] = ""
-            track["isrc"] = ""
-            track["playlist"] = "default"
-            track["length"] = duration
-            track["amplify"] = ""
-            track["fade_in"] = ""
-            track["fade_out"] = ""
-            track["cue_in"] = ""
-            track["cue_out"] = ""
-            track["cross_start_next"] = ""
-
-            trcks.append(track)
+                records_read += len(rows)
+                self.progress.update(files=len(rows))
 
-        self.mssql_con.disconnect()
+        cursor.close()
 
-        # Write data to a csv file
-        filename = f"{self.log_folder}/audio_files_list.csv"
-        print(f"Writing audio files list to: {filename}")
-        with open(filename, "w", encoding='utf-8') as f:
-            # Write header
-            f.write("unique_id,song_id,path,title,artist,album,genre,lyrics,isrc,playlist,length,amplify,fade_in,fade_out,cue_in,cue_out,cross_start_next\n")
-            for track in trcks:
-                f.write(f"{track['unique_id']},{track['song_id']},"
-                f"{track['path']},{track['title']},{track['artist']},"
-                f"{track['album']},{track['genre']},{track['lyrics']},"
-                f"{track['isrc']},{track['playlist']},{track['length']},"
-                f"{track['amplify']},{track['fade_in']},{track['fade_out']},"
-                f"{track['cue_in']},{track['cue_out']},{track['cross_start_next']}\n")
-            
+        print(f"Processed {records_read} records, {records_written} written")
         print("Audio files listing done.")
 
+    def make_audio_list_row(self, row) -> list:
+        filepath = row[0]
+        track_reference = row[1]
+        track_title = row[2]
+        artist_search = row[3]
+        node_name = row[4]
+        duration = row[5]
+        ogg_filename = f"{str(track_reference).zfill(8)}.ogg"
+        ogg_filepath = f"{filepath}{ogg_filename}"
+
+        # Generate hash of track_reference + track_title + artist_search
+        if track_title is None:
+            return None
+        if artist_search is None:
+            return None
+        unique_id = hashlib.sha256(str(track_reference).encode() + track_title.encode()).hexdigest()[0:24]
+
+        # Create hash of ogg_filepath
+        song_id = hashlib.sha256(ogg_filename.encode()).hexdigest()[0:32]
+
+        # Same order as AUDIO_FILES_LIST_COLUMNS
+        return [unique_id, song_id, ogg_filepath, track_title, artist_search, "", node_name,
+                "", "", "default", duration, "", "", "", "", "", ""]
+
     def convert_mp3_to_ogg(self):
         if not os.path.exists("ffmpeg.exe"):
             raise Exception("ffmpeg is not installed")
@@ -592,34 +1173,22 @@ class AudioConverter:
         self.artists = self.read_artists_from_db()
         self.folders = self.read_track_folders_from_db()
 
-        mp3_folders = [dir for dir in os.listdir(f"{self.audio_folder}")
-                        if os.path.isdir(os.path.join(self.audio_folder, dir))]
-
         audio_folders = {}
 
-        include_folders = self.include_folders.split(",")
-
-        for mp3_folder in mp3_folders:
-
-            short_folder_name =  mp3_folder[:mp3_folder.index("-")].strip()
-            if len(include_folders) > 0:
-                if short_folder_name not in include_folders:
-                    continue
-
-            folder_id = self.folders[short_folder_name]
-            filepath = f"{self.audio_folder}/{mp3_folder}"
-
-            folder = {'folder_id': folder_id,
-                    'folder_short_name': short_folder_name,
-                    'filepath': filepath}
+        for folder in self.get_mp3_folders():
+            short_folder_name = folder['folder_short_name']
 
             mp3_files = self.read_mp3_audio_files(folder)
 
             audio_folders[short_folder_name] = mp3_files
 
+        self.progress.set_total(sum(len(files) for files in audio_folders.values()))
+
         max_track_id = self.get_max_track_id()
         print(f"Current Max Track ID....: {max_track_id}")
 
+        manifest = self.get_manifest()
+
         counter = 0
 
         for folder, files in audio_folders.items():
@@ -631,41 +1200,21 @@ class AudioConverter:
             converted_files = []
 
             for file in files:
-
-                output_filepath =  self.make_output_filename(file)
-                file['output_filepath'] = output_filepath
-
-                # Check file size
-                mp3_file = file['full_filepath']
-                if self.get_file_size(mp3_file) == 0:
-                    print(f"Zero bytes file: {mp3_file} ...Skipping.")
-                    continue
-
-                if self.keep_converted:
-                    if os.path.exists(output_filepath):
-                        print(f"Output file already exists: {output_filepath}  ... skipping")
-                        continue
-
-                if self.mp3_to_ogg(file):
+                if self.convert_mp3_file(file, manifest):
                     converted_files.append(file)
-                else:
-                    self.failed_conversions.append(file)
-        
+                self.count_mp3_file(file)
+
             for converted_file in converted_files:
                 max_track_id += 1
-                filepath = self.output_folder  
-
-                output_filepath = converted_file['output_filepath']
-                ogg_filepath = self.make_ogg_filepath(filepath, max_track_id)
-
-                if not self.rename_converted_file_to_ogg(output_filepath, ogg_filepath):
-                    print(f"Failed to rename {output_filepath} to {ogg_filepath}")
-                    converted_file['ogg_filepath'] =""
+                if not self.rename_converted_mp3(converted_file, max_track_id, manifest):
                     max_track_id -= 1
-                    converted_file['track_id'] = -1
-                else:
-                    converted_file['ogg_filepath'] = ogg_filepath
-                    converted_file['track_id'] = max_track_id
+
+            if self.import_mode == "direct":
+                if not self.import_folder(folder, converted_files):
+                    print(f"Failed to import Artists and Tracks for folder: {folder}")
+                    print(f"Process terminated.")
+                    return
+                continue
 
             if not self.write_artists_insert_stmts_to_file(folder, counter):
                 print(f"Failed to write Artists insert statements for folder: {folder} ")
@@ -680,6 +1229,286 @@ class AudioConverter:
         print(f"File conversion done.")
         print(f"Last folder: {folder}")
 
+        print(f"Failed conversions: {len(self.failed_conversions)}")
+        print(f"Skipped transcodes (source already matches profile): {self.total_skipped_transcodes}")
+        if len(self.failed_conversions) > 0:
+            with open(f"{self.log_folder}/mp3_failed_conversions.json", "w", encoding="utf-8") as f:
+                json.dump(self.failed_conversions, f, ensure_ascii=False, indent=4)
+
+    def convert_mp3_pipeline(self):
+        # Same result as convert_mp3_to_ogg, but the folders are listed,
+        # probed, converted, renamed and imported at the same time instead of
+        # one step after the other. Artist and track ids are handed out by
+        # single worker stages in the order the files were listed, whichever
+        # worker finishes first, so a re-run numbers them the same way. Tracks
+        # and new artists are imported in batches of import_batch_size.
+        if not os.path.exists("ffmpeg.exe"):
+            raise Exception("ffmpeg is not installed")
+
+        self.artists = self.read_artists_from_db()
+        self.folders = self.read_track_folders_from_db()
+
+        max_track_id = self.get_max_track_id()
+        print(f"Current Max Track ID....: {max_track_id}")
+
+        manifest = self.get_manifest()
+        next_track_id = max_track_id + 1
+        batch = []
+        batch_counter = itertools.count(1)
+
+        # Items carry their sequence number up to the stage that reorders
+        # them, so the workers in between pass failures on as None instead
+        # of dropping them
+        probed = SequenceBuffer()
+        converted = SequenceBuffer()
+        file_numbers = itertools.count()
+
+        def probe(source):
+            number, (folder, mp3_file) = source
+            try:
+                tags = self.read_mp3_tags(f"{folder['filepath']}/{mp3_file}", folder['folder_short_name'])
+            except Exception as e:
+                print(f"Failed to probe {folder['filepath']}/{mp3_file}: {e}")
+                tags = None
+            return number, (folder, mp3_file, tags)
+
+        def add_artists(probe_result):
+            files = []
+            for folder, mp3_file, tags in probed.add(*probe_result):
+                if tags is None:
+                    continue
+                with self._artists_lock:
+                    file = self.make_mp3_file_data(folder, mp3_file, tags)
+                if file is not None:
+                    files.append((next(file_numbers), file))
+            return files
+
+        def fetch(numbered_file):
+            number, file = numbered_file
+            try:
+                mp3_stat, local_file = self.fetch_source(file['full_filepath'], file['folder_short_name'], "mp3",
+                                                         scratch, manifest)
+            except Exception as e:
+                print(f"Failed to fetch {file['full_filepath']}: {e}")
+                mp3_stat, local_file = None, None
+            return number, file, mp3_stat, local_file
+
+        def transcode(fetched):
+            number, file, mp3_stat, local_file = fetched
+            try:
+                converted_file = self.convert_mp3_file(file, manifest, mp3_stat, local_file)
+            except Exception as e:
+                print(f"Failed to convert {file['full_filepath']}: {e}")
+                converted_file = False
+            finally:
+                if local_file is not None:
+                    scratch.release(local_file)
+            self.count_mp3_file(file)
+            return number, file if converted_file else None
+
+        def rename(transcode_result):
+            nonlocal next_track_id
+            files = []
+            for file in converted.add(*transcode_result):
+                if file is None or not self.rename_converted_mp3(file, next_track_id, manifest):
+                    continue
+                next_track_id += 1
+                files.append(file)
+            return files
+
+        def add_track(file):
+            batch.append(file)
+            if len(batch) >= self.import_batch_size:
+                import_batch()
+            return file
+
+        def import_batch():
+            if len(batch) == 0:
+                return
+            name = f"mp3_pipeline_{next(batch_counter)}"
+            try:
+                imported = self.import_folder(name, batch)
+            finally:
+                batch.clear()
+
+            if not imported:
+                print(f"Failed to import Artists and Tracks for: {name}")
+                print(f"Process terminated.")
+                pipeline.stop()
+                if scratch is not None:
+                    scratch.close()     # Wakes up fetches waiting for room
+
+        size = self.pipeline_queue_size
+        max_io = max(self.io_workers, self.probe_workers, self.max_io_workers)
+        max_cpu = max(self.workers, self.max_workers)
+        scratch = self.make_scratch()
+        pipeline = self.make_pipeline(enumerate(self.counted(self.iter_mp3_sources())),
+                                      [PipelineStage("probe", probe, self.probe_workers, size, max_workers=max_io),
+                                       PipelineStage("artists", add_artists, 1, size, many=True),
+                                       PipelineStage("fetch", fetch, self.io_workers, size, max_workers=max_io,
+                                                     blocked=scratch.waiting_fetches if scratch is not None else None),
+                                       PipelineStage("transcode", transcode, self.workers, size, max_workers=max_cpu),
+                                       PipelineStage("rename", rename, 1, size, many=True),
+                                       PipelineStage("import", add_track, 1, size, finish=import_batch)])
+        try:
+            stats = pipeline.run()
+        finally:
+            self.close_scratch(scratch)
+
+        print(f"File conversion done.")
+        self.write_pipeline_stats("mp3_pipeline_stats.json", stats)
+
+        print(f"Failed conversions: {len(self.failed_conversions)}")
+        print(f"Skipped transcodes (source already matches profile): {self.total_skipped_transcodes}")
+        if len(self.failed_conversions) > 0:
+            with open(f"{self.log_folder}/mp3_failed_conversions.json", "w", encoding="utf-8") as f:
+                json.dump(self.failed_conversions, f, ensure_ascii=False, indent=4)
+
+    def iter_mp3_sources(self):
+        # (folder, mp3 filename) of every file convert_mp3_to_ogg would probe
+        for folder in self.get_mp3_folders():
+            print(f"Reading folder: {folder['filepath']}")
+            for mp3_file in os.listdir(folder['filepath']):
+                if self.is_source_file(mp3_file):
+                    yield folder, mp3_file
+
+    def make_pipeline(self, source, stages: list, source_name: str = "discovery") -> Pipeline:
+        return Pipeline(source, stages, source_name=source_name,
+                        report_interval=self.pipeline_report_interval,
+                        autotune_interval=self.autotune_interval if self.autotune_workers else 0.0,
+                        autotune_wait=self.autotune_wait)
+
+    def make_scratch(self) -> ScratchSpace:
+        # None when prefetch_sources=False
+        if not self.prefetch_sources:
+            return None
+        return ScratchSpace(self.scratch_folder, self.scratch_size)
+
+    def close_scratch(self, scratch: ScratchSpace):
+        if scratch is None:
+            return
+        scratch.close()
+        if scratch.fetched > 0:
+            print(f"Prefetched {scratch.fetched} network sources ({scratch.fetched_bytes / (1024 * 1024):.1f} MB) "
+                  f"to: {self.scratch_folder}")
+
+    def fetch_source(self, input_file: str, category: str, kind: str, scratch: ScratchSpace,
+                     manifest: ConversionManifest) -> tuple:
+        # Runs on the I/O workers. Returns (stat, local copy) of a source, the
+        # local copy is None unless the source is on a network share and
+        # still has to be converted, the stat is None when it can't be read.
+        input_stat = self.stat_source(input_file, category)
+        return input_stat, self.prefetch_source(input_file, input_stat, category, kind, scratch, manifest)
+
+    def prefetch_source(self, input_file: str, input_stat: os.stat_result, category: str, kind: str,
+                        scratch: ScratchSpace, manifest: ConversionManifest) -> str:
+        # Path of the local copy of a source, or None when it is used in place
+        if input_stat is None or input_stat.st_size == 0 or scratch is None:
+            return None
+        if not is_network_path(input_file, self.network_roots):
+            return None
+        if self.keep_converted and manifest.finished(kind, input_file, input_stat) is not None:
+            return None
+
+        with self.metrics.timed("prefetch", category, input_stat.st_size) as timing:
+            try:
+                local_file = scratch.fetch(input_file, input_stat.st_size)
+            except OSError as e:
+                timing.ok = False
+                print(f"Failed to prefetch {input_file}: {e}")
+                return None
+            timing.bytes_out = input_stat.st_size
+        return local_file
+
+    def write_pipeline_stats(self, filename: str, stats: list):
+        with open(f"{self.log_folder}/{filename}", "w", encoding="utf-8") as f:
+            json.dump(stats, f, ensure_ascii=False, indent=4)
+
+    def get_mp3_folders(self) -> list:
+        # The mp3 folders of audio_folder listed in include_folders
+        mp3_folders = [dir for dir in os.listdir(f"{self.audio_folder}")
+                        if os.path.isdir(os.path.join(self.audio_folder, dir))]
+
+        include_folders = self.include_folders.split(",")
+
+        folders = []
+        for mp3_folder in mp3_folders:
+
+            short_folder_name =  mp3_folder[:mp3_folder.index("-")].strip()
+            if len(include_folders) > 0:
+                if short_folder_name not in include_folders:
+                    continue
+
+            folder_id = self.folders[short_folder_name]
+            filepath = f"{self.audio_folder}/{mp3_folder}"
+
+            folders.append({'folder_id': folder_id,
+                            'folder_short_name': short_folder_name,
+                            'filepath': filepath})
+        return folders
+
+    def convert_mp3_file(self, file: dict, manifest: ConversionManifest, mp3_stat: os.stat_result = None,
+                         local_file: str = None) -> bool:
+        # Returns True when the file has an output waiting to be renamed to
+        # its track id. local_file is a prefetched copy of the source.
+        output_filepath =  self.make_output_filename(file)
+        file['output_filepath'] = output_filepath
+
+        # Check file size
+        mp3_file = file['full_filepath']
+        if mp3_stat is None:
+            mp3_stat = self.stat_source(mp3_file, file['folder_short_name'])
+        if mp3_stat is None:
+            print(f"Failed to get size of {mp3_file}")
+            return False
+        file['input_size'] = mp3_stat.st_size
+
+        if mp3_stat.st_size == 0:
+            print(f"Zero bytes file: {mp3_file} ...Skipping.")
+            return False
+
+        if self.keep_converted:
+            entry = manifest.finished("mp3", mp3_file, mp3_stat)
+            if entry is not None:
+                if entry['output_path'] == output_filepath:
+                    # Converted by a run that stopped before renaming it to a track id
+                    file['duration'] = int(entry['duration_ms'])
+                    file['converted_file_size_kb'] = entry['output_size'] / 1024
+                    return True
+
+                print(f"Output file already converted: {entry['output_path']}  ... skipping")
+                return False
+
+        if self.mp3_to_ogg(file, mp3_stat.st_size, local_file):
+            manifest.mark_done("mp3", mp3_file, mp3_stat, output_filepath, file.get('duration', 0))
+            return True
+
+        manifest.mark_failed("mp3", mp3_file, mp3_stat, file.get('ffmpeg_error', ''))
+        self.failed_conversions.append(file)
+        return False
+
+    def count_mp3_file(self, file: dict):
+        # Files without a converted size failed or were skipped
+        converted = 'converted_file_size_kb' in file
+        self.progress.update(source_bytes=file.get('input_size', 0),
+                             audio_seconds=file.get('duration', 0) / 1000 if converted else 0,
+                             failed='ffmpeg_error' in file)
+
+    def rename_converted_mp3(self, converted_file: dict, track_id: int, manifest: ConversionManifest) -> bool:
+        output_filepath = converted_file['output_filepath']
+        ogg_filepath = self.make_ogg_filepath(self.output_folder, track_id)
+
+        if not self.rename_converted_file_to_ogg(output_filepath, ogg_filepath):
+            print(f"Failed to rename {output_filepath} to {ogg_filepath}")
+            converted_file['ogg_filepath'] =""
+            converted_file['track_id'] = -1
+            return False
+
+        converted_file['ogg_filepath'] = ogg_filepath
+        converted_file['track_id'] = track_id
+        manifest.update_output("mp3", converted_file['full_filepath'], ogg_filepath)
+        return True
+
     def write_tracks_insert_stmts_to_file(self, folder: str, converted_files:dict) ->bool:
         # Generated SQL insert statements
         conv_files = [cf for cf in converted_files if cf['ogg_filepath'] != ""]
@@ -692,12 +1521,7 @@ class AudioConverter:
 
 
     def write_artists_insert_stmts_to_file(self, folder:str, counter: int):
-        new_artists = []
-
-        for artist_name, data in self.artists.items():
-            if data['in_db']:
-                continue
-            new_artists.append({'id': data['id'], 'name':artist_name})
+        new_artists = self.get_new_artists()
 
         print(f"Generating DB statements for artists ...")
         sql_stmts = self.generate_artists_insert_stmts(new_artists)
@@ -706,59 +1530,111 @@ class AudioConverter:
         print(f"Writting `{filename}` file ...")
         return self.write_sql_stmts(sql_stmts, filename)
 
+    def import_folder(self, folder: str, converted_files: list) ->bool:
+        # Load the new artists and the folder's tracks in one transaction
+        new_artists = self.get_new_artists()
+        conv_files = [cf for cf in converted_files if cf['ogg_filepath'] != ""]
+
+        inserts = [("Artists", ARTIST_COLUMNS, self.make_artist_rows(new_artists)),
+                   ("Tracks", MP3_TRACK_COLUMNS, self.make_track_rows(conv_files))]
 
-    def generate_insert_statements(self, conv_files: list):
+        if not self.import_rows(inserts, folder):
+            return False
+
+        for artist in new_artists:
+            self.artists[artist['name']]['in_db'] = True
+
+        return True
+
+    def get_new_artists(self) -> list:
+        new_artists = []
+
+        with self._artists_lock:
+            for artist_name, data in self.artists.items():
+                if data['in_db']:
+                    continue
+                new_artists.append({'id': data['id'], 'name':artist_name})
+
+        return new_artists
+
+    def make_track_rows(self, conv_files: list) -> list:
         audio_folder = fr"{self.get_audio_folder()}"
 
         audio_folder = audio_folder.replace("\\\\", "\\")
 
-        stmts = []
+        rows = []
         for cf in conv_files:
 
             if cf['track_id'] == -1:
                 continue
 
-            print(cf)
+            self.print_file(str(cf))
 
-            file_size = self.get_file_size(cf['ogg_filepath'])
+            file_size = cf.get('converted_file_size_kb')
+            if file_size is None:
+                file_size = self.get_file_size(cf['ogg_filepath'])
 
-            ins_stmt = (f'Insert into Tracks (trackreference, tracktitle,artistsearch,filepath,class,duration,year,'
-                        f'fadein,fadeout,fadedelay,intro,extro,folderid,onstartevent,onstopevent,'
-                        f'disablenotify,physicalstorageused,trackmediatype,artistID_1)'
-                        f' VALUES ( '
-                        f'{cf["track_id"]},"{cf["title"]}","{cf["artist"]}","{audio_folder}", '
-                        f'"SONG",{cf["duration"]},2025,0,0,0,0,0,{cf["folder_id"]},-1,-1,0,'
-                        f'{file_size},"AUDIO",{cf["artist_id"]});')
+            rows.append((cf["track_id"], cf["title"], cf["artist"], audio_folder, "SONG", cf["duration"],
+                         2025, 0, 0, 0, 0, 0, cf["folder_id"], -1, -1, 0, file_size, "AUDIO", cf["artist_id"]))
+        return rows
 
-            stmts.append(ins_stmt)
-        return stmts
+    def generate_insert_statements(self, conv_files: list):
+        rows = self.make_track_rows(conv_files)
+        return [make_insert_stmt("Tracks", MP3_TRACK_COLUMNS, row) for row in rows]
 
+    def make_artist_rows(self, artists: list) -> list:
+        return [(artist["id"], artist["name"], "GROUP") for artist in artists]
 
     def generate_artists_insert_stmts(self, artists: list) -> list:
-        stmts = []
-        for artist in artists:
-            stmt = (f'Insert into Artists (ArtistID, ArtistSurname, ArtistType) '
-                         f'VALUES ({artist["id"]}, "{artist["name"]}", "GROUP" );')
+        rows = self.make_artist_rows(artists)
+        return [make_insert_stmt("Artists", ARTIST_COLUMNS, row) for row in rows]
 
-            stmts.append(stmt)
-
-        return stmts
-
-    def mp3_to_ogg(self, file) ->bool:
+    def mp3_to_ogg(self, file, input_size: int = 0, local_file: str = None) ->bool:
         input_filepath = file['full_filepath']
         output_filepath = file['output_filepath']
-
-        print(f"Converting file...: {input_filepath} => {output_filepath}")
-        try:
-            os.system(f'ffmpeg -y -i "{input_filepath}" -nostats -loglevel 0 -c:a libvorbis -q:a 4 -vsync 2 "{output_filepath}"')
+        source = local_file if local_file is not None else input_filepath
+
+        category = file.get('folder_short_name', "")
+        copied = self.copy_matching_source(source, output_filepath, category, input_size,
+                                           self.get_profile(category))
+        if copied is not None:
+            file['duration'], size = copied
+            file['converted_file_size_kb'] = size / 1024
+            file['conversion_time'] = 0
+            file['cpu_time'] = 0
+            file['transcode_skipped'] = True
             return True
-        except:
+
+        self.print_file(f"Converting file...: {input_filepath} => {output_filepath}")
+        result = self.transcode(source, output_filepath, category, input_size)
+        if not result.ok:
+            file.update(result.failure_details())
+            print(f"Failed to convert: {input_filepath}: {result.error_message()}")
             return False
 
+        file['conversion_time'] = result.wall_time
+        file['cpu_time'] = result.cpu_time
+
+        # Keep the duration ffmpeg measured on the output, the tag from the
+        # mp3 probe is only an estimate for VBR files
+        if result.duration is not None:
+            file['duration'] = int(result.duration * 1000)
+
+        try:
+            file['converted_file_size_kb'] = self.converted_file_size(result, output_filepath) / 1024
+        except OSError as e:
+            print(f"Failed to get size of {output_filepath}: {e}")
+
+        return True
+
     def make_output_filename(self, file: dict) ->str:
+        # Folders are converted at the same time in --pipeline, the folder id
+        # keeps e.g. A/Intro.mp3 and B/Intro.mp3 apart until they are renamed
+        # to their track ids. The source extension stays in the name so x.mp3
+        # and x.ogg of one folder don't share an output either.
         mp3_filename = file['mp3_filename']
-        filepath = self.output_folder   
-        return f"{filepath}/{mp3_filename[:-4]}.OGG"
+        filepath = self.output_folder
+        return f"{filepath}/{file['folder_id']}-{mp3_filename}.OGG"
 
     def make_ogg_filepath(self, filepath:str, track_id:int) ->str:
         ogg_filename = f"{str(track_id).zfill(8)}.ogg"
@@ -767,41 +1643,32 @@ class AudioConverter:
 
     def rename_converted_file_to_ogg(self, old_file: str, new_file:str) ->bool:
         try:
-            os.rename(old_file, new_file)
+            place_file(old_file, new_file, verify=self.placement_verify)
             return True
-        except:
-            print(f"Failed to rename {old_file} to {new_file}")
+        except OSError as e:
+            print(f"Failed to rename {old_file} to {new_file}: {e}")
             return False
 
     def get_max_track_id(self):
-        if not self.mssql_con.connect():
-            print("Failed to connect to database")
+        rows = self.mssql_con.execute_query("SELECT max(TrackReference) max_id FROM Tracks")
+        if rows is None:
+            print("Failed to read max track id from database")
             return
-        cursor = self.mssql_con.conn.cursor()
-        cursor.execute("SELECT max(TrackReference) max_id FROM Tracks")
-        rows = cursor.fetchall()
 
         for row in rows:
             max_id = row[0]
 
-        self.mssql_con.disconnect()
-
         return max_id
 
     def get_max_artist_id(self):
-        if not self.mssql_con.connect():
-            print("Failed to connect to database")
+        rows = self.mssql_con.execute_query("SELECT max(ArtistID) max_id FROM Artists")
+        if rows is None:
+            print("Failed to read max artist id from database")
             return
 
-        cursor = self.mssql_con.conn.cursor()
-        cursor.execute("SELECT max(ArtistID) max_id FROM Artists")
-        rows = cursor.fetchall()
-
         for row in rows:
             max_id = row[0]
 
-        self.mssql_con.disconnect()
-
         return max_id
 
 
@@ -820,14 +1687,11 @@ class AudioConverter:
 
     def read_artists_from_db(self) ->dict:
         # Read artists from the database
-        if not self.mssql_con.connect():
-            print("Failed to connect to database")
+        rows = self.mssql_con.execute_query("SELECT ArtistID, ArtistSurname FROM Artists")
+        if rows is None:
+            print("Failed to read artists from database")
             return
 
-        cursor = self.mssql_con.conn.cursor()
-        cursor.execute("SELECT ArtistID, ArtistSurname FROM Artists")
-        rows = cursor.fetchall()
-
         ARTIST_ID = 0
         ARTIST_NAME = 1
 
@@ -835,21 +1699,16 @@ class AudioConverter:
         for row in rows:
             artists[row[ARTIST_NAME]] = {'id':row[ARTIST_ID], 'in_db':True}
 
-        self.mssql_con.disconnect()
-
         return artists
 
 
     def read_track_folders_from_db(self) ->dict:
         # Read tree from the database
-        if not self.mssql_con.connect():
-            print("Failed to connect to database")
+        rows = self.mssql_con.execute_query("SELECT NodeID, NodeName FROM Tree")
+        if rows is None:
+            print("Failed to read track folders from database")
             return
 
-        cursor = self.mssql_con.conn.cursor()
-        cursor.execute("SELECT NodeID, NodeName FROM Tree")
-        rows = cursor.fetchall()
-
         NODE_ID = 0
         NODE_NAME = 1
 
@@ -857,120 +1716,154 @@ class AudioConverter:
         for row in rows:
             folders[row[NODE_NAME]] = row[NODE_ID]  
 
-        self.mssql_con.disconnect()
-
         return folders
     
     def get_audio_folder(self):
-        if not self.mssql_con.connect():
-            print("Failed to connect to database")
-            return
+        # DefRecordLocation doesn't change during a run, read it once
+        if self.audio_location is not None:
+            return self.audio_location
 
-        cursor = self.mssql_con.conn.cursor()
-        cursor.execute("SELECT DefRecordLocation FROM System")
-        rows = cursor.fetchall()
+        rows = self.mssql_con.execute_query("SELECT DefRecordLocation FROM System")
+        if rows is None:
+            print("Failed to read audio folder from database")
+            return
 
         audio_location = ""
 
         for row in rows:
             audio_location = row[0]
 
-        self.mssql_con.disconnect()
+        self.audio_location = audio_location
 
         return audio_location
 
 
     def read_mp3_audio_files(self, mp3_folder:str) ->list:
-        folder_id = mp3_folder['folder_id']
         filepath = mp3_folder['filepath']
-        folder_short_name = mp3_folder['folder_short_name']
 
-        mp3_raw_files = [f for f in os.listdir(filepath) if f.endswith('.mp3')]
+        mp3_raw_files = [f for f in os.listdir(filepath) if self.is_source_file(f)]
 
-        data_files = []
+        print(f"Probing {len(mp3_raw_files)} files in: {filepath}")
 
-        for mp3_file in mp3_raw_files:
-            full_filepath = f"{filepath}/{mp3_file}"
+        # ffprobe runs on several workers at once. Artist ids are handed out
+        # afterwards in directory order so they don't depend on which probe
+        # finished first.
+        scheduler = ConversionScheduler(self.probe_workers)
+        category = mp3_folder['folder_short_name']
+        results = list(scheduler.run(lambda index, mp3_file: self.read_mp3_tags(f"{filepath}/{mp3_file}", category),
+                                     mp3_raw_files))
+        results.sort(key=lambda result: result[0])
 
-            print(f"Probing file: {full_filepath}")
-
-            data = self.probe_mp3_file(full_filepath)
+        data_files = []
 
-            if len(data) == 0:
+        for index, mp3_file, tags in results:
+            if tags is None:
                 continue
 
-            if not "title" in data.keys():
-                # Get title from the filename
-                data['title'] = mp3_file[:-4]
-                #continue
-
-            if not "artist" in data.keys():
+            data = self.make_mp3_file_data(mp3_folder, mp3_file, tags)
+            if data is None:
                 continue
 
-            data['folder_id'] = folder_id
-            data['folder_short_name'] = folder_short_name
-            data['mp3_filename'] = mp3_file
-            data['filepath'] = filepath
-            data['full_filepath'] = full_filepath
-
             data_files.append(data)
         
         return data_files
 
+    def make_mp3_file_data(self, mp3_folder: dict, mp3_file: str, tags: dict) -> dict:
+        filepath = mp3_folder['filepath']
+        full_filepath = f"{filepath}/{mp3_file}"
+
+        data = self.add_artist_id(tags, full_filepath)
+
+        if not "title" in data.keys():
+            # Get title from the filename
+            data['title'] = self.strip_source_extension(mp3_file)
+            #continue
+
+        if not "artist" in data.keys():
+            return None
+
+        data['folder_id'] = mp3_folder['folder_id']
+        data['folder_short_name'] = mp3_folder['folder_short_name']
+        data['mp3_filename'] = mp3_file
+        data['filepath'] = filepath
+        data['full_filepath'] = full_filepath
+        return data
+
 
     def probe_mp3_file(self, filepath) -> dict:
+        data = self.read_mp3_tags(filepath)
+        if data is None:
+            return None
 
-        if not os.path.exists(filepath):
-            return
+        return self.add_artist_id(data, filepath)
 
+    def read_mp3_tags(self, filepath, category: str = "") -> dict:
+        # Title, artist and duration (ms) of an mp3. Runs on the probe workers,
+        # so it must not touch self.artists.
         try:
-            cmd = f'ffprobe.exe -i "{filepath}" -show_format -v quiet | grep -E "title|artist|duration"'
-            result = run(cmd, capture_output=True, shell=True, text=True, encoding='utf-8')
-            data_str = result.stdout
-            data_str = data_str.replace("TAG:", "")
-            data_str = data_str.replace(":", " ")
-            data_str = data_str.replace("=", ":")
-        except:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+
+        cache = self.get_probe_cache()
+        if cache is not None:
+            data = cache.get("mp3_tags", filepath, stat)
+            if data is not None:
+                return data
+
+        with self.metrics.timed("probe", category, stat.st_size) as timing:
+            data = self.probe_mp3_tags(filepath)
+            timing.ok = data is not None
+
+        # Failed probes are not cached so they are tried again next run
+        if cache is not None and data is not None:
+            cache.put("mp3_tags", filepath, stat, data)
+        return data if data is not None else {}
+
+    def probe_mp3_tags(self, filepath) -> dict:
+        # Read the tags and frame headers directly, ffprobe is only started
+        # for files that can't be parsed that way
+        if self.fast_mp3_probe and filepath.lower().endswith(".mp3"):
+            info = read_mp3_info(filepath)
+            if info is not None:
+                return info
+
+        probe = probe_audio(filepath)
+        if probe is None:
             print(f"Error probing file: {filepath} ")
-            return {}
+            return None
 
-        # loop through the string and split it into key value pairs
-        # split the string by ":" and loop through the string
-        # and split it into key value pairs
+        # Ogg files keep their tags on the stream
+        tags = {key.lower(): value for key, value in probe["stream"].get("tags", {}).items()}
+        tags.update({key.lower(): value for key, value in probe.get("tags", {}).items()})
 
         data = {}
-        key = ""
-
-        data_values = data_str.split("\n")
+        for key in ("title", "artist"):
+            if key in tags:
+                # Remove all return characters and new lines
+                data[key] = tags[key].replace("\n", "").replace("\r", "").strip()
 
-        for data_value in data_values:
-            if data_value == "":
-                continue
+        try:
+            # Convert duration to milliseconds
+            data["duration"] = int(float(probe["duration"]) * 1000)
+        except (KeyError, ValueError):
+            pass
 
-            key, value = data_value.split(":")
-
-            # Remove all return characters and new lines
-            value = value.replace("\n", "").replace("\r", "").strip()
-            key = key.strip()
-
-            if (key == "duration"):
-                # Convert duration to milliseconds
-                value = float(value)
-                value = int(value * 1000)
-
-            if (key == 'artist'):
-                # Check if the artist is in the artists dictionary
-                if value not in self.artists.keys():
-                    print(f"Missing artists: {value}")
-                    # Add the artist to the artists dictionary
-                    self.max_artist_id = self.max_artist_id + 1
-                    self.artists[value] = {'id':self.max_artist_id, 'in_db':False}
-                    data["artist_id"] = self.max_artist_id
-                else:
-                    artist_id = self.artists[value]['id']
-                    data["artist_id"] = artist_id
+        return data
 
-            data[key] = value
+    def add_artist_id(self, data: dict, filepath) -> dict:
+        if "artist" in data.keys():
+            value = data["artist"]
+            # Check if the artist is in the artists dictionary
+            if value not in self.artists.keys():
+                print(f"Missing artists: {value}")
+                # Add the artist to the artists dictionary
+                self.max_artist_id = self.max_artist_id + 1
+                self.artists[value] = {'id':self.max_artist_id, 'in_db':False}
+                data["artist_id"] = self.max_artist_id
+            else:
+                artist_id = self.artists[value]['id']
+                data["artist_id"] = artist_id
 
         # If we dont have an artist, we create a default one called "Unknown Artist"
         if "artist_id" not in data.keys():
@@ -1004,7 +1897,10 @@ class AudioConverter:
                     #     all_data.append(data)
         return all_data
 
-    def build_tree(self, path: Path, parent=None) -> TreeNode:
+    def build_tree(self, path: Path, parent=None, ids: NodeIdAllocator = None) -> TreeNode:
+        if ids is None:
+            ids = NodeIdAllocator()
+
         # Only include folders and .mp3 files
         if path.is_file():
             if path.suffix.lower() != '.mp3':
@@ -1013,11 +1909,12 @@ class AudioConverter:
         else:
             is_file = False
 
-        node = TreeNode(path.name, is_file=is_file, filepath=path, parent=parent)
+        node = TreeNode(path.name, ids.next_id(is_file), is_file=is_file, parent=parent,
+                        root_path=str(path) if parent is None else None)
         if path.is_dir():
             print(f"Reading folder: {path}")
             for child_path in sorted(path.iterdir(), key=lambda p: (p.is_file(), p.name)):
-                child_node = self.build_tree(child_path, parent=node)
+                child_node = self.build_tree(child_path, parent=node, ids=ids)
                 if child_node is not None:
                     node.add_child(child_node)
         return node
@@ -1029,13 +1926,67 @@ class AudioConverter:
             'is_file': node.is_file,
             'parent_id': node.parent.node_id if node.parent else None,
             'children_ids': [child.node_id for child in node.children],
-            'filepath': str(WindowsPath(node.filepath)),
+            'filepath': str(PureWindowsPath(node.filepath)),
             'outputfilepath':f"{self.output_folder}/{node.node_id:08d}.ogg" if node.is_file else None
         }
         for child in node.children:
             tree_list.update(self.extract_tree(child))
         return tree_list
 
+    def iter_tree(self, root_folder: str):
+        # Walks the folder in the same order and with the same ids as
+        # build_tree, in one pass over os.scandir with an explicit stack so
+        # deep trees don't hit the recursion limit. Yields (node_id, item) for
+        # each node as it is visited, only the folders still to be visited
+        # are held in memory.
+        root_path = os.path.normpath(root_folder)
+        ids = NodeIdAllocator()
+
+        # (path, name, is_file, parent id)
+        stack = [(root_path, os.path.basename(root_path), False, None)]
+
+        while stack:
+            path, name, is_file, parent_id = stack.pop()
+
+            node_id = ids.next_id(is_file)
+            yield node_id, {
+                'name': name,
+                'is_file': is_file,
+                'parent_id': parent_id,
+                'filepath': path,
+                'outputfilepath':f"{self.output_folder}/{node_id:08d}.ogg" if is_file else None
+            }
+
+            if is_file:
+                continue
+
+            for child_is_file, child_name, child_path in reversed(self.scan_folder(path)):
+                stack.append((child_path, child_name, child_is_file, node_id))
+
+    def scan_folder(self, path: str) -> list:
+        # Sorted (is_file, name, path) of the sub folders and source files
+        # (.mp3 unless source_extensions says otherwise) in a folder, folders
+        # first. DirEntry caches the file type, so each entry costs one stat
+        # at most.
+        try:
+            entries = list(os.scandir(path))
+        except (NotADirectoryError, FileNotFoundError):
+            return []
+
+        print(f"Reading folder: {path}")
+
+        children = []
+        for entry in entries:
+            if entry.is_file():
+                # Only include folders and source files
+                if self.is_source_file(entry.name):
+                    children.append((True, entry.name, entry.path))
+            else:
+                children.append((False, entry.name, entry.path))
+
+        children.sort()
+        return children
+
     def print_tree(self, node: TreeNode, indent: str = ""):
         print(indent + ("📄 " if node.is_file else "📁 ") + node.name + "("+ (str(node.node_id) + ":" + str(node.parent.node_id) if node.parent else "root") +")")
         for child in node.children:
@@ -1068,110 +2019,320 @@ class AudioConverter:
             print("Please provide a valid root folder.")
             return
 
-        path = Path(root_folder)
-        root_node = self.build_tree(path)
-        tree_list = {}
+        for _ in self.write_prepared_tree(root_folder):
+            self.progress.update()
+
+    def write_prepared_tree(self, root_folder: str):
+        # Walks root_folder and yields the row of each file as it is written.
+        # files.jsonl (one file per line) and folders.csv are written while
+        # the folder is walked, convert_prepared_files can start on them
+        # before the walk is done (--follow). The .done marker is created
+        # once the walk is complete.
+        done_marker = f"{self.files_list_file}.done"
+        if os.path.exists(done_marker):
+            os.remove(done_marker)
+
+        files_count = 0
+        folders_count = 0
+
+        print("Extracting tree structure to CSV and JSONL format...")
+
+        with open("folders.csv", "w", encoding="utf-8") as folders_file, \
+             open(self.files_list_file, "w", encoding="utf-8", buffering=1) as files_file:
+
+            for node_id, item in self.iter_tree(root_folder):
+                if folders_count == 0 and files_count == 0:
+                    print(f"Root folder: {item['name']} (ID: {node_id}) {item['is_file']}")
+                if item['is_file']:
+                    row = self.make_row_dict(node_id, item)
+                    files_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    files_count += 1
+                    yield row
+                else:
+                    row = f"{node_id}|{item['name']}| {item['parent_id']}|0|0|0|0|1|null"
+                    folders_file.write(row + "\n")
+                    folders_count += 1
 
-        print("Extracting tree structure to CSV format...")
+        open(done_marker, "w").close()
 
-        tree_list = self.extract_tree(root_node)
-        files = []
-        folders = []    
+        print(f"Length of artist data: {len(self.artists)}")
+        self.write_artists_to_file()
 
-        for node_id, item in tree_list.items():
-            if node_id == 1:
-                print(f"Root folder: {item['name']} (ID: {node_id}) {item['is_file']}")
-            if item['is_file']:
-                row = self.make_row_dict(node_id, item)
-                files.append(row)
-            else:
-                row = f"{node_id}|{item['name']}| {item['parent_id']}|0|0|0|0|1|null"
-                folders.append(row)
+        print("Finished extracting tree structure to JSONL format.")
+        print(f"Total Folders: {folders_count}")
+        print(f"Total Files: {files_count}")
+
+    def iter_prepared_files(self, follow: bool = False):
+        # Yields the files written by prepare_files_for_conversion one at a
+        # time. With follow=True it keeps waiting for new lines until the walk
+        # has written its .done marker. Falls back to a files.json from older runs.
+        if not os.path.exists(self.files_list_file) and os.path.exists("files.json"):
+            with open("files.json", "r", encoding="utf-8") as f:
+                yield from json.load(f)
+            return
 
-        self.write_files("folders.csv", folders)
+        done_marker = f"{self.files_list_file}.done"
 
-        print(f"Length of artist data: {len(self.artists)}")
-        self.write_artists_to_file()
+        with open(self.files_list_file, "r", encoding="utf-8") as f:
+            while True:
+                # Checked before reading, so nothing written before the
+                # marker appeared can be missed
+                done = not follow or os.path.exists(done_marker)
+                position = f.tell()
+                line = f.readline()
 
-        # save files as a JSON file
-        with open("files.json", "w", encoding="utf-8") as f:
-            json.dump(files, f, ensure_ascii=False, indent=4)
+                if line.endswith("\n"):
+                    if line.strip() != "":
+                        yield json.loads(line)
+                    continue
 
-        print("Finished extracting tree structure to JSON format.")
-        print(f"Total Folders: {len(folders)}")
-        print(f"Total Files: {len(files)}")
+                # End of the file, or a line that is still being written
+                if done:
+                    if line.strip() != "":
+                        yield json.loads(line)
+                    return
 
-        #self.print_tree(root_node)
-        # folders, files = self.print_tree_with_counts(root_node)
-        # print(f"Folders: {folders}")
-        # print(f"Files: {files}")
+                f.seek(position)
+                time.sleep(0.5)
 
-    def convert_prepared_files(self):
+    def convert_prepared_files(self, follow: bool = False):
         print("Converting prepared files...")
 
-        json_file = "files.json"
-        if not os.path.exists(json_file):
-            print(f"File not found: {json_file}")
+        if not os.path.exists(self.files_list_file) and not os.path.exists("files.json"):
+            print(f"File not found: {self.files_list_file}")
             return
 
-        with open(json_file, "r", encoding="utf-8") as f:
-            files = json.load(f)
+        files = self.iter_prepared_files(follow)
+        if not follow and os.path.exists(self.files_list_file):
+            with open(self.files_list_file, "r", encoding="utf-8") as f:
+                self.progress.set_total(sum(1 for line in f if line.strip() != ""))
 
-        print(f"Converting {len(files)} files...")
         start_time = datetime.datetime.now()
         print(f"Start Time: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
-        insert_statements = []
+        track_rows = []
         failed_conversions = []
-        for index, file in enumerate(files):
-            input_file = file['filepath']
-            node_id = file['node_id']
-            output_file = f"{self.output_folder}/{str(node_id).zfill(8)}.ogg"
+        total_cpu_time = 0.0
+        manifest = self.get_manifest()
 
-            if not os.path.exists(input_file):
-                print(f"Input file not found: {input_file} ... skipping")
-                continue
+        if self.import_mode != "direct":
+            self.write_stmts([])    # Batches are appended to it
 
-            if self.keep_converted:
-                if os.path.exists(output_file):
-                    print(f"Output file already exists: {output_file}  ... skipping")
-                    continue
-
-            print(f"{index}. Converting: {input_file} => {output_file}")
-
-            try:
-                os.system(f"ffmpeg -y -i \"{input_file}\" -nostats -loglevel 0 -c:a libvorbis -q:a 4 -vsync 2 \"{output_file}\"")
-                print(f"Converted: {input_file} => {output_file}")
-                duration =  self.probe_audio_duration(output_file)
-                file['duration'] = int(duration * 1000)  # in milliseconds
-                file['physicalstorageused'] = self.get_file_size(output_file)
-                track_insert_stmt = self.make_insert_statement(file)
-                insert_statements.append(track_insert_stmt)
-            except:
-                print(f"Failed to convert: {input_file} => {output_file}")
-                failed_conversions.append(file)
+        for index, file in enumerate(files):
+            if self.convert_prepared_file(index, file, manifest, failed_conversions) is None:
                 continue
 
-        print(f"Writing insert statements to file...{len(insert_statements)}")
-        self.write_stmts(insert_statements)
+            total_cpu_time += file.get('cpu_time', 0.0)
+            track_rows.append(self.make_prepared_track_row(file))
+            if len(track_rows) >= self.import_batch_size:
+                self.save_prepared_tracks(track_rows)
+
+        self.save_prepared_tracks(track_rows)
 
         # Write failed conversions to a json file
+        print(f"Skipped transcodes (source already matches profile): {self.total_skipped_transcodes}")
         print(f"Writing failed conversions to file...{len(failed_conversions)}")
         if len(failed_conversions) > 0:
             with open(f"{self.log_folder}/failed_conversions.json", "w", encoding="utf-8") as f:
                 json.dump(failed_conversions, f, ensure_ascii=False, indent=4)
 
+        self.write_duplicate_groups()
+
         print("File conversion done.")
         end_time = datetime.datetime.now()
         print(f"End Time: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
         time_diff = end_time - start_time
         print(f"Total Conversion Time: {time_diff}")
+        print(f"Total ffmpeg CPU Time: {timedelta(seconds=total_cpu_time)}")
 
 
-    def write_stmts(self, stmts: list):
+    def convert_tree_pipeline(self, root_folder: str):
+        # --w followed by --t in one pass: files are converted and their
+        # insert statements written while the folder is still being walked
+        if root_folder == "":
+            print("Please provide a valid root folder.")
+            return
+
+        start_time = datetime.datetime.now()
+        print(f"Start Time: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+        manifest = self.get_manifest()
+        indexes = itertools.count()
+        track_rows = []
+        failed_conversions = []
+        total_cpu_time = 0.0
+
+        if self.import_mode != "direct":
+            self.write_stmts([])    # Batches are appended to it
+
+        def fetch(file):
+            input_stat, local_file = self.fetch_source(file['filepath'], "prepared", "prepared", scratch, manifest)
+            return file, input_stat, local_file
+
+        def transcode(fetched):
+            file, input_stat, local_file = fetched
+            try:
+                return self.convert_prepared_file(next(indexes), file, manifest, failed_conversions, input_stat,
+                                                  local_file)
+            finally:
+                if local_file is not None:
+                    scratch.release(local_file)
+
+        def add_track(file):
+            nonlocal total_cpu_time
+            total_cpu_time += file.get('cpu_time', 0.0)
+            track_rows.append(self.make_prepared_track_row(file))
+            if len(track_rows) >= self.import_batch_size:
+                self.save_prepared_tracks(track_rows)
+            return file
+
+        size = self.pipeline_queue_size
+        max_io = max(self.io_workers, self.max_io_workers)
+        max_cpu = max(self.workers, self.max_workers)
+        scratch = self.make_scratch()
+        pipeline = self.make_pipeline(self.counted(self.write_prepared_tree(root_folder)),
+                                      [PipelineStage("fetch", fetch, self.io_workers, size, max_workers=max_io,
+                                                     blocked=scratch.waiting_fetches if scratch is not None else None),
+                                       PipelineStage("transcode", transcode, self.workers, size, max_workers=max_cpu),
+                                       PipelineStage("import", add_track, 1, size,
+                                                     finish=lambda: self.save_prepared_tracks(track_rows))],
+                                      source_name="walk")
+        try:
+            stats = pipeline.run()
+        finally:
+            self.close_scratch(scratch)
+        self.write_pipeline_stats("tree_pipeline_stats.json", stats)
+
+        # Write failed conversions to a json file
+        print(f"Skipped transcodes (source already matches profile): {self.total_skipped_transcodes}")
+        print(f"Writing failed conversions to file...{len(failed_conversions)}")
+        if len(failed_conversions) > 0:
+            with open(f"{self.log_folder}/failed_conversions.json", "w", encoding="utf-8") as f:
+                json.dump(failed_conversions, f, ensure_ascii=False, indent=4)
+
+        self.write_duplicate_groups()
+
+        print("File conversion done.")
+        end_time = datetime.datetime.now()
+        print(f"End Time: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"Total Conversion Time: {end_time - start_time}")
+        print(f"Total ffmpeg CPU Time: {timedelta(seconds=total_cpu_time)}")
+
+    def convert_prepared_file(self, index: int, file: dict, manifest: ConversionManifest,
+                              failed_conversions: list, input_stat: os.stat_result = None,
+                              local_file: str = None) -> dict:
+        # Returns the file with its duration and size filled in, or None when
+        # it was skipped or failed. local_file is a prefetched copy of the source.
+        input_file = file['filepath']
+        node_id = file['node_id']
+        output_file = f"{self.output_folder}/{str(node_id).zfill(8)}.ogg"
+
+        if input_stat is None:
+            input_stat = self.stat_source(input_file, "prepared")
+        if input_stat is None:
+            print(f"Input file not found: {input_file} ... skipping")
+            self.progress.update(failed=True)
+            return None
+
+        source = self.claim_source(input_file, input_stat)
+        converted = None
+        try:
+            if source is not None and source.leader is not None:
+                leader = self.place_duplicate(source, output_file)
+                if leader is not None:
+                    file['duration'] = leader.details['duration']
+                    file['physicalstorageused'] = leader.details['physicalstorageused']
+                    file['duplicate_of'] = leader.path
+                    manifest.mark_done("prepared", input_file, input_stat, output_file, file['duration'])
+                    converted = file
+                    return converted
+
+            converted = self.transcode_prepared_file(index, file, input_stat, output_file, manifest,
+                                                     failed_conversions, local_file)
+            return converted
+        finally:
+            if source is not None:
+                self.source_index.finish(source, output_file if converted is not None else None, file)
+            self.progress.update(source_bytes=input_stat.st_size,
+                                 audio_seconds=converted['duration'] / 1000 if converted is not None else 0,
+                                 failed=converted is None)
+
+    def transcode_prepared_file(self, index: int, file: dict, input_stat: os.stat_result, output_file: str,
+                                manifest: ConversionManifest, failed_conversions: list,
+                                local_file: str = None) -> dict:
+        input_file = file['filepath']
+        source = local_file if local_file is not None else input_file
+
+        if self.keep_converted:
+            entry = manifest.finished("prepared", input_file, input_stat)
+            if entry is not None:
+                print(f"Output file already converted: {output_file}  ... skipping")
+                file['duration'] = int(entry['duration_ms'])
+                file['physicalstorageused'] = entry['output_size'] / 1024
+                return file
+
+        # Prepared files pick their profile by the name of their folder
+        profile = self.get_profile(PureWindowsPath(input_file).parent.name)
+
+        copied = self.copy_matching_source(source, output_file, "prepared", input_stat.st_size, profile)
+        if copied is not None:
+            file['duration'], size = copied
+            file['physicalstorageused'] = size / 1024
+            file['transcode_skipped'] = True
+            manifest.mark_done("prepared", input_file, input_stat, output_file, file['duration'])
+            return file
+
+        self.print_file(f"{index}. Converting: {input_file} => {output_file}")
+
+        result = self.transcode(source, output_file, "prepared", input_stat.st_size, profile)
+        if not result.ok:
+            print(f"Failed to convert: {input_file} => {output_file}: {result.error_message()}")
+            file.update(result.failure_details())
+            manifest.mark_failed("prepared", input_file, input_stat, result.error_message())
+            failed_conversions.append(file)
+            return None
+
+        file['cpu_time'] = result.cpu_time
+
+        try:
+            self.print_file(f"Converted: {input_file} => {output_file} Time: {timedelta(seconds=result.wall_time)}")
+            duration = self.converted_file_duration(result, output_file)
+            file['duration'] = int(duration * 1000)  # in milliseconds
+            file['physicalstorageused'] = self.converted_file_size(result, output_file) / 1024
+            manifest.mark_done("prepared", input_file, input_stat, output_file, file['duration'])
+        except:
+            print(f"Failed to convert: {input_file} => {output_file}")
+            failed_conversions.append(file)
+            return None
+
+        return file
+
+    def save_prepared_tracks(self, track_rows: list):
+        # Imports or appends the insert statements of a batch of rows and
+        # empties it, so a run only holds import_batch_size rows at a time
+        if self.import_mode == "direct":
+            self.import_prepared_tracks(track_rows)
+        else:
+            print(f"Writing insert statements to file...{len(track_rows)}")
+            self.write_stmts([make_insert_stmt("Tracks", PREPARED_TRACK_COLUMNS, row) for row in track_rows],
+                             append=True)
+        track_rows.clear()
+
+    def import_prepared_tracks(self, track_rows: list):
+        # One transaction per folder
+        folder_index = PREPARED_TRACK_COLUMNS.index('folderid')
+        folders = {}
+        for row in track_rows:
+            folders.setdefault(row[folder_index], []).append(row)
+
+        for folder_id, rows in folders.items():
+            if not self.import_rows([("Tracks", PREPARED_TRACK_COLUMNS, rows)], f"folder {folder_id}"):
+                print(f"Failed to import Tracks for folder: {folder_id}")
+
+    def write_stmts(self, stmts: list, append: bool = False):
         filename = f"{self.log_folder}/tracks_insert_statements.sql"
         try:
-            with open(filename, "w", encoding="utf-8") as f:
+            with open(filename, "a" if append else "w", encoding="utf-8") as f:
                 for stmt in stmts:
                     try:
                         f.write(stmt + "\n")
@@ -1184,17 +2345,26 @@ class AudioConverter:
             return False    
 
 
+    def make_prepared_track_row(self, file: dict) -> tuple:
+        return (file["node_id"], file["title"], file["artist"], "//AUDIO-SERVER", file["class"],
+                file["duration"], file["year"], file["fadein"], file["fadeout"], file["fadedelay"],
+                file["intro"], file["extro"], file["folderid"], file["onstartevent"], file["onstopevent"],
+                file["disablenotify"], file["physicalstorageused"], file["trackmediatype"],
+                file["artistID_1"], file["old_filename"])
+
     def make_insert_statement(self, file: dict) -> str:
-        ins_stmt = (f'Insert into Tracks (trackreference, tracktitle,artistsearch,filepath,class,duration,year,'
-                    f'fadein,fadeout,fadedelay,intro,extro,folderid,onstartevent,onstopevent,'
-                    f'disablenotify,physicalstorageused,trackmediatype,artistID_1, old_filename)'
-                    f' VALUES ( '
-                    f'{file["node_id"]},"{file["title"]}","{file["artist"]}","//AUDIO-SERVER", '
-                    f'"{file["class"]}",{file["duration"]},{file["year"]},{file["fadein"]},{file["fadeout"]},'
-                    f'{file["fadedelay"]},{file["intro"]},{file["extro"]},{file["folderid"]},'
-                    f'{file["onstartevent"]},{file["onstopevent"]},{file["disablenotify"]},'
-                    f'{file["physicalstorageused"]},"{file["trackmediatype"]}",{file["artistID_1"]}, {file["old_filename"]} );')
-        return ins_stmt
+        return make_insert_stmt("Tracks", PREPARED_TRACK_COLUMNS, self.make_prepared_track_row(file))
+
+    def is_source_file(self, name: str) -> bool:
+        # Extensions match in any case, e.g. .mp3 also picks up .MP3
+        return name.lower().endswith(self.source_extensions)
+
+    def strip_source_extension(self, name: str) -> str:
+        lower_name = name.lower()
+        for ext in self.source_extensions:
+            if lower_name.endswith(ext):
+                return name[:-len(ext)]
+        return name
 
     def make_row_dict(self, node_id: int, item: dict) -> dict:
         row = {}
@@ -1210,13 +2380,13 @@ class AudioConverter:
             parts = item['name'].rsplit("-", 1)
             if len(parts) == 2:
                 row['artist'] = parts[0].strip()
-                row['title'] = parts[1].strip().replace(".mp3", "")
+                row['title'] = self.strip_source_extension(parts[1].strip())
             else:
                 row['artist'] = parts[0].strip()
-                row['title'] = parts[0].strip().replace(".mp3", "")
+                row['title'] = self.strip_source_extension(parts[0].strip())
         else:
             row['artist'] = "UNKNOWN"
-            row['title'] = item['name'].strip().replace(".mp3", "")
+            row['title'] = self.strip_source_extension(item['name'].strip())
 
         row['parent_id'] = item['parent_id']
         row['filepath'] = item.get('filepath','')
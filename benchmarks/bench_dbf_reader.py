@@ -0,0 +1,64 @@
+import os
+import sys
+import random
+import argparse
+import tempfile
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbf_reader import (HEADER_SIZE, RECORD_SIZE, get_raw_dbf_data, format_raw_data, read_dbf)
+
+
+def make_dbf(filename: str, records: int, seed: int = 1):
+    # Writes a DBF with the layout get_raw_dbf_data expects: a header, then
+    # fixed size records with the code at 0, the title at 56, the artist at 120
+    rnd = random.Random(seed)
+    words = ["NYERI", "NAIROBI", "ROAD", "SAFETY", "TIPS", "MERU", "EMBU", "DATE", "MATATU", "STAGES"]
+
+    with open(filename, "wb") as f:
+        f.write(b"\x03" + bytes(HEADER_SIZE - 1))
+        for i in range(records):
+            title = " ".join(rnd.choice(words) for _ in range(4)).encode("ascii")
+            artist = " ".join(rnd.choice(words) for _ in range(3)).encode("ascii")
+            record = bytearray(b" " * RECORD_SIZE)
+            record[0:4] = f"{i % 10000:04d}".encode("ascii")
+            record[56:56 + len(title)] = title
+            record[120:120 + len(artist)] = artist
+            f.write(record)
+        f.write(b"\x1a")
+
+
+def time_it(func, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        func()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the hex and mmap DBF readers")
+    parser.add_argument("--records", type=int, default=100000, help="Records in the synthetic DBF")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per reader, the best one is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dbf = os.path.join(tmp, "CHR.DBF")
+        make_dbf(dbf, args.records)
+
+        legacy = format_raw_data(get_raw_dbf_data(dbf), "CHR.DBF", "..//Audio")
+        current = read_dbf(dbf, "CHR.DBF", "..//Audio")
+        if legacy != current:
+            raise SystemExit("Readers returned different records")
+
+        legacy_time = time_it(lambda: format_raw_data(get_raw_dbf_data(dbf), "CHR.DBF", "..//Audio"), args.repeat)
+        current_time = time_it(lambda: read_dbf(dbf, "CHR.DBF", "..//Audio"), args.repeat)
+
+    print(f"Records..................: {len(current)}")
+    print(f"Hex reader...............: {legacy_time * 1000:.1f} ms")
+    print(f"mmap reader..............: {current_time * 1000:.1f} ms")
+    print(f"Speedup..................: {legacy_time / current_time:.1f}x")
@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import shutil
+import struct
+import random
+import argparse
+import platform
+import datetime
+import tempfile
+from pathlib import Path
+from subprocess import run, PIPE, DEVNULL
+from timeit import default_timer as timer
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbf_reader import get_raw_dbf_data, format_raw_data, read_dbf
+from id3_reader import read_mp3_info
+from ffmpeg_runner import FFMPEG, FFPROBE, probe_format
+from mssql_data import make_insert_stmt
+from audio_convert import AudioConverter, PREPARED_TRACK_COLUMNS, ARTIST_COLUMNS
+
+from bench_dbf_reader import make_dbf, time_it
+from bench_tree_walk import make_tree, make_converter, write_prepared
+
+# Runs every stage of the conversion on synthetic fixtures and writes the
+# timings to a JSON file, so two runs (e.g. before and after a change) can be
+# compared with --compare. Only ffmpeg/ffprobe are needed, the stages that use
+# them are skipped when they are not on the PATH.
+
+# MPEG-1 layer III, 128 kbit/s, 44.1 kHz, mono: 417 bytes and 1152 samples a frame
+MP3_FRAME_HEADER = b"\xff\xfb\x90\xc4"
+MP3_FRAME_SIZE = 417
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+WORDS = ["NYERI", "NAIROBI", "ROAD", "SAFETY", "TIPS", "MERU", "EMBU", "DATE", "MATATU", "STAGES"]
+
+
+def id3_text_frame(frame_id: bytes, text: str) -> bytes:
+    body = b"\x03" + text.encode("utf-8")   # utf-8
+    return frame_id + struct.pack(">I", len(body)) + b"\x00\x00" + body
+
+
+def syncsafe_bytes(value: int) -> bytes:
+    return bytes([(value >> 21) & 0x7f, (value >> 14) & 0x7f, (value >> 7) & 0x7f, value & 0x7f])
+
+
+def make_mp3(filename: str, title: str, artist: str, seconds: float):
+    # An ID3v2.3 tag followed by constant bitrate frames of silence, enough
+    # for read_mp3_info and for ffmpeg to decode
+    frames = id3_text_frame(b"TIT2", title) + id3_text_frame(b"TPE1", artist)
+    tag = b"ID3\x03\x00\x00" + syncsafe_bytes(len(frames)) + frames
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+
+    with open(filename, "wb") as f:
+        f.write(tag)
+        f.write(frame * max(1, int(seconds * MP3_FRAMES_PER_SECOND)))
+
+
+def make_mp3_tree(root: str, files: int, seconds: float, seed: int = 1) -> list:
+    # "ARTIST - TITLE.mp3" files with matching tags, spread over nested folders
+    # like make_tree, returns their paths
+    rnd = random.Random(seed)
+    make_tree(root, files)
+
+    paths = []
+    for folder, _, names in os.walk(root):
+        for name in sorted(names):
+            if not name.endswith(".mp3"):
+                continue
+            os.remove(os.path.join(folder, name))
+            artist = " ".join(rnd.choice(WORDS) for _ in range(2))
+            title = " ".join(rnd.choice(WORDS) for _ in range(3))
+            path = os.path.join(folder, f"{artist} - {title} {len(paths):06d}.mp3")
+            make_mp3(path, title, artist, seconds)
+            paths.append(path)
+    return paths
+
+
+def make_clips(folder: str, category: str, count: int, seconds: float):
+    # Short MPEG-TS clips named like the MTS files of a category, one tone
+    # per clip so they don't all have the same content
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        argv = [FFMPEG, "-v", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency={220 + i * 10}:duration={seconds}",
+                "-c:a", "mp2", "-f", "mpegts", os.path.join(folder, f"{category}{i:04d}.MTS")]
+        run(argv, stdout=DEVNULL, stderr=PIPE, check=True)
+
+
+def tool_version(tool: str) -> str:
+    # First line of -version, None when the tool is not installed
+    if shutil.which(tool) is None:
+        return None
+    result = run([tool, "-version"], stdout=PIPE, stderr=DEVNULL, encoding="utf-8", errors="replace")
+    return result.stdout.split("\n")[0]
+
+
+def stage(seconds: float, items: int, **extra) -> dict:
+    return {"seconds": round(seconds, 6),
+            "items": items,
+            "items_per_second": round(items / seconds, 1) if seconds > 0 else None,
+            **extra}
+
+
+def bench_dbf_reader(tmp: str, records: int, repeat: int) -> dict:
+    dbf = os.path.join(tmp, "CHR.DBF")
+    make_dbf(dbf, records)
+
+    legacy = time_it(lambda: format_raw_data(get_raw_dbf_data(dbf), "CHR.DBF", "..//Audio"), repeat)
+    current = time_it(lambda: read_dbf(dbf, "CHR.DBF", "..//Audio"), repeat)
+    return {"dbf_reader.hex": stage(legacy, records),
+            "dbf_reader.mmap": stage(current, records)}
+
+
+def bench_tree(tmp: str, files: int, repeat: int) -> dict:
+    root = os.path.join(tmp, "TREE")
+    os.makedirs(root)
+    folders = make_tree(root, files)
+    converter = make_converter()
+
+    work = os.path.join(tmp, "TREE_OUT")
+    os.makedirs(work)
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        legacy = time_it(lambda: converter.extract_tree(converter.build_tree(Path(root))), repeat)
+        current = time_it(lambda: sum(1 for _ in converter.iter_tree(root)), repeat)
+        # --w as it runs: the walk plus files.jsonl and folders.csv
+        write = time_it(lambda: write_prepared(converter, root, work), repeat)
+    return {"tree.build_extract": stage(legacy, files, folders=folders),
+            "tree.walk": stage(current, files, folders=folders),
+            "tree.write_prepared": stage(write, files, folders=folders)}
+
+
+def bench_probe(paths: list, ffprobe_files: int, repeat: int) -> dict:
+    results = {"probe.id3_reader": stage(time_it(lambda: [read_mp3_info(p) for p in paths], repeat), len(paths))}
+
+    # ffprobe is the fallback for files id3_reader can't parse, timed on a
+    # sample because it starts a process per file
+    if shutil.which(FFPROBE) is not None:
+        sample = paths[:ffprobe_files]
+        results["probe.ffprobe"] = stage(time_it(lambda: [probe_format(p) for p in sample], 1), len(sample))
+    else:
+        results["probe.ffprobe"] = {"skipped": "ffprobe not found"}
+    return results
+
+
+def bench_sql(rows: int, repeat: int) -> dict:
+    rnd = random.Random(1)
+    tracks = []
+    for i in range(rows):
+        tracks.append((i + 1, " ".join(rnd.choice(WORDS) for _ in range(3)) + " O'NEIL",
+                       " ".join(rnd.choice(WORDS) for _ in range(2)), "//AUDIO-SERVER", "SONG",
+                       rnd.randint(60000, 400000), 2025, 0, 0, 0, 0, 0, i % 100, -1, -1, 0,
+                       rnd.randint(1000, 9000) * 1.5, "AUDIO", i % 500, i + 1))
+    artists = [(i, " ".join(rnd.choice(WORDS) for _ in range(2)), "GROUP") for i in range(rows // 10)]
+
+    track_time = time_it(lambda: [make_insert_stmt("Tracks", PREPARED_TRACK_COLUMNS, row) for row in tracks], repeat)
+    artist_time = time_it(lambda: [make_insert_stmt("Artists", ARTIST_COLUMNS, row) for row in artists], repeat)
+    return {"sql.tracks": stage(track_time, len(tracks)),
+            "sql.artists": stage(artist_time, len(artists))}
+
+
+def run_converter(work: str, func, **kwargs) -> tuple:
+    # Runs func(converter) inside work, where the modes write their lists
+    # and logs. Returns (seconds, stage metrics, encoder profile stats).
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        os.makedirs("log", exist_ok=True)
+        os.makedirs("out", exist_ok=True)
+        config = {"output_folder": "out", "log_folder": "log", "db_backend": "sqlite", "sqlite_file": "bench.db",
+                  "probe_cache": "False", "metrics_format": "none", "progress_interval": "0",
+                  "print_files": "False", **kwargs}
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            converter = AudioConverter(**config)
+            try:
+                start = timer()
+                func(converter)
+                elapsed = timer() - start
+            finally:
+                converter.close()
+        return elapsed, converter.metrics.summary(), converter.profile_stats.summary()
+    finally:
+        os.chdir(cwd)
+
+
+def bench_end_to_end(tmp: str, clips: int, clip_seconds: float, workers: str, profile: str) -> dict:
+    if shutil.which(FFMPEG) is None:
+        skipped = {"skipped": "ffmpeg not found"}
+        return {"end_to_end.convert": skipped, "end_to_end.tree_pipeline": skipped}
+
+    # --c: DBF records, MTS clips, ogg outputs and the category logs
+    work = os.path.join(tmp, "convert")
+    os.makedirs(os.path.join(work, "dbf"))
+    make_dbf(os.path.join(work, "dbf", "CHR.DBF"), clips)
+    make_clips(os.path.join(work, "audio", "CHR"), "CHR", clips, clip_seconds)
+    open(os.path.join(work, "ffmpeg.exe"), "w").close()   # convert() only checks that it exists
+
+    # An encoder profile given with --profile is used for every conversion
+    config = {"workers": workers}
+    if profile:
+        config.update({"profile.bench": profile, "default_profile": "bench"})
+
+    elapsed, metrics, profiles = run_converter(work, lambda c: c.convert(), dbf_folder="dbf", audio_folder="audio",
+                                               **config)
+    results = {"end_to_end.convert": stage(elapsed, clips, audio_seconds=clips * clip_seconds, metrics=metrics,
+                                           profiles=profiles)}
+
+    # --w --pipeline: walk, transcode and insert statements in one pass
+    work = os.path.join(tmp, "tree_pipeline")
+    paths = make_mp3_tree(os.path.join(work, "MUSIC"), clips, clip_seconds)
+    elapsed, metrics, profiles = run_converter(work, lambda c: c.convert_tree_pipeline("MUSIC"),
+                                               pipeline_report_interval="0", **config)
+    results["end_to_end.tree_pipeline"] = stage(elapsed, len(paths), audio_seconds=len(paths) * clip_seconds,
+                                                metrics=metrics, profiles=profiles)
+    return results
+
+
+def compare(previous_file: str, current: dict):
+    with open(previous_file, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+
+    print(f"Compared with............: {previous_file} ({previous['started']})")
+    for name, result in current["stages"].items():
+        before = previous["stages"].get(name, {}).get("seconds")
+        after = result.get("seconds")
+        if before is None or after is None or after == 0:
+            continue
+        print(f"{name:<25}: {before * 1000:10.1f} ms => {after * 1000:10.1f} ms  {before / after:5.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every conversion stage on synthetic fixtures")
+    parser.add_argument("--records", type=int, default=100000, help="Records in the synthetic DBF")
+    parser.add_argument("--files", type=int, default=20000, help="mp3 files in the synthetic tree")
+    parser.add_argument("--probe-files", type=int, default=2000, help="Tagged mp3 files probed")
+    parser.add_argument("--ffprobe-files", type=int, default=50, help="Of those, files also probed with ffprobe")
+    parser.add_argument("--sql-rows", type=int, default=100000, help="Rows turned into insert statements")
+    parser.add_argument("--clips", type=int, default=20, help="Clips converted end to end, 0 to skip")
+    parser.add_argument("--clip-seconds", type=float, default=5, help="Length of each clip")
+    parser.add_argument("--workers", default="", help="Parallel conversions end to end, empty for one per core")
+    parser.add_argument("--profile", default="", help="Encoder profile end to end, e.g. codec=libopus,bitrate=64k")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the best one is reported")
+    parser.add_argument("--output", default="", help="JSON results file, bench_<time>.json by default")
+    parser.add_argument("--compare", default="", help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    started = datetime.datetime.now()
+    output = args.output or f"bench_{started.strftime('%Y%m%d_%H%M%S')}.json"
+
+    results = {"started": started.isoformat(timespec="seconds"),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "cpus": os.cpu_count(),
+               "ffmpeg": tool_version(FFMPEG),
+               "parameters": vars(args),
+               "stages": {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print("Timing dbf_reader...")
+        results["stages"].update(bench_dbf_reader(tmp, args.records, args.repeat))
+
+        print("Timing tree walks...")
+        results["stages"].update(bench_tree(tmp, args.files, args.repeat))
+
+        print("Timing mp3 probes...")
+        paths = make_mp3_tree(os.path.join(tmp, "PROBE"), args.probe_files, 1)
+        results["stages"].update(bench_probe(paths, args.ffprobe_files, args.repeat))
+
+        print("Timing SQL statement builders...")
+        results["stages"].update(bench_sql(args.sql_rows, args.repeat))
+
+        if args.clips > 0:
+            print("Timing end to end conversions...")
+            results["stages"].update(bench_end_to_end(tmp, args.clips, args.clip_seconds, args.workers,
+                                                              args.profile))
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+
+    for name, result in results["stages"].items():
+        if "skipped" in result:
+            print(f"{name:<25}: skipped, {result['skipped']}")
+        else:
+            print(f"{name:<25}: {result['seconds'] * 1000:10.1f} ms  {result['items_per_second'] or 0:12.1f} items/s")
+    print(f"Results written to.......: {output}")
+
+    if args.compare:
+        compare(args.compare, results)
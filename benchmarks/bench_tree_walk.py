@@ -0,0 +1,120 @@
+import os
+import sys
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path, PureWindowsPath
+from timeit import default_timer as timer
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_convert import AudioConverter
+
+
+def make_tree(root: str, files: int, files_per_folder: int = 50, folders_per_level: int = 8):
+    # Empty .mp3 files spread over nested folders, with a few other files
+    # mixed in that the walk has to skip
+    folder_count = 0
+    created = 0
+    level = [root]
+    while created < files:
+        next_level = []
+        for parent in level:
+            for _ in range(folders_per_level):
+                folder = os.path.join(parent, f"ARTIST {folder_count:05d}")
+                os.makedirs(folder)
+                folder_count += 1
+                next_level.append(folder)
+
+                for i in range(min(files_per_folder, files - created)):
+                    open(os.path.join(folder, f"ARTIST {folder_count} - SONG {i:03d}.mp3"), "wb").close()
+                    created += 1
+                open(os.path.join(folder, "cover.jpg"), "wb").close()
+
+                if created >= files:
+                    return folder_count
+        level = next_level
+    return folder_count
+
+
+def make_converter() -> AudioConverter:
+    # Only the tree methods are used, skip the database setup in __init__
+    converter = AudioConverter.__new__(AudioConverter)
+    converter.output_folder = "output"
+    converter.source_extensions = (".mp3",)
+    converter.files_list_file = "files.jsonl"
+    converter.log_folder = "log"
+    return converter
+
+
+def write_prepared(converter: AudioConverter, root: str, work: str) -> int:
+    # Runs --w (write_prepared_tree) with its files.jsonl, folders.csv and
+    # artists.txt written inside work, returns the number of files
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        os.makedirs(converter.log_folder, exist_ok=True)
+        converter.artists = {}
+        return sum(1 for _ in converter.write_prepared_tree(root))
+    finally:
+        os.chdir(cwd)
+
+
+def legacy_rows(node, rows=None) -> list:
+    # (node id, name, is_file, parent id, path) in build_tree order
+    if rows is None:
+        rows = []
+    rows.append((node.node_id, node.name, node.is_file, node.parent.node_id if node.parent else None,
+                 str(PureWindowsPath(node.filepath))))
+    for child in node.children:
+        legacy_rows(child, rows)
+    return rows
+
+
+def current_rows(converter: AudioConverter, root: str) -> list:
+    return [(node_id, item['name'], item['is_file'], item['parent_id'], str(PureWindowsPath(item['filepath'])))
+            for node_id, item in converter.iter_tree(root)]
+
+
+def measure(func) -> tuple:
+    # (result, seconds, peak MB allocated), timed without tracemalloc running
+    start = timer()
+    func()
+    elapsed = timer() - start
+
+    tracemalloc.start()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare build_tree/extract_tree with iter_tree")
+    parser.add_argument("--files", type=int, default=100000, help="mp3 files in the synthetic tree")
+    args = parser.parse_args()
+
+    converter = make_converter()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "MUSIC")
+        os.makedirs(root)
+        folders = make_tree(root, args.files)
+
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            root_node, node_time, node_peak = measure(lambda: converter.build_tree(Path(root)))
+            _, legacy_time, legacy_peak = measure(lambda: converter.extract_tree(converter.build_tree(Path(root))))
+            # The walk is streamed, only the nodes still to be visited are held
+            _, current_time, current_peak = measure(lambda: sum(1 for _ in converter.iter_tree(root)))
+            _, write_time, write_peak = measure(lambda: write_prepared(converter, root, tmp))
+
+            if legacy_rows(root_node) != current_rows(converter, root):
+                raise SystemExit("iter_tree returned a different tree")
+
+    print(f"Files / folders..........: {args.files} / {folders}")
+    print(f"build_tree (nodes only)..: {node_time * 1000:.1f} ms (peak {node_peak:.1f} MB)")
+    print(f"build_tree+extract_tree..: {legacy_time * 1000:.1f} ms (peak {legacy_peak:.1f} MB)")
+    print(f"iter_tree................: {current_time * 1000:.1f} ms (peak {current_peak:.1f} MB)")
+    print(f"write_prepared_tree......: {write_time * 1000:.1f} ms (peak {write_peak:.1f} MB)")
+    print(f"Speedup..................: {legacy_time / current_time:.1f}x")
@@ -1,5 +1,19 @@
+import os
 import sys
 import json
+import mmap
+import struct
+
+# Layout of the MTS category DBF files
+HEADER_SIZE = 1379  # bytes
+RECORD_SIZE = 446   # bytes from the start of one record to the next
+FIELDS_SIZE = 184   # bytes from the start of a record to the end of the artist field
+
+# code, 52 unused bytes, title, artist, 262 bytes up to the next record
+RECORD_STRUCT = struct.Struct("4s52x64s64s262x")
+CODE_SLICE = slice(0, 4)
+TITLE_SLICE = slice(56, 120)
+ARTIST_SLICE = slice(120, 184)
 
 def get_raw_dbf_data(dbf: str) -> list:
     HEADER = 1379  #bytes
@@ -42,19 +56,19 @@ def format_raw_data(hex_data: list, category: str, audio_folder: str) -> list:
         try:
             code_byte_string = bytes.fromhex(data['code'])
             record['code'] = code_byte_string.decode('ASCII')
-        except:
+        except ValueError:
             record['code'] = ''
 
         try:
             title_byte_string = bytes.fromhex(data['title'])
             record['title'] = title_byte_string.decode('ASCII').rstrip()
-        except:
+        except ValueError:
             record['title'] = ''
 
         try:
             art_byte_string = bytes.fromhex(data['artist'])
             record['artist'] = art_byte_string.decode('ASCII').rstrip()
-        except:
+        except ValueError:
             record['artist'] = ''
 
         record['category'] = category
@@ -68,7 +82,62 @@ def format_raw_data(hex_data: list, category: str, audio_folder: str) -> list:
 
     return ascii_data
 
+def _decode_field(raw: bytes) -> str:
+    try:
+        return raw.decode('ASCII')
+    except UnicodeDecodeError:
+        return ''
+
+def _unpack_raw_records(buffer, size: int):
+    # Yields (code, title, artist) bytes for every record in the buffer.
+    # Matches get_raw_dbf_data, which also returns the record that starts
+    # after the last full one when the file has at least one byte past the
+    # artist field of the previous record.
+    data_size = size - HEADER_SIZE
+    full_records = max(data_size, 0) // RECORD_SIZE
+
+    offset = HEADER_SIZE
+    for _ in range(full_records):
+        yield RECORD_STRUCT.unpack_from(buffer, offset)
+        offset += RECORD_SIZE
+
+    if full_records == 0 or data_size > (full_records - 1) * RECORD_SIZE + FIELDS_SIZE:
+        partial = buffer[offset:min(offset + FIELDS_SIZE, size)]
+        yield partial[CODE_SLICE], partial[TITLE_SLICE], partial[ARTIST_SLICE]
+
+def count_records(dbf_path: str) -> int:
+    # Upper bound on the records iter_records yields, from the file size
+    # alone. Records without a code are skipped there but counted here.
+    data_size = os.path.getsize(dbf_path) - HEADER_SIZE
+    if data_size <= 0:
+        return 0
+    return data_size // RECORD_SIZE + 1
+
+def iter_records(dbf_path: str, category: str, audio_folder: str):
+    # Yields the same records as format_raw_data(get_raw_dbf_data(dbf_path), ...)
+    # one at a time, decoded straight from a memory map of the file.
+    category = category[:-4]
+
+    with open(dbf_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            file_prefix = f"{audio_folder}//{category}//{category}"
+            for code, title, artist in _unpack_raw_records(buffer, size):
+                code = _decode_field(code)
+                if code == '':
+                    continue
+
+                yield {'code': code,
+                       'title': _decode_field(title).rstrip(),
+                       'artist': _decode_field(artist).rstrip(),
+                       'category': category,
+                       'audio_file': f"{file_prefix}{code}.MTS"}
+
+def read_dbf(dbf: str, category: str, audio_folder: str) -> list:
+    return list(iter_records(dbf, category, audio_folder))
+
 def get_data(dbf_folder : str, category: str, audio_folder: str)-> list:
-    raw_data = get_raw_dbf_data(dbf_folder+"/"+category)
-    data = format_raw_data(raw_data, category, audio_folder)
-    return data
+    return read_dbf(dbf_folder+"/"+category, category, audio_folder)
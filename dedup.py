@@ -0,0 +1,116 @@
+import hashlib
+import threading
+
+PARTIAL_HASH_SIZE = 64 * 1024       # bytes hashed from the start and the end of a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def partial_hash(filepath: str, size: int) -> str:
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        h.update(f.read(PARTIAL_HASH_SIZE))
+        if size > 2 * PARTIAL_HASH_SIZE:
+            f.seek(size - PARTIAL_HASH_SIZE)
+            h.update(f.read(PARTIAL_HASH_SIZE))
+    return h.hexdigest()
+
+
+def full_hash(filepath: str) -> str:
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class SourceFile:
+    __slots__ = ("path", "size", "partial", "full", "leader", "output", "details", "duplicates", "done")
+
+    def __init__(self, path: str, size: int, leader=None):
+        self.path = path
+        self.size = size
+        self.partial = None
+        self.full = None
+        self.leader = leader    # SourceFile with the same content that is converted instead
+        self.output = None      # Output of the conversion, None when it failed
+        self.details = None     # Record of the conversion, copied to the duplicates
+        self.duplicates = []
+        self.done = threading.Event()
+
+
+class SourceIndex:
+    # Finds sources with the same content so each one is only converted once.
+    # Files are compared by size first, then by a hash of their first and last
+    # 64 KB, and only read in full when both of those match.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_size = {}
+        self._leaders = []
+
+    def claim(self, path: str, size: int) -> SourceFile:
+        # Returns the SourceFile for path. When its leader is None the caller
+        # converts it and calls finish(), otherwise it waits for the leader.
+        with self._lock:
+            candidates = list(self._by_size.get(size, []))
+
+        # Hashing happens outside the lock. Two copies claimed at the same
+        # moment can both become leaders, they are then converted twice.
+        source = SourceFile(path, size)
+        for candidate in candidates:
+            if self._same_content(source, candidate):
+                with self._lock:
+                    candidate.duplicates.append(source)
+                source.leader = candidate
+                return source
+
+        with self._lock:
+            self._by_size.setdefault(size, []).append(source)
+            self._leaders.append(source)
+        return source
+
+    def finish(self, source: SourceFile, output: str, details: dict):
+        # output is None when the conversion failed, duplicates then convert
+        # their own copy
+        source.output = output
+        source.details = details
+        source.done.set()
+
+    def wait(self, source: SourceFile) -> SourceFile:
+        # Returns the leader once it is converted, or None when it failed
+        source.leader.done.wait()
+        if source.leader.output is None:
+            return None
+        return source.leader
+
+    def _same_content(self, a: SourceFile, b: SourceFile) -> bool:
+        try:
+            if self._partial(a) != self._partial(b):
+                return False
+            return self._full(a) == self._full(b)
+        except OSError as e:
+            print(f"Failed to hash {a.path}: {e}")
+            return False
+
+    def _partial(self, source: SourceFile) -> str:
+        if source.partial is None:
+            source.partial = partial_hash(source.path, source.size)
+        return source.partial
+
+    def _full(self, source: SourceFile) -> str:
+        if source.full is None:
+            source.full = full_hash(source.path)
+        return source.full
+
+    def duplicate_groups(self) -> list:
+        # One entry per source that has copies, for the run log
+        groups = []
+        with self._lock:
+            for leader in self._leaders:
+                if len(leader.duplicates) == 0:
+                    continue
+                groups.append({"source": leader.path,
+                               "output": leader.output,
+                               "size": leader.size,
+                               "sha256": leader.full,
+                               "duplicates": [{"source": d.path, "output": d.output} for d in leader.duplicates]})
+        return groups
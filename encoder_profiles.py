@@ -0,0 +1,189 @@
+import math
+import threading
+
+# Settings the ffmpeg runs encode with. Profiles are defined in config.ini as
+#   profile.speech=codec=libvorbis,quality=2,sample_rate=22050,channels=1
+#   profile.jingles=codec=libopus,bitrate=64k,threads=2
+# and picked per DBF category or mp3 folder with
+#   profile_map=SPO:speech,JIN:jingles
+# Everything else uses default_profile, "vorbis" unless set.
+# Ogg sources that already have the codec, sample rate and channels of the
+# profile and at least min_bitrate kbit/s are copied, not encoded. Without
+# min_bitrate the minimum follows from the bitrate or the Vorbis quality of
+# the profile, profiles with neither never copy.
+
+PROFILE_PREFIX = "profile."
+PROFILE_KEYS = ("codec", "quality", "bitrate", "sample_rate", "channels", "threads", "min_bitrate")
+
+# Outputs are Ogg files, only sources in that container can be copied as they are
+OGG_EXTENSIONS = (".ogg", ".oga", ".opus")
+
+# ffprobe's codec_name of what an ffmpeg encoder writes
+CODEC_NAMES = {"libvorbis": "vorbis", "libopus": "opus", "libmp3lame": "mp3", "libfdk_aac": "aac"}
+
+# Nominal kbit/s of the libvorbis -q:a levels, 44.1 kHz stereo
+VORBIS_QUALITY_BITRATES = {-1: 45, 0: 64, 1: 80, 2: 96, 3: 112, 4: 128, 5: 160, 6: 192, 7: 224, 8: 256, 9: 320,
+                           10: 500}
+
+# Share of the nominal bitrate a source needs when the minimum is derived,
+# VBR files average somewhat below the rate of their quality level
+DERIVED_BITRATE_SHARE = 0.8
+
+
+class EncoderProfile:
+    def __init__(self, name: str, codec: str = "libvorbis", quality: str = None, bitrate: str = None,
+                 sample_rate: str = None, channels: str = None, threads: str = None, min_bitrate: str = None):
+        self.name = name
+        self.codec = codec
+        self.quality = quality          # -q:a, codec specific scale
+        self.bitrate = bitrate          # -b:a, e.g. 64k
+        self.sample_rate = sample_rate  # Hz, None keeps the source rate
+        self.channels = channels        # None keeps the source channels
+        self.threads = threads          # Encoder threads, None lets ffmpeg decide
+        self.min_bitrate = min_bitrate  # kbit/s a source needs to be copied instead of encoded
+
+    def codec_args(self) -> list:
+        args = ["-c:a", self.codec]
+        if self.quality is not None:
+            args += ["-q:a", self.quality]
+        if self.bitrate is not None:
+            args += ["-b:a", self.bitrate]
+        if self.sample_rate is not None:
+            args += ["-ar", self.sample_rate]
+        if self.channels is not None:
+            args += ["-ac", self.channels]
+        if self.threads is not None:
+            args += ["-threads", self.threads]
+        return args + ["-vsync", "2"]
+
+    def accepts(self, probe: dict) -> bool:
+        # True when a source probed with probe_audio can be used as the
+        # output without encoding it again
+        stream = probe.get("stream", {})
+        if "ogg" not in probe.get("format_name", "").split(","):
+            return False
+        if stream.get("codec_name") != CODEC_NAMES.get(self.codec, self.codec):
+            return False
+        if self.sample_rate is not None and str(stream.get("sample_rate")) != self.sample_rate:
+            return False
+        if self.channels is not None and str(stream.get("channels")) != self.channels:
+            return False
+        min_bitrate = self.minimum_bitrate()
+        if min_bitrate is None:
+            return False
+        try:
+            bitrate = float(stream.get("bit_rate") or probe.get("bit_rate"))
+        except (TypeError, ValueError):
+            return False
+        return bitrate >= min_bitrate * 1000
+
+    def minimum_bitrate(self) -> float:
+        # kbit/s a source needs to be copied, None when it can't be told
+        try:
+            if self.min_bitrate is not None:
+                return float(self.min_bitrate)
+            if self.bitrate is not None:
+                return parse_bitrate(self.bitrate) * DERIVED_BITRATE_SHARE
+            if self.quality is not None and self.codec == "libvorbis":
+                level = min(max(math.floor(float(self.quality)), -1), 10)
+                return VORBIS_QUALITY_BITRATES[level] * DERIVED_BITRATE_SHARE
+        except ValueError:
+            pass
+        return None
+
+    def settings(self) -> dict:
+        return {key: getattr(self, key) for key in PROFILE_KEYS if getattr(self, key) is not None}
+
+
+def parse_bitrate(value: str) -> float:
+    # "64k" => 64.0 kbit/s, like ffmpeg's -b:a
+    value = value.strip().lower()
+    if value.endswith("k"):
+        return float(value[:-1])
+    if value.endswith("m"):
+        return float(value[:-1]) * 1000
+    return float(value) / 1000
+
+
+# Same arguments as the encode settings used before profiles existed
+DEFAULT_PROFILES = {"vorbis": EncoderProfile("vorbis", "libvorbis", quality="4")}
+
+
+def parse_profile(name: str, value: str) -> EncoderProfile:
+    settings = {}
+    for item in value.split(","):
+        if item.strip() == "":
+            continue
+        key, _, setting = item.partition("=")
+        key = key.strip()
+        if key not in PROFILE_KEYS:
+            raise ValueError(f"Unknown setting `{key}` in encoder profile: {name}")
+        settings[key] = setting.strip()
+    return EncoderProfile(name, **settings)
+
+
+def parse_profiles(config: dict) -> dict:
+    # Name => EncoderProfile from the profile.<name> keys of config.ini
+    profiles = dict(DEFAULT_PROFILES)
+    for key, value in config.items():
+        if key.startswith(PROFILE_PREFIX):
+            name = key[len(PROFILE_PREFIX):]
+            profiles[name] = parse_profile(name, value)
+    return profiles
+
+
+def parse_profile_map(value: str) -> dict:
+    # "SPO:speech,JIN:jingles" => {"SPO": "speech", "JIN": "jingles"}
+    profile_map = {}
+    for item in value.split(","):
+        if item.strip() == "":
+            continue
+        key, _, name = item.rpartition(":")
+        profile_map[key.strip()] = name.strip()
+    return profile_map
+
+
+class ProfileStats:
+    # Files, audio seconds and ffmpeg time per profile, shared by all
+    # workers, so profiles can be compared by their realtime factor
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, profile: EncoderProfile, result, input_size: int = 0):
+        with self._lock:
+            stats = self._stats.get(profile.name)
+            if stats is None:
+                stats = self._stats[profile.name] = {"profile": profile.name,
+                                                     **profile.settings(),
+                                                     "files": 0,
+                                                     "failed": 0,
+                                                     "audio_seconds": 0.0,
+                                                     "wall_seconds": 0.0,
+                                                     "cpu_seconds": 0.0,
+                                                     "bytes_in": 0,
+                                                     "bytes_out": 0}
+            stats["files"] += 1
+            if not result.ok:
+                stats["failed"] += 1
+                return
+            stats["wall_seconds"] += result.wall_time
+            stats["cpu_seconds"] += result.cpu_time
+            stats["audio_seconds"] += result.duration or 0.0
+            stats["bytes_in"] += input_size or 0
+            stats["bytes_out"] += result.output_size or 0
+
+    def summary(self) -> list:
+        rows = []
+        with self._lock:
+            for name, stats in sorted(self._stats.items()):
+                row = dict(stats)
+                for key in ("audio_seconds", "wall_seconds", "cpu_seconds"):
+                    row[key] = round(row[key], 3)
+                # Audio seconds encoded per second of wall clock and of CPU time
+                row["realtime_factor"] = round(stats["audio_seconds"] / stats["wall_seconds"], 2) \
+                    if stats["wall_seconds"] > 0 else None
+                row["cpu_realtime_factor"] = round(stats["audio_seconds"] / stats["cpu_seconds"], 2) \
+                    if stats["cpu_seconds"] > 0 else None
+                rows.append(row)
+        return rows
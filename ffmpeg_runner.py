@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import uuid
+import threading
+from subprocess import Popen, PIPE, DEVNULL, run, TimeoutExpired
+from timeit import default_timer as timer
+
+from encoder_profiles import DEFAULT_PROFILES
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+
+
+class FFmpegResult:
+    def __init__(self, argv: list):
+        self.argv = argv
+        self.returncode = None
+        self.stderr = ""
+        self.timed_out = False
+        self.wall_time = 0.0   # seconds
+        self.cpu_time = 0.0    # seconds, user + system time of the ffmpeg process
+
+        # Filled in from ffmpeg's -progress report, None when not reported
+        self.duration = None     # seconds of audio written
+        self.output_size = None  # bytes
+        self.bitrate = None      # kbit/s
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+    def error_message(self) -> str:
+        if self.timed_out:
+            return f"Timed out after {self.wall_time:.1f} seconds"
+        if self.stderr != "":
+            return self.stderr
+        return f"ffmpeg exited with code {self.returncode}"
+
+    def failure_details(self) -> dict:
+        # Fields added to the record of a failed conversion
+        return {"ffmpeg_returncode": self.returncode,
+                "ffmpeg_timed_out": self.timed_out,
+                "ffmpeg_error": self.error_message()}
+
+
+def make_ffmpeg_args(input_file: str, output_file: str, codec_args: list = None, ffmpeg: str = FFMPEG) -> list:
+    if codec_args is None:
+        codec_args = DEFAULT_PROFILES["vorbis"].codec_args()
+
+    # -progress writes key=value stats to stdout; the final block, written after
+    # the output is closed, gives the duration, size and bitrate of the output
+    # so it doesn't have to be probed again.
+    return [ffmpeg, "-y", "-i", input_file, "-nostats", "-loglevel", "error", "-progress", "pipe:1",
+            *codec_args, output_file]
+
+
+def run_ffmpeg(input_file: str, output_file: str, codec_args: list = None, timeout: float = None,
+               ffmpeg: str = FFMPEG) -> FFmpegResult:
+    # ffmpeg writes to a temporary file next to the output, which is only
+    # renamed into place once ffmpeg exits cleanly. A run that fails or gets
+    # killed never leaves a partial file under the output name.
+    partial_file = make_partial_filename(output_file)
+
+    argv = make_ffmpeg_args(input_file, partial_file, codec_args, ffmpeg)
+    result = run_process(argv, timeout)
+
+    try:
+        if result.ok:
+            os.replace(partial_file, output_file)
+        elif os.path.exists(partial_file):
+            os.remove(partial_file)
+    except OSError as e:
+        result.returncode = -1
+        result.stderr = f"Failed to move {partial_file} to {output_file}: {e}"
+
+    return result
+
+
+# CHR0001.ogg is written as CHR0001.partial-1f2e3d4c.ogg, keeping the extension
+# so ffmpeg still picks the output format from it
+PARTIAL_PATTERN = re.compile(r"\.partial-[0-9a-f]{8}(\.[^.]*)?$")
+
+
+def make_partial_filename(output_file: str) -> str:
+    base, ext = os.path.splitext(output_file)
+    return f"{base}.partial-{uuid.uuid4().hex[:8]}{ext}"
+
+
+def cleanup_partial_outputs(folder: str) -> int:
+    # Remove temporaries left behind by runs that were killed mid-transcode
+    if not os.path.isdir(folder):
+        return 0
+
+    removed = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and PARTIAL_PATTERN.search(entry.name):
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError as e:
+                    print(f"Failed to remove partial output {entry.path}: {e}")
+
+    return removed
+
+
+def run_process(argv: list, timeout: float = None) -> FFmpegResult:
+    # Exec the program directly (no shell) and wait for it, killing it if it
+    # runs past `timeout` seconds.
+    result = FFmpegResult(argv)
+
+    start_time = timer()
+    try:
+        proc = Popen(argv, stdin=DEVNULL, stdout=PIPE, stderr=PIPE)
+    except OSError as e:
+        result.returncode = -1
+        result.stderr = f"Failed to start {argv[0]}: {e}"
+        return result
+
+    watchdog = None
+    if timeout:
+        watchdog = threading.Timer(timeout, _kill, (proc, result))
+        watchdog.daemon = True
+        watchdog.start()
+
+    # stderr is drained on its own thread so neither pipe can fill up and
+    # stall ffmpeg while the other one is being read.
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    stderr_reader.start()
+
+    try:
+        progress = {}
+        for line in proc.stdout:
+            key, _, value = line.decode("utf-8", errors="replace").strip().partition("=")
+            progress[key] = value
+        stderr_reader.join()
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+        if watchdog is not None:
+            watchdog.cancel()
+
+    stderr = b"".join(stderr_chunks)
+    _read_progress(progress, result)
+
+    result.returncode, result.cpu_time = _wait(proc)
+    result.wall_time = timer() - start_time
+    result.stderr = stderr.decode("utf-8", errors="replace").strip()
+
+    return result
+
+
+def _read_progress(progress: dict, result: FFmpegResult):
+    # Only trust the report ffmpeg writes once it has finished
+    if progress.get("progress") != "end":
+        return
+
+    # out_time_ms is in microseconds as well, older builds only write that one
+    out_time = progress.get("out_time_us", progress.get("out_time_ms", ""))
+    if out_time.lstrip("-").isdigit() and int(out_time) >= 0:
+        result.duration = int(out_time) / 1_000_000
+
+    total_size = progress.get("total_size", "")
+    if total_size.isdigit():
+        result.output_size = int(total_size)
+
+    bitrate = progress.get("bitrate", "").replace("kbits/s", "")
+    try:
+        result.bitrate = float(bitrate)
+    except ValueError:
+        result.bitrate = None
+
+
+def _kill(proc: Popen, result: FFmpegResult):
+    result.timed_out = True
+    proc.kill()
+
+
+def _wait(proc: Popen) -> tuple:
+    # Reap the process and return (returncode, cpu seconds)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, usage.ru_utime + usage.ru_stime
+
+    proc.wait()
+    return proc.returncode, _windows_cpu_time(proc)
+
+
+def _windows_cpu_time(proc: Popen) -> float:
+    import ctypes
+    from ctypes import wintypes
+
+    creation_time = wintypes.FILETIME()
+    exit_time = wintypes.FILETIME()
+    kernel_time = wintypes.FILETIME()
+    user_time = wintypes.FILETIME()
+
+    if not ctypes.windll.kernel32.GetProcessTimes(int(proc._handle), ctypes.byref(creation_time),
+                                                  ctypes.byref(exit_time), ctypes.byref(kernel_time),
+                                                  ctypes.byref(user_time)):
+        return 0.0
+
+    # FILETIME counts in 100 nanosecond units
+    def to_seconds(filetime):
+        return ((filetime.dwHighDateTime << 32) + filetime.dwLowDateTime) / 10_000_000
+
+    return to_seconds(kernel_time) + to_seconds(user_time)
+
+
+def probe_format(filepath: str, timeout: float = None, ffprobe: str = FFPROBE) -> dict:
+    # Returns ffprobe's format section (duration, bit_rate, tags, ...) as a
+    # dict, or None when the file couldn't be probed
+    probe = run_ffprobe([ffprobe, "-v", "quiet", "-of", "json", "-show_format", filepath], timeout)
+    if probe is None:
+        return None
+    return probe.get("format", {})
+
+
+def probe_audio(filepath: str, timeout: float = None, ffprobe: str = FFPROBE) -> dict:
+    # Like probe_format, with the first audio stream (codec_name,
+    # sample_rate, channels, bit_rate, tags, ...) added as "stream"
+    probe = run_ffprobe([ffprobe, "-v", "quiet", "-of", "json", "-show_format", "-show_streams",
+                         "-select_streams", "a:0", filepath], timeout)
+    if probe is None:
+        return None
+
+    streams = probe.get("streams", [])
+    return {**probe.get("format", {}), "stream": streams[0] if len(streams) > 0 else {}}
+
+
+def run_ffprobe(argv: list, timeout: float = None) -> dict:
+    try:
+        result = run(argv, stdin=DEVNULL, capture_output=True, timeout=timeout)
+    except (OSError, TimeoutExpired):
+        return None
+
+    if result.returncode != 0:
+        return None
+
+    try:
+        return json.loads(result.stdout.decode("utf-8", errors="replace"))
+    except ValueError:
+        return None
+
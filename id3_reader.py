@@ -0,0 +1,242 @@
+import os
+import struct
+
+# Reads title, artist and duration of an mp3 from its ID3 tags and MPEG frame
+# headers with a few small reads, without starting ffprobe.
+
+ID3V1_SIZE = 128
+SYNC_SCAN_SIZE = 64 * 1024  # bytes searched for the first frame after the tag
+
+# kbit/s by [version][layer][bitrate index], version 1 is MPEG-1, 2 is MPEG-2 and 2.5
+BITRATES = {
+    1: {1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]},
+    2: {1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]},
+}
+
+# Hz by version bits of the frame header
+SAMPLE_RATES = {3: [44100, 48000, 32000],    # MPEG-1
+                2: [22050, 24000, 16000],    # MPEG-2
+                0: [11025, 12000, 8000]}     # MPEG-2.5
+
+TEXT_FRAMES = {b"TIT2": "title", b"TPE1": "artist",
+               b"TT2": "title", b"TP1": "artist"}   # ID3v2.2 ids
+
+TEXT_ENCODINGS = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}
+
+
+def read_mp3_info(filepath: str) -> dict:
+    # Returns a dict with title and artist (when tagged) and duration in
+    # milliseconds, or None when no MPEG audio frame could be found
+    try:
+        with open(filepath, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+
+            data, audio_start = read_id3v2(f)
+
+            f.seek(audio_start)
+            frame = find_first_frame(f.read(SYNC_SCAN_SIZE))
+            if frame is None:
+                return None
+
+            has_id3v1 = False
+            if file_size >= audio_start + ID3V1_SIZE:
+                f.seek(file_size - ID3V1_SIZE)
+                id3v1 = read_id3v1(f.read(ID3V1_SIZE))
+                if id3v1 is not None:
+                    has_id3v1 = True
+                    # ID3v1 only fills in what the v2 tag doesn't have
+                    for key, value in id3v1.items():
+                        data.setdefault(key, value)
+    except (OSError, struct.error, IndexError, ValueError):
+        # Unreadable, or a truncated or corrupt tag: left to ffprobe
+        return None
+
+    offset, header, xing_frames = frame
+    audio_size = file_size - audio_start - offset - (ID3V1_SIZE if has_id3v1 else 0)
+
+    if xing_frames is not None:
+        seconds = xing_frames * header["samples"] / header["sample_rate"]
+    else:
+        # No VBR header, assume constant bitrate like ffprobe does
+        seconds = audio_size * 8 / (header["bitrate"] * 1000)
+
+    data["duration"] = int(seconds * 1000)
+    return data
+
+
+def read_id3v2(f) -> tuple:
+    # Returns (tags, offset of the first byte after the tag)
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return {}, 0
+
+    major = header[3]
+    flags = header[5]
+    size = syncsafe(header[6:10])
+    audio_start = 10 + size + (10 if flags & 0x10 else 0)  # v2.4 footer
+
+    if major not in (2, 3, 4):
+        return {}, audio_start
+
+    body = f.read(size)
+
+    # Unsynchronisation of the whole tag (v2.2 / v2.3)
+    if flags & 0x80 and major < 4:
+        body = body.replace(b"\xff\x00", b"\xff")
+
+    pos = 0
+    if flags & 0x40 and major > 2:
+        # Skip the extended header
+        if major == 3:
+            pos = 4 + struct.unpack(">I", body[:4])[0]
+        else:
+            pos = syncsafe(body[:4])
+
+    return read_id3v2_frames(body, pos, major), audio_start
+
+
+def read_id3v2_frames(body: bytes, pos: int, major: int) -> dict:
+    data = {}
+    id_size = 3 if major == 2 else 4
+    header_size = 6 if major == 2 else 10
+
+    while pos + header_size <= len(body):
+        frame_id = body[pos:pos + id_size]
+        if frame_id[0] == 0:
+            break   # Padding
+
+        if major == 2:
+            frame_size = int.from_bytes(body[pos + 3:pos + 6], "big")
+            frame_flags = 0
+        elif major == 3:
+            frame_size = struct.unpack(">I", body[pos + 4:pos + 8])[0]
+            frame_flags = 0
+        else:
+            frame_size = syncsafe(body[pos + 4:pos + 8])
+            frame_flags = body[pos + 9]
+
+        pos += header_size
+        frame = body[pos:pos + frame_size]
+        pos += frame_size
+
+        key = TEXT_FRAMES.get(frame_id)
+        if key is None or key in data or len(frame) == 0:
+            continue
+
+        if major == 4:
+            if frame_flags & 0x01:
+                frame = frame[4:]   # Data length indicator
+            if frame_flags & 0x02:
+                frame = frame.replace(b"\xff\x00", b"\xff")
+            if frame_flags & 0x0c:
+                continue    # Compressed or encrypted
+
+        value = decode_text(frame)
+        if value is not None:
+            data[key] = value
+
+    return data
+
+
+def decode_text(frame: bytes) -> str:
+    encoding = TEXT_ENCODINGS.get(frame[0])
+    if encoding is None:
+        return None
+
+    try:
+        value = frame[1:].decode(encoding)
+    except UnicodeDecodeError:
+        return None
+
+    # v2.4 can hold several values separated by nulls, keep the first
+    return value.split("\x00")[0].replace("\n", "").replace("\r", "").strip()
+
+
+def read_id3v1(tag: bytes) -> dict:
+    if len(tag) < ID3V1_SIZE or tag[:3] != b"TAG":
+        return None
+
+    data = {}
+    for key, start in (("title", 3), ("artist", 33)):
+        value = tag[start:start + 30].split(b"\x00")[0].decode("latin-1").strip()
+        if value != "":
+            data[key] = value
+    return data
+
+
+def syncsafe(raw: bytes) -> int:
+    return (raw[0] << 21) | (raw[1] << 14) | (raw[2] << 7) | raw[3]
+
+
+def parse_frame_header(raw: bytes) -> dict:
+    if len(raw) < 4 or raw[0] != 0xFF or raw[1] & 0xE0 != 0xE0:
+        return None
+
+    version_bits = (raw[1] >> 3) & 0x03
+    layer_bits = (raw[1] >> 1) & 0x03
+    bitrate_index = raw[2] >> 4
+    sample_rate_index = (raw[2] >> 2) & 0x03
+    padding = (raw[2] >> 1) & 0x01
+    channel_mode = raw[3] >> 6
+
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    version = 1 if version_bits == 3 else 2
+    layer = 4 - layer_bits
+    bitrate = BITRATES[version][layer][bitrate_index]
+    sample_rate = SAMPLE_RATES[version_bits][sample_rate_index]
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        length = samples // 8 * bitrate * 1000 // sample_rate + padding
+
+    return {"version": version,
+            "layer": layer,
+            "bitrate": bitrate,
+            "sample_rate": sample_rate,
+            "samples": samples,
+            "mono": channel_mode == 3,
+            "length": length}
+
+
+def find_first_frame(buffer: bytes) -> tuple:
+    # Returns (offset, header, frame count from a Xing/Info/VBRI header or
+    # None) for the first frame that is followed by another valid frame
+    pos = buffer.find(b"\xff")
+    while 0 <= pos < len(buffer) - 4:
+        header = parse_frame_header(buffer[pos:pos + 4])
+        if header is not None:
+            next_pos = pos + header["length"]
+            if next_pos + 4 > len(buffer) or parse_frame_header(buffer[next_pos:next_pos + 4]) is not None:
+                return pos, header, read_vbr_frames(buffer[pos:next_pos], header)
+        pos = buffer.find(b"\xff", pos + 1)
+
+    return None
+
+
+def read_vbr_frames(frame: bytes, header: dict) -> int:
+    # The Xing/Info header sits after the side information of the first frame
+    if header["version"] == 1:
+        side_info = 17 if header["mono"] else 32
+    else:
+        side_info = 9 if header["mono"] else 17
+
+    xing = frame[4 + side_info:]
+    if xing[:4] in (b"Xing", b"Info") and len(xing) >= 12:
+        flags = struct.unpack(">I", xing[4:8])[0]
+        if flags & 0x01:
+            return struct.unpack(">I", xing[8:12])[0]
+
+    vbri = frame[36:]
+    if vbri[:4] == b"VBRI" and len(vbri) >= 18:
+        return struct.unpack(">I", vbri[14:18])[0]
+
+    return None
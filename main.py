@@ -2,6 +2,7 @@ import json
 from pathlib import Path
 import argparse
 from audio_convert import AudioConverter
+from scheduler import parse_workers
 
 def get_config(config_file: str) -> dict:
     config = {}
@@ -11,7 +12,7 @@ def get_config(config_file: str) -> dict:
         for line in config_data:
             if line.startswith("#") or line == "": # Skip comments and empty lines
                 continue
-            key, value = line.split("=") # Split the line into key and value
+            key, value = line.split("=", 1) # Split the line into key and value, values may contain "="
             print(f"{key}: {value}")
             config[key] = value
 
@@ -34,7 +35,6 @@ def make_row_dict(node_id: int, item: dict) -> dict:
 if __name__ == "__main__":
     config_ini = "config.ini"
     config = get_config(config_ini)
-    audio_converter = AudioConverter(**config)
 
     parser = argparse.ArgumentParser(description="Convert and rename audio files")
 
@@ -45,24 +45,51 @@ if __name__ == "__main__":
     parser.add_argument("--w", action="store_true", help="Walks through MP3 folders")
     parser.add_argument("--t", action="store_true", help="Convert prepared files")
     parser.add_argument("--l", action="store_true", help="List audio files")
+    parser.add_argument("--follow", action="store_true", help="With --t, convert files while --w is still writing them")
+    parser.add_argument("--pipeline", action="store_true", help="With --m or --w, run all stages at the same time (--w also converts)")
+    parser.add_argument("--workers", type=int, help="Number of parallel conversions (overrides config.ini)")
     args = parser.parse_args()
 
-    if args.c:
-        audio_converter.convert()
-    elif args.p:
-        audio_converter.process_import_data()
-    elif args.r:
-        audio_converter.rename_converted_files()
-    elif args.m:
-        audio_converter.convert_mp3_to_ogg()
-    elif args.w:
-        audio_converter.prepare_files_for_conversion(audio_converter.chamgei_music_folder)
-    elif args.t:
-        audio_converter.convert_prepared_files()
-    elif args.l:
-        audio_converter.list_audio_files()
-    else:
-        parser.print_help()
-        print('\n')
-        print("Please provide an argument")
+    if args.workers is not None:
+        # Set before the converter is built, so the probe and placement
+        # workers follow it and autotune never goes past it
+        workers = str(parse_workers(args.workers))
+        config["workers"] = workers
+        config["max_workers"] = workers
+
+    audio_converter = AudioConverter(**config)
+
+    # Name shown in the progress lines and status file
+    modes = {"c": "convert", "p": "process", "r": "rename", "m": "mp3", "w": "walk", "t": "prepared", "l": "list"}
+    mode = next((name for flag, name in modes.items() if getattr(args, flag)), None)
+    if mode is not None:
+        if args.pipeline and mode in ("mp3", "walk"):
+            mode = f"{mode}_pipeline"
+        audio_converter.start_progress(mode)
+
+    try:
+        if args.c:
+            audio_converter.convert()
+        elif args.p:
+            audio_converter.process_import_data()
+        elif args.r:
+            audio_converter.rename_converted_files()
+        elif args.m and args.pipeline:
+            audio_converter.convert_mp3_pipeline()
+        elif args.m:
+            audio_converter.convert_mp3_to_ogg()
+        elif args.w and args.pipeline:
+            audio_converter.convert_tree_pipeline(audio_converter.chamgei_music_folder)
+        elif args.w:
+            audio_converter.prepare_files_for_conversion(audio_converter.chamgei_music_folder)
+        elif args.t:
+            audio_converter.convert_prepared_files(follow=args.follow)
+        elif args.l:
+            audio_converter.list_audio_files()
+        else:
+            parser.print_help()
+            print('\n')
+            print("Please provide an argument")
+    finally:
+        audio_converter.close()
 
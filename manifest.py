@@ -0,0 +1,100 @@
+import os
+import time
+import sqlite3
+import threading
+
+DONE = "done"
+FAILED = "failed"
+
+
+class ConversionManifest:
+    # Records every conversion in a local SQLite database so a re-run can tell
+    # finished outputs from ones left behind by a crash. Entries are keyed on
+    # the pipeline and the source path, and only count while the source still
+    # has the size and mtime it had when it was converted.
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+
+        # Workers record their results directly, access is serialised by _lock
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS conversions ("
+                          "pipeline TEXT NOT NULL, "
+                          "source_path TEXT NOT NULL, "
+                          "source_size INTEGER, "
+                          "source_mtime_ns INTEGER, "
+                          "status TEXT, "
+                          "output_path TEXT, "
+                          "output_size INTEGER, "
+                          "duration_ms REAL, "
+                          "error TEXT, "
+                          "updated_at REAL, "
+                          "PRIMARY KEY (pipeline, source_path))")
+        self.conn.commit()
+
+    def lookup(self, pipeline: str, source_path: str, source_stat: os.stat_result) -> dict:
+        # Returns the entry for the source, or None when there is none or the
+        # source changed since it was recorded
+        with self._lock:
+            row = self.conn.execute("SELECT status, output_path, output_size, duration_ms, error, "
+                                    "source_size, source_mtime_ns FROM conversions "
+                                    "WHERE pipeline = ? AND source_path = ?",
+                                    (pipeline, source_path)).fetchone()
+        if row is None:
+            return None
+
+        status, output_path, output_size, duration_ms, error, source_size, source_mtime_ns = row
+        if source_size != source_stat.st_size or source_mtime_ns != source_stat.st_mtime_ns:
+            return None
+
+        return {"status": status,
+                "output_path": output_path,
+                "output_size": output_size,
+                "duration_ms": duration_ms,
+                "error": error}
+
+    def finished(self, pipeline: str, source_path: str, source_stat: os.stat_result) -> dict:
+        # Returns the entry when the source was converted and its output is
+        # still on disk with the size that was recorded, otherwise None
+        entry = self.lookup(pipeline, source_path, source_stat)
+        if entry is None or entry["status"] != DONE:
+            return None
+
+        try:
+            if os.path.getsize(entry["output_path"]) != entry["output_size"]:
+                return None
+        except OSError:
+            return None
+
+        return entry
+
+    def mark_done(self, pipeline: str, source_path: str, source_stat: os.stat_result,
+                  output_path: str, duration_ms: float):
+        output_size = os.path.getsize(output_path)
+        self._save(pipeline, source_path, source_stat, DONE, output_path, output_size, duration_ms, None)
+
+    def mark_failed(self, pipeline: str, source_path: str, source_stat: os.stat_result, error: str):
+        self._save(pipeline, source_path, source_stat, FAILED, None, None, None, error)
+
+    def update_output(self, pipeline: str, source_path: str, output_path: str):
+        # The output was moved, e.g. renamed to its track id
+        with self._lock:
+            self.conn.execute("UPDATE conversions SET output_path = ?, updated_at = ? "
+                              "WHERE pipeline = ? AND source_path = ?",
+                              (output_path, time.time(), pipeline, source_path))
+            self.conn.commit()
+
+    def _save(self, pipeline, source_path, source_stat, status, output_path, output_size, duration_ms, error):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO conversions (pipeline, source_path, source_size, "
+                              "source_mtime_ns, status, output_path, output_size, duration_ms, error, updated_at) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (pipeline, source_path, source_stat.st_size, source_stat.st_mtime_ns, status,
+                               output_path, output_size, duration_ms, error, time.time()))
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
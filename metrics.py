@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import math
+import threading
+from array import array
+from timeit import default_timer as timer
+
+
+class StageTiming:
+    # Handed out by Metrics.timed(), the caller can fill in what it learns
+    # while the stage runs
+    __slots__ = ("bytes_in", "bytes_out", "ok")
+
+    def __init__(self, bytes_in: int = 0):
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.ok = True
+
+
+class StageStats:
+    __slots__ = ("count", "errors", "total", "max", "durations", "bytes_in", "bytes_out")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.durations = array('d')
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def add(self, seconds: float, bytes_in: int, bytes_out: int, ok: bool):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.durations.append(seconds)
+        self.bytes_in += bytes_in or 0
+        self.bytes_out += bytes_out or 0
+        if not ok:
+            self.errors += 1
+
+    def p95(self) -> float:
+        if len(self.durations) == 0:
+            return 0.0
+        ordered = sorted(self.durations)
+        return ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)]
+
+
+class Metrics:
+    # Latency and byte counts per (stage, category), shared by all workers.
+    # Stages are e.g. dbf_read, source_check, transcode, probe, json_write
+    # and db_query, the category is the DBF category or mp3 folder.
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, stage: str, seconds: float, category: str = "", bytes_in: int = 0, bytes_out: int = 0,
+               ok: bool = True):
+        with self._lock:
+            stats = self._stats.get((stage, category))
+            if stats is None:
+                stats = self._stats[(stage, category)] = StageStats()
+            stats.add(seconds, bytes_in, bytes_out, ok)
+
+    def timed(self, stage: str, category: str = "", bytes_in: int = 0):
+        return _Timer(self, stage, category, bytes_in)
+
+    def timed_iter(self, stage: str, iterable, category: str = "", bytes_in: int = 0):
+        # Passes the items of iterable through and records the time spent
+        # producing them as one observation once it is exhausted
+        iterator = iter(iterable)
+        elapsed = 0.0
+        ok = True
+        try:
+            while True:
+                start = timer()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    elapsed += timer() - start
+                    break
+                except Exception:
+                    elapsed += timer() - start
+                    ok = False
+                    raise
+                elapsed += timer() - start
+                yield item
+        finally:
+            self.record(stage, elapsed, category, bytes_in, 0, ok)
+
+    def summary(self) -> list:
+        rows = []
+        with self._lock:
+            for (stage, category), stats in sorted(self._stats.items()):
+                rows.append({"stage": stage,
+                             "category": category,
+                             "count": stats.count,
+                             "errors": stats.errors,
+                             "total_seconds": round(stats.total, 6),
+                             "mean_seconds": round(stats.total / stats.count, 6) if stats.count else 0.0,
+                             "p95_seconds": round(stats.p95(), 6),
+                             "max_seconds": round(stats.max, 6),
+                             "bytes_in": stats.bytes_in,
+                             "bytes_out": stats.bytes_out})
+        return rows
+
+    def write_jsonl(self, filename: str):
+        # Appends one line per stage and category, runs are told apart by
+        # their start time
+        with open(filename, "a", encoding="utf-8") as f:
+            for row in self.summary():
+                row = {"run_started": self.started, **row}
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def write_prometheus(self, filename: str):
+        # Textfile collector format. Written to a temporary and moved in
+        # place so the collector never reads half a file.
+        # Each metric family is written as one block, HELP and TYPE first
+        rows = [(f'stage="{_label(row["stage"])}",category="{_label(row["category"])}"', row)
+                for row in self.summary()]
+
+        lines = ["# HELP audio_convert_stage_seconds Time spent per stage and category",
+                 "# TYPE audio_convert_stage_seconds summary"]
+        for labels, row in rows:
+            lines.append(f'audio_convert_stage_seconds{{{labels},quantile="0.95"}} {row["p95_seconds"]}')
+            lines.append(f'audio_convert_stage_seconds_sum{{{labels}}} {row["total_seconds"]}')
+            lines.append(f'audio_convert_stage_seconds_count{{{labels}}} {row["count"]}')
+
+        for name, key, help_text in [("errors_total", "errors", "Failed operations per stage and category"),
+                                     ("bytes_in_total", "bytes_in", "Bytes read per stage and category"),
+                                     ("bytes_out_total", "bytes_out", "Bytes written per stage and category")]:
+            lines.append(f"# HELP audio_convert_stage_{name} {help_text}")
+            lines.append(f"# TYPE audio_convert_stage_{name} counter")
+            for labels, row in rows:
+                lines.append(f'audio_convert_stage_{name}{{{labels}}} {row[key]}')
+
+        temp = f"{filename}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp, filename)
+
+
+class _Timer:
+    def __init__(self, metrics: Metrics, stage: str, category: str, bytes_in: int):
+        self.metrics = metrics
+        self.stage = stage
+        self.category = category
+        self.timing = StageTiming(bytes_in)
+
+    def __enter__(self) -> StageTiming:
+        self.start = timer()
+        return self.timing
+
+    def __exit__(self, exc_type, exc, tb):
+        timing = self.timing
+        self.metrics.record(self.stage, timer() - self.start, self.category, timing.bytes_in, timing.bytes_out,
+                            timing.ok and exc_type is None)
+        return False
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,5 +1,33 @@
-import winreg
-import pyodbc
+import sqlite3
+from timeit import default_timer as timer
+
+# Only available on the Windows hosts that run StudioONE, the SQLite stand-in
+# works without them
+try:
+    import winreg
+except ImportError:
+    winreg = None
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+def make_insert_sql(table: str, columns: list) -> str:
+    placeholders = ", ".join(["?"] * len(columns))
+    return f"Insert into {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+def format_sql_value(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, str):
+        # Values are written in double quotes, a quote inside is doubled
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+def make_insert_stmt(table: str, columns: list, row: tuple) -> str:
+    values = ",".join(format_sql_value(value) for value in row)
+    return f"Insert into {table} ({','.join(columns)}) VALUES ({values});"
 
 def read_registry()->dict:
     access_reg = winreg.ConnectRegistry(None, winreg.HKEY_LOCAL_MACHINE)
@@ -25,6 +53,9 @@ def read_registry()->dict:
     return conn
 
 class MSSQLData:
+    db_error = pyodbc.Error if pyodbc else Exception
+    metrics = None  # metrics.Metrics, set by the caller to time round-trips
+
     def __init__(self, server, database, username, password):
         self._server = server      
         self._database = database  
@@ -48,33 +79,74 @@ class MSSQLData:
     def server(self):
         return self._server
 
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
     def connect(self):
+        # The connection is kept open and reused until disconnect(), so
+        # repeated lookups don't pay for a login each time
+        if self.conn is not None:
+            return True
+
         try:
-            self.conn = pyodbc.connect(self.conn_str)
+            self.conn = self.open_connection()
             return True
-        except pyodbc.Error as ex:
+        except self.db_error as ex:
             sqlstate = ex.args[0]
             print(f"Error connecting to database: {sqlstate}")
             return False
 
+    def open_connection(self):
+        return pyodbc.connect(self.conn_str)
+
     def disconnect(self):
         if self.conn:
-            self.conn.close()
+            try:
+                self.conn.close()
+            except self.db_error:
+                pass    # Already broken
             self.conn = None
 
-    def execute_query(self, query: str):
-        if not self.conn:
-            if not self.connect():
-                return None
-        cursor = self.conn.cursor()
+    def is_connection_error(self, ex) -> bool:
+        # SQLSTATE class 08 covers connection failures, e.g. 08S01 link failure
+        return str(ex.args[0]).startswith("08")
+
+    def execute_query(self, query: str, params: tuple = ()):
+        start = timer()
+        rows = None
         try:
-            cursor.execute(query)
-            rows = cursor.fetchall()
+            rows = self.run_query(query, params)
             return rows
-        except pyodbc.Error as ex:
-            sqlstate = ex.args[0]
-            print(f"Error executing query: {sqlstate}")
-            return None
+        finally:
+            self.record_round_trip("db_query", start, rows is not None)
+
+    def run_query(self, query: str, params: tuple = ()):
+        # Retries once on a fresh connection if the open one has dropped
+        for attempt in range(2):
+            if not self.connect():
+                return None
+
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                return rows
+            except self.db_error as ex:
+                if attempt == 0 and self.is_connection_error(ex):
+                    print("Lost connection to database, reconnecting...")
+                    self.disconnect()
+                    continue
+                sqlstate = ex.args[0]
+                print(f"Error executing query: {sqlstate}")
+                return None
+            finally:
+                cursor.close()
+
+        return None
 
     def execute_non_query(self, query):
         print(query)
@@ -86,8 +158,97 @@ class MSSQLData:
             cursor.execute(query)
             self.conn.commit()
             return True
-        except pyodbc.Error as ex:
+        except self.db_error as ex:
             sqlstate = ex.args[0]
             print(f"Error executing non-query: {sqlstate}")
             return False
-            
\ No newline at end of file
+
+    def bulk_insert(self, inserts: list, batch_size: int = 1000) -> bool:
+        # inserts is a list of (table, columns, rows). Everything is loaded in
+        # one transaction, rows are sent batch_size at a time. If the
+        # connection drops, the whole transaction is replayed once on a fresh one.
+        start_time = timer()
+        ok = False
+        try:
+            for attempt in range(2):
+                if not self.connect():
+                    return False
+
+                cursor = self.conn.cursor()
+                self.prepare_bulk_cursor(cursor)
+                try:
+                    for table, columns, rows in inserts:
+                        sql = make_insert_sql(table, columns)
+                        for start in range(0, len(rows), batch_size):
+                            cursor.executemany(sql, rows[start:start + batch_size])
+                    self.conn.commit()
+                    ok = True
+                    return True
+                except self.db_error as ex:
+                    self.rollback()
+                    if attempt == 0 and self.is_connection_error(ex):
+                        print("Lost connection to database, reconnecting...")
+                        self.disconnect()
+                        continue
+                    print(f"Error importing rows: {ex.args[0]}")
+                    return False
+                finally:
+                    try:
+                        cursor.close()
+                    except self.db_error:
+                        pass    # Already broken
+
+            return False
+        finally:
+            self.record_round_trip("db_bulk_insert", start_time, ok)
+
+    def rollback(self):
+        try:
+            self.conn.rollback()
+        except self.db_error:
+            pass    # The link is gone, the server drops the transaction itself
+
+    def record_round_trip(self, stage: str, start: float, ok: bool):
+        if self.metrics is not None:
+            self.metrics.record(stage, timer() - start, ok=ok)
+
+    def prepare_bulk_cursor(self, cursor):
+        # Sends each batch as one parameter array instead of a round-trip per row
+        cursor.fast_executemany = True
+
+
+class SQLiteData(MSSQLData):
+    # Local stand-in for the StudioONE database, for trying imports without a server
+    db_error = sqlite3.Error
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._database = filename
+        self._server = "sqlite"
+        self.conn = None
+
+    def open_connection(self):
+        # Like a pyodbc connection it is used from whichever thread does the
+        # import, e.g. the import stage of a pipeline
+        conn = sqlite3.connect(self._filename, check_same_thread=False)
+        self.create_tables(conn)
+        return conn
+
+    def is_connection_error(self, ex) -> bool:
+        return False
+
+    def create_tables(self, conn):
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS Tracks ("
+            "  TrackReference INTEGER PRIMARY KEY, TrackTitle TEXT, ArtistSearch TEXT, FilePath TEXT,"
+            "  Class TEXT, Duration INTEGER, Year INTEGER, FadeIn INTEGER, FadeOut INTEGER,"
+            "  FadeDelay INTEGER, Intro INTEGER, Extro INTEGER, FolderID INTEGER, OnStartEvent INTEGER,"
+            "  OnStopEvent INTEGER, DisableNotify INTEGER, PhysicalStorageUsed REAL, TrackMediaType TEXT,"
+            "  ArtistID_1 INTEGER, Old_Filename TEXT);"
+            "CREATE TABLE IF NOT EXISTS Artists (ArtistID INTEGER PRIMARY KEY, ArtistSurname TEXT, ArtistType TEXT);"
+            "CREATE TABLE IF NOT EXISTS Tree (NodeID INTEGER PRIMARY KEY, NodeName TEXT);"
+            "CREATE TABLE IF NOT EXISTS System (DefRecordLocation TEXT);")
+        conn.commit()
+
+    def prepare_bulk_cursor(self, cursor):
+        pass
@@ -0,0 +1,303 @@
+import queue
+import threading
+from timeit import default_timer as timer
+
+END = object()  # Put on a stage queue once per worker when its input is exhausted
+
+
+class PipelineStage:
+    # One step of a Pipeline. `func` takes an item and returns the item for
+    # the next stage, or None to drop it. With many=True it returns a list
+    # of items instead, possibly empty. `finish` is called once after the
+    # last item went through, e.g. to flush a batch. With max_workers above
+    # workers the pipeline adds and removes workers as the load changes,
+    # between 1 and max_workers. `blocked` returns how many workers are
+    # waiting on something outside the pipeline, e.g. for scratch space,
+    # which counts like waiting for room in the next queue.
+    def __init__(self, name: str, func, workers: int = 1, queue_size: int = 100, finish=None,
+                 max_workers: int = None, many: bool = False, blocked=None):
+        self.name = name
+        self.func = func
+        self.many = many
+        self.blocked = blocked
+        self.workers = workers      # Worker threads running
+        self.target = workers       # Workers wanted, extra ones exit after their item
+        self.max_workers = max_workers if max_workers is not None else workers
+        self.finish = finish
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.ended = False
+
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.max_depth = 0
+        self.queue_wait = 0.0       # Seconds items spent in the queue, in total
+        self.idle_workers = 0       # Workers waiting for an item
+        self.blocked_workers = 0    # Workers waiting for room in the next queue
+        self._lock = threading.Lock()
+        self._reset_window()
+
+    def _reset_window(self):
+        # Observations since the last autotune
+        self.window_items = 0
+        self.window_wait = 0.0      # Seconds items waited in the queue
+        self.window_samples = 0
+        self.window_idle = 0.0      # Sum of the idle share of the workers per sample
+        self.window_blocked = 0.0   # Sum of the blocked share of the workers per sample
+
+    def sample(self):
+        blocked_outside = self.blocked() if self.blocked is not None else 0
+        with self._lock:
+            if self.workers > 0:
+                self.window_samples += 1
+                self.window_idle += self.idle_workers / self.workers
+                self.window_blocked += min(1.0, (self.blocked_workers + blocked_outside) / self.workers)
+
+    def oldest_wait(self) -> float:
+        # Seconds the item at the head of the queue has been waiting
+        with self.queue.mutex:
+            if len(self.queue.queue) == 0:
+                return 0.0
+            queued_at, item = self.queue.queue[0]
+        return timer() - queued_at if item is not END else 0.0
+
+    def stats(self, elapsed: float) -> dict:
+        return {"stage": self.name,
+                "workers": self.workers,
+                "max_workers": self.max_workers,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_depth,
+                "busy_time": round(self.busy_time, 3),
+                "average_queue_wait": round(self.queue_wait / self.processed, 3) if self.processed > 0 else 0.0,
+                "items_per_second": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0}
+
+
+class SequenceBuffer:
+    # For a single worker stage that has to see items in the order the
+    # source produced them, while the stages before it finish them in any
+    # order. Items are added with their sequence number (0, 1, 2, ...) and
+    # come back in that order once every item before them has been added.
+    def __init__(self):
+        self.next_number = 0
+        self.held = {}
+
+    def add(self, number: int, item) -> list:
+        self.held[number] = item
+        ready = []
+        while self.next_number in self.held:
+            ready.append(self.held.pop(self.next_number))
+            self.next_number += 1
+        return ready
+
+
+class Pipeline:
+    # Runs `source` (any iterable) and the stages at the same time, connected
+    # by bounded queues: a slow stage fills its queue and the stages before
+    # it block on put() instead of running ahead and piling up items in
+    # memory. Every report_interval seconds the queue depth and throughput of
+    # each stage is printed. Every autotune_interval seconds (0 to never)
+    # stages whose items wait longer than autotune_wait seconds in their
+    # queue get a worker, stages whose workers are mostly idle lose one.
+    def __init__(self, source, stages: list, source_name: str = "discovery", report_interval: float = 10.0,
+                 autotune_interval: float = 0.0, autotune_wait: float = 1.0):
+        self.source = source
+        self.source_name = source_name
+        self.stages = stages
+        self.report_interval = report_interval
+        self.autotune_interval = autotune_interval
+        self.autotune_wait = autotune_wait
+
+        self.discovered = 0
+        self.start_time = None
+        self._last_report = 0.0
+        self._last_tune = 0.0
+        self._stop = threading.Event()
+
+    def stop(self):
+        # Stops reading the source, items already queued are drained
+        # without being processed
+        self._stop.set()
+
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def run(self) -> list:
+        # Returns the stats of every stage once all items went through
+        self.start_time = timer()
+        self._last_report = self.start_time
+        self._last_tune = self.start_time
+
+        # All stages run at once, they are only waited on in order: a stage
+        # gets its end of input when the one before it has finished
+        source_thread = threading.Thread(target=self._read_source, daemon=True)
+        source_thread.start()
+
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self._start_worker(index)
+
+        self._wait([source_thread])
+        self._end(0)
+
+        for index, stage in enumerate(self.stages):
+            self._wait(stage.threads)
+            if stage.finish is not None and not self.stopped():
+                try:
+                    stage.finish()
+                except Exception as e:
+                    print(f"Pipeline stage {stage.name} failed to finish: {e}")
+                    stage.errors += 1
+            self._end(index + 1)
+
+        self.report()
+        return self.stats()
+
+    def _start_worker(self, index: int):
+        thread = threading.Thread(target=self._work, args=(index,), daemon=True)
+        self.stages[index].threads.append(thread)
+        thread.start()
+
+    def _read_source(self):
+        first = self.stages[0]
+        try:
+            for item in self.source:
+                if self.stopped():
+                    break
+                self.discovered += 1
+                first.queue.put((timer(), item))
+                first.max_depth = max(first.max_depth, first.queue.qsize())
+        except Exception as e:
+            print(f"Pipeline {self.source_name} failed: {e}")
+            self.stop()
+
+    def _end(self, index: int):
+        if index < len(self.stages):
+            stage = self.stages[index]
+            with stage._lock:
+                # Workers are no longer removed from here on, and the ones
+                # added later put their own END, so every running worker
+                # gets exactly one
+                stage.ended = True
+                workers = stage.workers
+            for _ in range(workers):
+                stage.queue.put((0.0, END))
+
+    def _work(self, index: int):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            with stage._lock:
+                stage.idle_workers += 1
+            queued_at, item = stage.queue.get()
+            got_item = timer()
+            with stage._lock:
+                stage.idle_workers -= 1
+            if item is END:
+                return
+            if self.stopped():
+                continue
+
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                print(f"Pipeline stage {stage.name} failed: {e}")
+                result = None
+                with stage._lock:
+                    stage.errors += 1
+            elapsed = timer() - got_item
+
+            results = (result or []) if stage.many else [result] if result is not None else []
+            if len(results) > 0 and next_stage is not None:
+                with stage._lock:
+                    stage.blocked_workers += 1
+                for result in results:
+                    next_stage.queue.put((timer(), result))
+                    next_stage.max_depth = max(next_stage.max_depth, next_stage.queue.qsize())
+                with stage._lock:
+                    stage.blocked_workers -= 1
+
+            with stage._lock:
+                stage.processed += 1
+                stage.busy_time += elapsed
+                stage.queue_wait += got_item - queued_at
+                stage.window_items += 1
+                stage.window_wait += got_item - queued_at
+                if len(results) == 0:
+                    stage.dropped += 1
+
+                # Scaled down by _autotune
+                if stage.workers > stage.target and not stage.ended:
+                    stage.workers -= 1
+                    return
+
+    def _wait(self, threads: list):
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+                if timer() - self._last_report >= self.report_interval:
+                    self.report()
+                if self.autotune_interval > 0:
+                    for stage in self.stages:
+                        stage.sample()
+                    if timer() - self._last_tune >= self.autotune_interval:
+                        self._autotune()
+
+    def _autotune(self):
+        self._last_tune = timer()
+        for index, stage in enumerate(self.stages):
+            if stage.max_workers <= 1:
+                continue
+
+            oldest_wait = stage.oldest_wait()
+            with stage._lock:
+                samples = stage.window_samples
+                wait = stage.window_wait / stage.window_items if stage.window_items > 0 else 0.0
+                wait = max(wait, oldest_wait)
+                idle = stage.window_idle / samples if samples > 0 else 0.0
+                blocked = stage.window_blocked / samples if samples > 0 else 0.0
+                stage._reset_window()
+                if samples == 0:
+                    continue
+
+                before = stage.target
+                grow = False
+                # Items are waiting and the workers are busy with them, not
+                # stuck on a full queue further down
+                if wait > self.autotune_wait and idle < 0.1 and blocked < 0.25 and stage.workers < stage.max_workers:
+                    stage.workers += 1
+                    stage.target += 1
+                    grow = True
+                    ended = stage.ended
+                elif idle > 0.5 and stage.target > 1 and not stage.ended:
+                    stage.target -= 1
+
+            if grow:
+                self._start_worker(index)
+                if ended:
+                    stage.queue.put((0.0, END))     # The input has ended already
+
+            if stage.target != before:
+                print(f"[{stage.name}] workers {before} => {stage.target} "
+                      f"(queue wait {wait:.2f}s, idle {idle:.0%}, blocked {blocked:.0%})")
+
+    def stats(self) -> list:
+        elapsed = timer() - self.start_time
+        source = {"stage": self.source_name,
+                  "workers": 1,
+                  "processed": self.discovered,
+                  "items_per_second": round(self.discovered / elapsed, 2) if elapsed > 0 else 0.0}
+        return [source] + [stage.stats(elapsed) for stage in self.stages]
+
+    def report(self):
+        self._last_report = timer()
+        for stats in self.stats():
+            depth = stats.get("queue_depth")
+            queue_text = f"queue {depth:>5}" if depth is not None else " " * 11
+            print(f"[{stats['stage']:<12}] {queue_text}  done {stats['processed']:>8}  "
+                  f"{stats['items_per_second']:>8.2f}/s  workers {stats['workers']:>3}")
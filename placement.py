@@ -0,0 +1,99 @@
+import os
+import hashlib
+
+from ffmpeg_runner import make_partial_filename
+
+# Reflinks (copy-on-write clones) are only tried on Linux, on file systems
+# such as btrfs and xfs that support them
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def place_file(source: str, target: str, move: bool = True, link: bool = True, verify: bool = True) -> str:
+    # Puts source at target and returns how it was done: "rename", "link",
+    # "reflink" or "copy". With move=True the source is removed afterwards.
+    # Everything but the rename goes through a temporary next to target
+    # that is moved in place at the end, so target is either the old file
+    # or the complete new one.
+    if move:
+        try:
+            os.replace(source, target)
+            return "rename"
+        except OSError:
+            pass    # Usually a different volume
+
+    methods = [("link", os.link), ("reflink", reflink)] if link else []
+    methods.append(("copy", lambda src, dst: copy_file(src, dst, verify)))
+
+    for method, func in methods:
+        temp = make_partial_filename(target)
+        try:
+            func(source, temp)
+            os.replace(temp, target)
+        except OSError:
+            remove_quietly(temp)
+            if method == "copy":
+                raise
+            continue
+
+        sync_folder(os.path.dirname(target))
+        if move:
+            os.remove(source)
+        return method
+
+
+def reflink(source: str, target: str):
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform")
+
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def copy_file(source: str, target: str, verify: bool = True):
+    # Streams source to target, flushes it to disk and, with verify=True,
+    # reads it back to check that it has the sha256 of the source
+    source_hash = hashlib.sha256()
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+            source_hash.update(chunk)
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    if verify and file_hash(target) != source_hash.hexdigest():
+        raise OSError(f"Checksum mismatch after copying {source} to {target}")
+
+
+def file_hash(filepath: str) -> str:
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def sync_folder(folder: str):
+    # Makes the new directory entry durable, not possible on Windows
+    try:
+        fd = os.open(folder or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def remove_quietly(filepath: str):
+    try:
+        os.remove(filepath)
+    except OSError:
+        pass
@@ -0,0 +1,80 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+COMMIT_EVERY = 500  # writes between commits
+
+
+class ProbeCache:
+    # Persistent cache of probe results (mp3 tags, durations). An entry is
+    # only returned while the file still has the size and mtime it had when
+    # it was probed. Once the cache holds more than max_entries, the least
+    # recently used entries are evicted.
+    def __init__(self, db_file: str, max_entries: int = 500000):
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        # Shared by the probe workers, access is serialised by _lock
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS probes ("
+                          "kind TEXT NOT NULL, "
+                          "path TEXT NOT NULL, "
+                          "size INTEGER, "
+                          "mtime_ns INTEGER, "
+                          "value TEXT, "
+                          "last_used REAL, "
+                          "PRIMARY KEY (kind, path))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used)")
+        self.conn.commit()
+
+    def get(self, kind: str, path: str, stat: os.stat_result):
+        with self._lock:
+            row = self.conn.execute("SELECT size, mtime_ns, value FROM probes WHERE kind = ? AND path = ?",
+                                    (kind, path)).fetchone()
+
+            if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute("UPDATE probes SET last_used = ? WHERE kind = ? AND path = ?",
+                              (time.time(), kind, path))
+            self._written()
+
+        return json.loads(row[2])
+
+    def put(self, kind: str, path: str, stat: os.stat_result, value):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO probes (kind, path, size, mtime_ns, value, last_used) "
+                              "VALUES (?, ?, ?, ?, ?, ?)",
+                              (kind, path, stat.st_size, stat.st_mtime_ns, json.dumps(value), time.time()))
+            self._written()
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % COMMIT_EVERY == 0:
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        count = self.conn.execute("SELECT count(*) FROM probes").fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        self.conn.execute("DELETE FROM probes WHERE rowid IN "
+                          "(SELECT rowid FROM probes ORDER BY last_used LIMIT ?)",
+                          (count - self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self.conn.commit()
+            self.conn.close()
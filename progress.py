@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import threading
+from timeit import default_timer as timer
+from datetime import timedelta
+
+
+class ProgressReporter:
+    # Counts finished files, source bytes and seconds of audio for one run.
+    # A background thread prints the totals with rates and ETA every interval
+    # seconds and writes the same numbers to status_file, so other tools can
+    # poll it. Workers only call update(), which never prints.
+    def __init__(self, mode: str, status_file: str = None, interval: float = 5.0):
+        self.mode = mode
+        self.status_file = status_file
+        self.interval = interval
+        self.total = None       # Files expected, None when not known up front
+        self.files = 0
+        self.failed = 0
+        self.source_bytes = 0
+        self.audio_seconds = 0.0
+        self.started = None
+        self._start = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, total: int = None):
+        self.total = total
+        self.started = time.time()
+        self._start = timer()
+        if self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"progress-{self.mode}", daemon=True)
+        self._thread.start()
+
+    def set_total(self, total: int):
+        with self._lock:
+            self.total = total
+
+    def add_total(self, count: int = 1):
+        # For modes that discover their files while they convert them
+        with self._lock:
+            self.total = (self.total or 0) + count
+
+    def update(self, files: int = 1, source_bytes: int = 0, audio_seconds: float = 0.0, failed: bool = False):
+        with self._lock:
+            self.files += files
+            self.source_bytes += source_bytes or 0
+            self.audio_seconds += audio_seconds or 0.0
+            if failed:
+                self.failed += files
+
+    def stop(self):
+        # Prints and writes the final numbers, safe to call more than once
+        if self._start is None or self._stop.is_set():
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report("finished")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report("running")
+
+    def report(self, state: str = "running"):
+        status = self.snapshot(state)
+        write_line(format_status(status))
+        if self.status_file:
+            self.write_status(status)
+
+    def snapshot(self, state: str = "running") -> dict:
+        with self._lock:
+            files = self.files
+            failed = self.failed
+            total = self.total
+            source_bytes = self.source_bytes
+            audio_seconds = self.audio_seconds
+
+        elapsed = timer() - self._start
+        files_per_second = files / elapsed if elapsed > 0 else 0.0
+
+        eta = None
+        if total is not None and files_per_second > 0:
+            eta = max(0, total - files) / files_per_second
+
+        return {"mode": self.mode,
+                "state": state,
+                "started": self.started,
+                "updated": time.time(),
+                "elapsed_seconds": round(elapsed, 3),
+                "files": files,
+                "failed": failed,
+                "total": total,
+                "source_bytes": source_bytes,
+                "audio_seconds": round(audio_seconds, 3),
+                "files_per_second": round(files_per_second, 3),
+                "source_mb_per_second": round(source_bytes / (1024 * 1024) / elapsed, 3) if elapsed > 0 else 0.0,
+                "realtime_factor": round(audio_seconds / elapsed, 3) if elapsed > 0 else 0.0,
+                "eta_seconds": round(eta, 1) if eta is not None else None}
+
+    def write_status(self, status: dict):
+        # Written to a temporary and moved in place so readers never see
+        # half a file
+        temp = f"{self.status_file}.tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump(status, f, indent=4)
+            os.replace(temp, self.status_file)
+        except OSError as e:
+            write_line(f"Failed to write status to {self.status_file}: {e}")
+
+
+def format_status(status: dict) -> str:
+    done = f"{status['files']}/{status['total']}" if status["total"] is not None else f"{status['files']}"
+    eta = "--"
+    if status["eta_seconds"] is not None:
+        eta = str(timedelta(seconds=int(status["eta_seconds"])))
+    return (f"[{status['mode']}] {done} files ({status['failed']} failed) "
+            f"{status['files_per_second']:.1f} files/s "
+            f"{status['source_mb_per_second']:.1f} MB/s "
+            f"{status['realtime_factor']:.1f}x realtime "
+            f"elapsed {timedelta(seconds=int(status['elapsed_seconds']))} ETA {eta}")
+
+
+def write_line(line: str):
+    # One write per line, so lines from different threads don't interleave
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
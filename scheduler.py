@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def parse_workers(value) -> int:
+    # Accepts the raw config.ini string, an int or None
+    if value is None or str(value).strip() == "":
+        return default_workers()
+
+    workers = int(value)
+    if workers < 1:
+        raise ValueError(f"Invalid number of workers: {value}")
+
+    return workers
+
+
+class ConversionScheduler:
+    def __init__(self, workers=None):
+        self.workers = parse_workers(workers)
+
+    def run(self, job, items):
+        # Fan items out to `job` on a pool of worker threads. Each worker spends
+        # its time waiting on an ffmpeg process, so threads are enough to keep
+        # all cores busy. Only a bounded number of jobs are kept in flight so
+        # `items` can be a generator that is consumed as the workers free up.
+        # Yields (index, item, result) in completion order.
+        max_pending = self.workers * 2
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for index, item in enumerate(items):
+                if len(pending) >= max_pending:
+                    yield from self._collect(pending, FIRST_COMPLETED)
+
+                future = executor.submit(job, index, item)
+                pending[future] = (index, item)
+
+            while pending:
+                yield from self._collect(pending, FIRST_COMPLETED)
+
+    def _collect(self, pending: dict, return_when):
+        done, _ = wait(pending.keys(), return_when=return_when)
+        for future in done:
+            index, item = pending.pop(future)
+            yield index, item, future.result()
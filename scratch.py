@@ -0,0 +1,88 @@
+import os
+import uuid
+import shutil
+import threading
+
+from placement import remove_quietly
+
+
+def is_network_path(path: str, network_roots: tuple = ()) -> bool:
+    # UNC paths (//AUDIO-SERVER/share or \\AUDIO-SERVER\share) and anything
+    # under network_roots, e.g. the mount point of a share on Linux
+    normalized = path.replace("\\", "/")
+    if normalized.startswith("//"):
+        return True
+    return any(normalized.startswith(root) for root in network_roots)
+
+
+class ScratchSpace:
+    # Local copies of sources on network shares. The I/O workers copy the
+    # next sources here while the ffmpeg workers convert local files, so the
+    # share only sees whole-file sequential reads. At most max_bytes are held
+    # at once, fetch() waits for release() of earlier copies when it's full.
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.fetched = 0
+        self.fetched_bytes = 0
+        self.waiting = 0    # fetch() calls waiting for room
+        self.closed = False
+        self._sizes = {}
+        self._cond = threading.Condition()
+
+    def fetch(self, source: str, size: int) -> str:
+        # Returns the path of the local copy
+        with self._cond:
+            # A source bigger than the whole space is let through on its own
+            while not self.closed and self.used > 0 and self.used + size > self.max_bytes:
+                self.waiting += 1
+                try:
+                    self._cond.wait()
+                finally:
+                    self.waiting -= 1
+            if self.closed:
+                raise OSError("Scratch space is closed")
+            self.used += size
+
+        _, ext = os.path.splitext(source)
+        local = os.path.join(self.folder, f"{uuid.uuid4().hex}{ext}")
+        with self._cond:
+            self._sizes[local] = size
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            shutil.copyfile(source, local)
+        except OSError:
+            self.release(local)
+            raise
+
+        with self._cond:
+            closed = self.closed
+            self.fetched += 1
+            self.fetched_bytes += size
+        if closed:
+            self.release(local)
+            raise OSError("Scratch space is closed")
+        return local
+
+    def waiting_fetches(self) -> int:
+        with self._cond:
+            return self.waiting
+
+    def release(self, local: str):
+        remove_quietly(local)
+        with self._cond:
+            self.used -= self._sizes.pop(local, 0)
+            self._cond.notify_all()
+
+    def close(self):
+        # Wakes up waiting fetches and removes the copies nobody released,
+        # e.g. of items dropped when a pipeline was stopped
+        with self._cond:
+            self.closed = True
+            leftovers = list(self._sizes)
+            self._cond.notify_all()
+
+        for local in leftovers:
+            self.release(local)
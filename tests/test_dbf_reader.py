@@ -0,0 +1,75 @@
+import random
+
+from dbf_reader import (get_raw_dbf_data, format_raw_data, read_dbf, iter_records, count_records,
+                        HEADER_SIZE, RECORD_SIZE)
+
+
+def make_record(rnd: random.Random, code: bytes, title: bytes, artist: bytes) -> bytes:
+    filler = bytes(rnd.randrange(256) for _ in range(52))
+    tail = bytes(rnd.randrange(256) for _ in range(262))
+    return code + filler + title.ljust(64) + artist.ljust(64) + tail
+
+
+def random_text(rnd: random.Random, size: int) -> bytes:
+    # Mostly ASCII, sometimes a byte the readers can't decode
+    alphabet = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ 0123456789-'"
+    text = bytes(rnd.choice(alphabet) for _ in range(rnd.randrange(size + 1)))
+    if rnd.random() < 0.1:
+        text = text[:size - 1] + b"\xe9"
+    return text
+
+
+def make_fuzzed_dbf(path, rnd: random.Random):
+    data = bytes(rnd.randrange(256) for _ in range(HEADER_SIZE))
+    for _ in range(rnd.randrange(6)):
+        code = rnd.choice([b"%04d" % rnd.randrange(10000), b"\x00\x00\x00\x00", b"AB\xff1"])
+        data += make_record(rnd, code, random_text(rnd, 64), random_text(rnd, 64))
+
+    # Files often end part way into a record
+    data += bytes(rnd.randrange(1, 256) for _ in range(rnd.choice([0, 0, 1, 3, 4, 100, 184, 185, 300])))
+
+    # And some are shorter than their header
+    if rnd.random() < 0.05:
+        data = data[:rnd.randrange(HEADER_SIZE + 1)]
+
+    path.write_bytes(data)
+
+
+def test_matches_legacy_reader_on_fuzzed_files(tmp_path):
+    rnd = random.Random(4)
+    for i in range(400):
+        dbf = tmp_path / f"F{i:03d}.DBF"
+        make_fuzzed_dbf(dbf, rnd)
+
+        legacy = format_raw_data(get_raw_dbf_data(str(dbf)), "CHR.DBF", "..//Audio")
+        current = read_dbf(str(dbf), "CHR.DBF", "..//Audio")
+
+        assert current == legacy, f"Different records for fuzzed file {i}"
+        assert count_records(str(dbf)) >= len(current)
+
+
+def test_reads_fields(tmp_path):
+    rnd = random.Random(1)
+    dbf = tmp_path / "JIN.DBF"
+    dbf.write_bytes(bytes(HEADER_SIZE) + make_record(rnd, b"0042", b"SAFETY TIPS", b"MATATU STAGES"))
+
+    records = read_dbf(str(dbf), "JIN.DBF", "..//Audio")
+
+    assert records == [{"code": "0042",
+                        "title": "SAFETY TIPS",
+                        "artist": "MATATU STAGES",
+                        "category": "JIN",
+                        "audio_file": "..//Audio//JIN//JIN0042.MTS"}]
+
+
+def test_empty_file(tmp_path):
+    dbf = tmp_path / "EMPTY.DBF"
+    dbf.write_bytes(b"")
+    assert list(iter_records(str(dbf), "EMPTY.DBF", "..//Audio")) == []
+    assert count_records(str(dbf)) == 0
+
+
+def test_count_records(tmp_path):
+    dbf = tmp_path / "CHR.DBF"
+    dbf.write_bytes(bytes(HEADER_SIZE + RECORD_SIZE * 3))
+    assert count_records(str(dbf)) == 4
@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+
+from encoder_profiles import (EncoderProfile, ProfileStats, DEFAULT_PROFILES, parse_profile, parse_profiles,
+                              parse_profile_map, parse_bitrate)
+
+
+def ogg_probe(codec: str = "vorbis", bit_rate: str = "128000", sample_rate: str = "44100", channels: int = 2,
+              format_name: str = "ogg") -> dict:
+    # Shaped like the result of ffmpeg_runner.probe_audio
+    return {"format_name": format_name,
+            "bit_rate": bit_rate,
+            "stream": {"codec_name": codec, "sample_rate": sample_rate, "channels": channels, "bit_rate": bit_rate}}
+
+
+def test_default_profile_args():
+    assert DEFAULT_PROFILES["vorbis"].codec_args() == ["-c:a", "libvorbis", "-q:a", "4", "-vsync", "2"]
+
+
+def test_parse_profile():
+    profile = parse_profile("jingles", "codec=libopus, bitrate=64k,threads=2,")
+
+    assert profile.name == "jingles"
+    assert profile.codec_args() == ["-c:a", "libopus", "-b:a", "64k", "-threads", "2", "-vsync", "2"]
+    assert profile.settings() == {"codec": "libopus", "bitrate": "64k", "threads": "2"}
+
+
+def test_parse_profile_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        parse_profile("speech", "codec=libvorbis,volume=2")
+
+
+def test_parse_profiles_keeps_the_default():
+    config = {"profile.speech": "codec=libvorbis,quality=2,sample_rate=22050,channels=1",
+              "workers": "4"}
+
+    profiles = parse_profiles(config)
+
+    assert sorted(profiles) == ["speech", "vorbis"]
+    assert profiles["speech"].codec_args() == ["-c:a", "libvorbis", "-q:a", "2", "-ar", "22050", "-ac", "1",
+                                               "-vsync", "2"]
+
+
+def test_parse_profiles_can_replace_the_default():
+    profiles = parse_profiles({"profile.vorbis": "codec=libvorbis,quality=6"})
+    assert profiles["vorbis"].quality == "6"
+    assert DEFAULT_PROFILES["vorbis"].quality == "4"
+
+
+def test_parse_profile_map():
+    assert parse_profile_map("SPO:speech, JIN:jingles,") == {"SPO": "speech", "JIN": "jingles"}
+    assert parse_profile_map("") == {}
+
+
+def test_parse_bitrate():
+    assert parse_bitrate("64k") == 64
+    assert parse_bitrate("1M") == 1000
+    assert parse_bitrate("96000") == 96
+
+
+def test_accepts_matching_source():
+    assert DEFAULT_PROFILES["vorbis"].accepts(ogg_probe())
+
+
+def test_rejects_other_codecs_and_containers():
+    profile = DEFAULT_PROFILES["vorbis"]
+    assert not profile.accepts(ogg_probe(codec="opus"))
+    assert not profile.accepts(ogg_probe(format_name="mp3"))
+    assert not profile.accepts(ogg_probe(codec="mp3", format_name="mp3"))
+
+
+def test_rejects_low_bitrate_for_the_quality():
+    # q4 is 128 kbit/s nominal, VBR files somewhat below it are copied
+    profile = DEFAULT_PROFILES["vorbis"]
+    assert profile.accepts(ogg_probe(bit_rate="110000"))
+    assert not profile.accepts(ogg_probe(bit_rate="48000"))
+    assert not profile.accepts(ogg_probe(bit_rate=None))
+
+
+def test_min_bitrate_overrides_the_quality():
+    profile = EncoderProfile("low", "libvorbis", quality="4", min_bitrate="32")
+    assert profile.accepts(ogg_probe(bit_rate="48000"))
+
+
+def test_bitrate_profile_minimum():
+    profile = EncoderProfile("jingles", "libopus", bitrate="64k")
+    assert profile.accepts(ogg_probe(codec="opus", bit_rate="60000"))
+    assert not profile.accepts(ogg_probe(codec="opus", bit_rate="32000"))
+
+
+def test_profile_without_quality_or_bitrate_never_copies():
+    assert not EncoderProfile("plain", "libvorbis").accepts(ogg_probe(bit_rate="320000"))
+
+
+def test_sample_rate_and_channels_must_match():
+    profile = EncoderProfile("speech", "libvorbis", quality="2", sample_rate="22050", channels="1")
+    assert profile.accepts(ogg_probe(sample_rate="22050", channels=1))
+    assert not profile.accepts(ogg_probe(sample_rate="44100", channels=1))
+    assert not profile.accepts(ogg_probe(sample_rate="22050", channels=2))
+
+
+def test_profile_stats():
+    stats = ProfileStats()
+    profile = DEFAULT_PROFILES["vorbis"]
+    ok = SimpleNamespace(ok=True, wall_time=2.0, cpu_time=0.5, duration=20.0, output_size=1000)
+    failed = SimpleNamespace(ok=False, wall_time=9.0, cpu_time=9.0, duration=None, output_size=None)
+
+    stats.add(profile, ok, 4000)
+    stats.add(profile, ok, 4000)
+    stats.add(profile, failed, 4000)
+
+    [row] = stats.summary()
+    assert row["profile"] == "vorbis"
+    assert row["quality"] == "4"
+    assert row["files"] == 3
+    assert row["failed"] == 1
+    assert row["audio_seconds"] == 40.0
+    assert row["wall_seconds"] == 4.0
+    assert row["bytes_in"] == 8000
+    assert row["bytes_out"] == 2000
+    assert row["realtime_factor"] == 10.0
+    assert row["cpu_realtime_factor"] == 40.0
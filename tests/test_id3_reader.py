@@ -0,0 +1,121 @@
+import struct
+
+from id3_reader import read_mp3_info, parse_frame_header, find_first_frame, syncsafe
+
+# MPEG-1 layer III, 128 kbit/s, 44100 Hz, 417 bytes per frame
+FRAME_HEADER = b"\xff\xfb\x90\xc4"
+FRAME = FRAME_HEADER + b"\x00" * 413
+
+
+def to_syncsafe(value: int) -> bytes:
+    return bytes([(value >> 21) & 0x7f, (value >> 14) & 0x7f, (value >> 7) & 0x7f, value & 0x7f])
+
+
+def text_frame(frame_id: bytes, text: str) -> bytes:
+    data = b"\x03" + text.encode("utf-8")
+    return frame_id + struct.pack(">I", len(data)) + b"\x00\x00" + data
+
+
+def id3v23_tag(body: bytes, flags: int = 0) -> bytes:
+    return b"ID3\x03\x00" + bytes([flags]) + to_syncsafe(len(body)) + body
+
+
+def write(tmp_path, name: str, data: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_reads_tags_and_cbr_duration(tmp_path):
+    tag = id3v23_tag(text_frame(b"TIT2", "Title") + text_frame(b"TPE1", "Artist"))
+    path = write(tmp_path, "song.mp3", tag + FRAME * 100)
+
+    info = read_mp3_info(path)
+
+    assert info["title"] == "Title"
+    assert info["artist"] == "Artist"
+    # Constant bitrate estimate: 41700 bytes at 128 kbit/s
+    assert info["duration"] == 2606
+
+
+def test_id3v1_fills_in_missing_tags(tmp_path):
+    id3v1 = b"TAG" + b"Old title".ljust(30, b"\x00") + b"Old artist".ljust(30, b"\x00") + b"\x00" * 65
+    tag = id3v23_tag(text_frame(b"TIT2", "New title"))
+    path = write(tmp_path, "song.mp3", tag + FRAME * 10 + id3v1)
+
+    info = read_mp3_info(path)
+
+    assert info["title"] == "New title"
+    assert info["artist"] == "Old artist"
+
+
+def test_no_frames_returns_none(tmp_path):
+    path = write(tmp_path, "noise.mp3", b"\x00" * 4096)
+    assert read_mp3_info(path) is None
+
+
+def test_missing_file_returns_none(tmp_path):
+    assert read_mp3_info(str(tmp_path / "missing.mp3")) is None
+
+
+def test_truncated_extended_header_returns_none(tmp_path):
+    # Extended header flag set, but the file ends inside the header size
+    header = b"ID3\x03\x00\x40" + to_syncsafe(100)
+    path = write(tmp_path, "truncated.mp3", header + b"\x00\x00")
+    assert read_mp3_info(path) is None
+
+
+def test_truncated_v24_extended_header_returns_none(tmp_path):
+    header = b"ID3\x04\x00\x40" + to_syncsafe(100)
+    path = write(tmp_path, "truncated.mp3", header + b"\x00")
+    assert read_mp3_info(path) is None
+
+
+def test_truncated_frame_header_returns_tags_read_so_far(tmp_path):
+    # The last frame header is cut off after its id, the tags before it are kept
+    body = text_frame(b"TIT2", "Title") + b"TPE1\x00\x00\x00\x05\x00\x00"
+    tag = b"ID3\x03\x00\x00" + to_syncsafe(len(body) + 3) + body
+    path = write(tmp_path, "cut.mp3", tag + FRAME * 10)
+
+    info = read_mp3_info(path)
+
+    assert info["title"] == "Title"
+    assert "artist" not in info
+
+
+def test_parse_frame_header():
+    header = parse_frame_header(FRAME_HEADER)
+    assert header["version"] == 1
+    assert header["layer"] == 3
+    assert header["bitrate"] == 128
+    assert header["sample_rate"] == 44100
+    assert header["length"] == 417
+
+
+def test_parse_frame_header_rejects_invalid():
+    assert parse_frame_header(b"\xff\xfb\xf0\xc4") is None    # Bitrate index 15
+    assert parse_frame_header(b"\xff\xfb\x9c\xc4") is None    # Sample rate index 3
+    assert parse_frame_header(b"\x00\xfb\x90\xc4") is None
+    assert parse_frame_header(b"\xff") is None
+
+
+def test_find_first_frame_skips_false_sync():
+    buffer = b"\xff\xfb\x90" + b"\x00" * 20 + FRAME * 3
+    offset, header, xing_frames = find_first_frame(buffer)
+    assert offset == 23
+    assert xing_frames is None
+
+
+def test_find_first_frame_reads_xing_frame_count():
+    # Mono MPEG-1: the Xing header follows 17 bytes of side information
+    xing = b"Xing" + struct.pack(">II", 0x01, 1234)
+    first = FRAME_HEADER + b"\x00" * 17 + xing
+    first += b"\x00" * (417 - len(first))
+    offset, header, xing_frames = find_first_frame(first + FRAME)
+    assert offset == 0
+    assert xing_frames == 1234
+
+
+def test_syncsafe():
+    assert syncsafe(to_syncsafe(0x0fffffff)) == 0x0fffffff
+    assert syncsafe(b"\x00\x00\x02\x01") == 257
@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+from manifest import ConversionManifest
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = ConversionManifest(str(tmp_path / "manifest.db"))
+    yield manifest
+    manifest.close()
+
+
+def write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_finished_after_mark_done(tmp_path, manifest):
+    source = write(tmp_path / "a.MTS", b"source")
+    output = write(tmp_path / "a.ogg", b"output data")
+
+    manifest.mark_done("mts", source, os.stat(source), output, 1500)
+    entry = manifest.finished("mts", source, os.stat(source))
+
+    assert entry["status"] == "done"
+    assert entry["output_path"] == output
+    assert entry["output_size"] == len(b"output data")
+    assert entry["duration_ms"] == 1500
+
+
+def test_unknown_source_is_not_finished(tmp_path, manifest):
+    source = write(tmp_path / "a.MTS", b"source")
+    assert manifest.finished("mts", source, os.stat(source)) is None
+
+
+def test_changed_source_is_not_finished(tmp_path, manifest):
+    source = write(tmp_path / "a.MTS", b"source")
+    output = write(tmp_path / "a.ogg", b"output")
+    manifest.mark_done("mts", source, os.stat(source), output, 1000)
+
+    write(tmp_path / "a.MTS", b"a longer source")
+
+    assert manifest.finished("mts", source, os.stat(source)) is None
+
+
+def test_touched_source_is_not_finished(tmp_path, manifest):
+    source = write(tmp_path / "a.MTS", b"source")
+    output = write(tmp_path / "a.ogg", b"output")
+    stat = os.stat(source)
+    manifest.mark_done("mts", source, stat, output, 1000)
+
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert manifest.finished("mts", source, os.stat(source)) is None
+
+
+def test_missing_or_truncated_output_is_not_finished(tmp_path, manifest):
+    source = write(tmp_path / "a.MTS", b"source")
+    output = write(tmp_path / "a.ogg", b"output")
+    manifest.mark_done("mts", source, os.stat(source), output, 1000)
+
+    write(tmp_path / "a.ogg", b"out")
+    assert manifest.finished("mts", source, os.stat(source)) is None
+
+    os.remove(output)
+    assert manifest.finished("mts", source, os.stat(source)) is None
+
+
+def test_failed_is_recorded_but_not_finished(tmp_path, manifest):
+    source = write(tmp_path / "a.MTS", b"source")
+    manifest.mark_failed("mts", source, os.stat(source), "Invalid data found")
+
+    assert manifest.finished("mts", source, os.stat(source)) is None
+    entry = manifest.lookup("mts", source, os.stat(source))
+    assert entry["status"] == "failed"
+    assert entry["error"] == "Invalid data found"
+
+
+def test_done_replaces_failed(tmp_path, manifest):
+    source = write(tmp_path / "a.MTS", b"source")
+    output = write(tmp_path / "a.ogg", b"output")
+    manifest.mark_failed("mts", source, os.stat(source), "Killed")
+    manifest.mark_done("mts", source, os.stat(source), output, 1000)
+
+    assert manifest.finished("mts", source, os.stat(source)) is not None
+
+
+def test_pipelines_are_separate(tmp_path, manifest):
+    source = write(tmp_path / "a.mp3", b"source")
+    output = write(tmp_path / "a.ogg", b"output")
+    manifest.mark_done("mp3", source, os.stat(source), output, 1000)
+
+    assert manifest.finished("prepared", source, os.stat(source)) is None
+    assert manifest.finished("mp3", source, os.stat(source)) is not None
+
+
+def test_update_output_follows_a_rename(tmp_path, manifest):
+    source = write(tmp_path / "a.mp3", b"source")
+    output = write(tmp_path / "a.ogg", b"output")
+    manifest.mark_done("mp3", source, os.stat(source), output, 1000)
+
+    renamed = str(tmp_path / "00000001.ogg")
+    os.rename(output, renamed)
+    assert manifest.finished("mp3", source, os.stat(source)) is None
+
+    manifest.update_output("mp3", source, renamed)
+    assert manifest.finished("mp3", source, os.stat(source))["output_path"] == renamed
+
+
+def test_resumes_from_an_earlier_run(tmp_path):
+    db_file = str(tmp_path / "manifest.db")
+    source = write(tmp_path / "a.MTS", b"source")
+    output = write(tmp_path / "a.ogg", b"output")
+
+    first_run = ConversionManifest(db_file)
+    first_run.mark_done("mts", source, os.stat(source), output, 1000)
+    first_run.close()
+
+    second_run = ConversionManifest(db_file)
+    try:
+        assert second_run.finished("mts", source, os.stat(source)) is not None
+    finally:
+        second_run.close()
@@ -0,0 +1,119 @@
+import sqlite3
+
+from mssql_data import MSSQLData, SQLiteData, format_sql_value, make_insert_stmt, make_insert_sql
+
+ARTIST_COLUMNS = ['ArtistID', 'ArtistSurname', 'ArtistType']
+
+
+def test_format_sql_value():
+    assert format_sql_value(None) == "NULL"
+    assert format_sql_value(42) == "42"
+    assert format_sql_value(1.5) == "1.5"
+    assert format_sql_value("ROAD SAFETY") == '"ROAD SAFETY"'
+
+
+def test_format_sql_value_doubles_quotes():
+    assert format_sql_value('12" MIX') == '"12"" MIX"'
+    assert format_sql_value('""') == '""""""'
+
+
+def test_format_sql_value_keeps_single_quotes_and_unicode():
+    assert format_sql_value("O'NEIL") == '"O\'NEIL"'
+    assert format_sql_value("CHEBWARENG é") == '"CHEBWARENG é"'
+
+
+def test_make_insert_stmt():
+    stmt = make_insert_stmt("Artists", ARTIST_COLUMNS, (7, 'THE "BIG" BAND', "GROUP"))
+    assert stmt == 'Insert into Artists (ArtistID,ArtistSurname,ArtistType) VALUES (7,"THE ""BIG"" BAND","GROUP");'
+
+
+def test_make_insert_stmt_null():
+    stmt = make_insert_stmt("Artists", ARTIST_COLUMNS, (7, None, "GROUP"))
+    assert stmt == 'Insert into Artists (ArtistID,ArtistSurname,ArtistType) VALUES (7,NULL,"GROUP");'
+
+
+def test_make_insert_sql():
+    assert make_insert_sql("Artists", ARTIST_COLUMNS) == \
+        "Insert into Artists (ArtistID, ArtistSurname, ArtistType) VALUES (?, ?, ?)"
+
+
+def test_bulk_insert_round_trip(tmp_path):
+    rows = [(1, 'THE "BIG" BAND', "GROUP"), (2, "O'NEIL", "GROUP"), (3, None, "GROUP")]
+    data = SQLiteData(str(tmp_path / "studioone.db"))
+    try:
+        assert data.bulk_insert([("Artists", ARTIST_COLUMNS, rows)], batch_size=2)
+        assert data.execute_query("SELECT ArtistID, ArtistSurname, ArtistType FROM Artists ORDER BY ArtistID") == rows
+    finally:
+        data.disconnect()
+
+
+def test_bulk_insert_rolls_back_on_error(tmp_path):
+    data = SQLiteData(str(tmp_path / "studioone.db"))
+    try:
+        # The second row repeats the primary key of the first
+        rows = [(1, "A", "GROUP"), (1, "B", "GROUP")]
+        assert not data.bulk_insert([("Artists", ARTIST_COLUMNS, rows)])
+        assert data.execute_query("SELECT COUNT(*) FROM Artists") == [(0,)]
+    finally:
+        data.disconnect()
+
+
+class DroppedLinkCursor:
+    def executemany(self, sql, rows):
+        raise sqlite3.OperationalError("08S01", "Communication link failure")
+
+    def close(self):
+        raise sqlite3.OperationalError("08S01", "Communication link failure")
+
+
+class DroppedLinkConnection:
+    # A connection whose link went down, every call on it fails
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return DroppedLinkCursor()
+
+    def rollback(self):
+        raise sqlite3.OperationalError("08S01", "Communication link failure")
+
+    def close(self):
+        self.conn.close()
+
+
+class DroppingSQLiteData(SQLiteData):
+    # The first `drops` connections lose their link, later ones work
+    def __init__(self, filename, drops):
+        super().__init__(filename)
+        self.drops = drops
+        self.connections = 0
+
+    def open_connection(self):
+        conn = super().open_connection()
+        self.connections += 1
+        if self.connections <= self.drops:
+            return DroppedLinkConnection(conn)
+        return conn
+
+    def is_connection_error(self, ex) -> bool:
+        return MSSQLData.is_connection_error(self, ex)
+
+
+def test_bulk_insert_replays_after_dropped_link(tmp_path):
+    rows = [(1, "A", "GROUP"), (2, "B", "GROUP"), (3, "C", "GROUP")]
+    data = DroppingSQLiteData(str(tmp_path / "studioone.db"), drops=1)
+    try:
+        assert data.bulk_insert([("Artists", ARTIST_COLUMNS, rows)], batch_size=2)
+        assert data.connections == 2
+        assert data.execute_query("SELECT ArtistID, ArtistSurname, ArtistType FROM Artists ORDER BY ArtistID") == rows
+    finally:
+        data.disconnect()
+
+
+def test_bulk_insert_replays_only_once(tmp_path):
+    data = DroppingSQLiteData(str(tmp_path / "studioone.db"), drops=2)
+    try:
+        assert not data.bulk_insert([("Artists", ARTIST_COLUMNS, [(1, "A", "GROUP")])])
+        assert data.connections == 2
+    finally:
+        data.disconnect()
@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+
+from pipeline import Pipeline, PipelineStage, SequenceBuffer
+
+
+def run(source, stages: list, **kwargs) -> list:
+    return Pipeline(source, stages, report_interval=60.0, **kwargs).run()
+
+
+def test_sequence_buffer_returns_items_in_order():
+    buffer = SequenceBuffer()
+    assert buffer.add(2, "c") == []
+    assert buffer.add(1, "b") == []
+    assert buffer.add(0, "a") == ["a", "b", "c"]
+    assert buffer.add(3, None) == [None]
+    assert buffer.held == {}
+
+
+def test_many_stage_puts_every_item_of_the_list():
+    results = []
+    stats = run(range(5), [PipelineStage("split", lambda n: [n] * n, many=True),
+                           PipelineStage("collect", results.append)])
+
+    assert sorted(results) == [1, 2, 2, 3, 3, 3, 4, 4, 4, 4]
+    split = stats[1]
+    assert split["processed"] == 5
+    assert split["dropped"] == 1     # 0 gave an empty list
+
+
+def test_reordered_stage_sees_source_order():
+    # The workers finish in random order, the single worker stage after
+    # them gets the items back in source order
+    buffer = SequenceBuffer()
+    results = []
+
+    def work(item):
+        time.sleep(random.random() * 0.01)
+        return item
+
+    run(enumerate(range(50)), [PipelineStage("work", work, workers=4),
+                               PipelineStage("order", lambda item: buffer.add(*item), many=True),
+                               PipelineStage("collect", results.append)])
+
+    assert results == list(range(50))
+
+
+def run_in_thread(source, stages: list, timeout: float = 20.0, **kwargs) -> list:
+    # Fails instead of hanging when a worker never gets its END
+    result = []
+    thread = threading.Thread(target=lambda: result.append(run(source, stages, **kwargs)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not finish"
+    return result[0]
+
+
+def slow(item):
+    time.sleep(0.02)
+    return item
+
+
+def test_autotune_adds_workers_to_a_busy_stage():
+    results = []
+    stats = run_in_thread(range(100), [PipelineStage("work", slow, workers=1, max_workers=3),
+                                       PipelineStage("collect", results.append)],
+                          autotune_interval=0.2, autotune_wait=0.05)
+
+    assert sorted(results) == list(range(100))
+    assert stats[1]["workers"] > 1
+
+
+def test_autotune_grows_a_stage_whose_input_has_ended():
+    # The whole source is queued at once, so the workers added later each
+    # need an END of their own
+    stage = PipelineStage("work", slow, workers=1, max_workers=4, queue_size=200)
+    results = []
+    stats = run_in_thread(range(150), [stage, PipelineStage("collect", results.append)],
+                          autotune_interval=0.2, autotune_wait=0.05)
+
+    assert sorted(results) == list(range(150))
+    assert stats[1]["workers"] > 1
+    assert all(not thread.is_alive() for thread in stage.threads)
+
+
+def test_autotune_removes_idle_workers():
+    def trickle():
+        for item in range(40):
+            time.sleep(0.03)
+            yield item
+
+    results = []
+    stats = run_in_thread(trickle(), [PipelineStage("work", lambda item: item, workers=3, max_workers=3),
+                                      PipelineStage("collect", results.append)],
+                          autotune_interval=0.2, autotune_wait=0.05)
+
+    assert sorted(results) == list(range(40))
+    assert stats[1]["workers"] < 3
+
+
+def test_autotune_leaves_blocked_workers_alone():
+    # Workers waiting on something outside the pipeline don't get company
+    results = []
+    stats = run_in_thread(range(100), [PipelineStage("work", slow, workers=1, max_workers=3, blocked=lambda: 1),
+                                       PipelineStage("collect", results.append)],
+                          autotune_interval=0.2, autotune_wait=0.05)
+
+    assert sorted(results) == list(range(100))
+    assert stats[1]["workers"] == 1
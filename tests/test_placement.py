@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+import placement
+from placement import place_file, copy_file
+
+
+def make_source(tmp_path, data: bytes = b"ogg data") -> str:
+    source = tmp_path / "source.ogg"
+    source.write_bytes(data)
+    return str(source)
+
+
+def fail(*args):
+    raise OSError("Not supported")
+
+
+def no_cross_volume_rename(monkeypatch, source: str):
+    # os.replace of the source fails like a move to another volume, the
+    # temporaries next to the target can still be moved in place
+    replace = os.replace
+
+    def fake_replace(src, dst):
+        if src == source:
+            raise OSError("Invalid cross-device link")
+        replace(src, dst)
+
+    monkeypatch.setattr(placement.os, "replace", fake_replace)
+
+
+def folder_files(path) -> list:
+    return sorted(os.listdir(path))
+
+
+def test_rename(tmp_path):
+    source = make_source(tmp_path)
+    target = str(tmp_path / "target.ogg")
+
+    assert place_file(source, target) == "rename"
+    assert not os.path.exists(source)
+    assert open(target, "rb").read() == b"ogg data"
+
+
+def test_link_when_rename_fails(tmp_path, monkeypatch):
+    source = make_source(tmp_path)
+    target = str(tmp_path / "target.ogg")
+    no_cross_volume_rename(monkeypatch, source)
+
+    assert place_file(source, target) == "link"
+    assert not os.path.exists(source)
+    assert open(target, "rb").read() == b"ogg data"
+    assert folder_files(tmp_path) == ["target.ogg"]
+
+
+def test_reflink_when_link_fails(tmp_path, monkeypatch):
+    source = make_source(tmp_path)
+    target = str(tmp_path / "target.ogg")
+    no_cross_volume_rename(monkeypatch, source)
+    monkeypatch.setattr(placement.os, "link", fail)
+    monkeypatch.setattr(placement, "reflink", lambda src, dst: copy_file(src, dst, verify=False))
+
+    assert place_file(source, target) == "reflink"
+    assert open(target, "rb").read() == b"ogg data"
+
+
+def test_copy_when_nothing_else_works(tmp_path, monkeypatch):
+    source = make_source(tmp_path)
+    target = str(tmp_path / "target.ogg")
+    no_cross_volume_rename(monkeypatch, source)
+    monkeypatch.setattr(placement.os, "link", fail)
+    monkeypatch.setattr(placement, "reflink", fail)
+
+    assert place_file(source, target) == "copy"
+    assert not os.path.exists(source)
+    assert open(target, "rb").read() == b"ogg data"
+    assert folder_files(tmp_path) == ["target.ogg"]
+
+
+def test_copy_without_link_keeps_source(tmp_path):
+    source = make_source(tmp_path)
+    target = str(tmp_path / "target.ogg")
+
+    assert place_file(source, target, move=False, link=False) == "copy"
+    assert open(source, "rb").read() == b"ogg data"
+    assert open(target, "rb").read() == b"ogg data"
+    assert os.stat(source).st_ino != os.stat(target).st_ino
+
+
+def test_link_without_move_keeps_source(tmp_path):
+    source = make_source(tmp_path)
+    target = str(tmp_path / "target.ogg")
+
+    assert place_file(source, target, move=False) == "link"
+    assert os.path.exists(source)
+    assert os.path.samefile(source, target)
+
+
+def test_failed_copy_keeps_old_target(tmp_path, monkeypatch):
+    source = make_source(tmp_path)
+    target = tmp_path / "target.ogg"
+    target.write_bytes(b"old output")
+    monkeypatch.setattr(placement, "file_hash", lambda filepath: "0" * 64)    # Every copy fails to verify
+
+    with pytest.raises(OSError):
+        place_file(source, str(target), move=False, link=False)
+
+    assert target.read_bytes() == b"old output"
+    assert folder_files(tmp_path) == ["source.ogg", "target.ogg"]
+
+
+def test_copy_file_verifies(tmp_path):
+    source = make_source(tmp_path, os.urandom(3 * placement.COPY_CHUNK_SIZE + 17))
+    target = str(tmp_path / "copy.ogg")
+
+    copy_file(source, target)
+
+    assert placement.file_hash(target) == placement.file_hash(source)
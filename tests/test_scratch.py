@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+
+import pytest
+
+from scratch import ScratchSpace, is_network_path
+
+
+def write(path, size: int) -> str:
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def start_fetch(scratch: ScratchSpace, source: str, size: int) -> tuple:
+    # Runs fetch() in a thread, returns (thread, list with the local path
+    # or the error once it returns)
+    result = []
+
+    def fetch():
+        try:
+            result.append(scratch.fetch(source, size))
+        except OSError as e:
+            result.append(e)
+
+    thread = threading.Thread(target=fetch, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_is_network_path():
+    assert is_network_path("//AUDIO-SERVER/share/a.mp3")
+    assert is_network_path("\\\\AUDIO-SERVER\\share\\a.mp3")
+    assert is_network_path("/mnt/audio/a.mp3", ("/mnt/audio",))
+    assert not is_network_path("/home/audio/a.mp3", ("/mnt/audio",))
+
+
+def test_fetch_copies_and_release_frees(tmp_path):
+    source = write(tmp_path / "a.mp3", 6)
+    scratch = ScratchSpace(str(tmp_path / "scratch"), 10)
+
+    local = scratch.fetch(source, 6)
+    assert local.endswith(".mp3")
+    assert open(local, "rb").read() == b"x" * 6
+    assert scratch.used == 6
+    assert scratch.fetched == 1 and scratch.fetched_bytes == 6
+
+    scratch.release(local)
+    assert not os.path.exists(local)
+    assert scratch.used == 0
+
+
+def test_fetch_waits_for_room(tmp_path):
+    first = write(tmp_path / "a.mp3", 6)
+    second = write(tmp_path / "b.mp3", 6)
+    scratch = ScratchSpace(str(tmp_path / "scratch"), 10)
+
+    local = scratch.fetch(first, 6)
+    thread, result = start_fetch(scratch, second, 6)
+    wait_for(lambda: scratch.waiting_fetches() == 1)
+    assert result == []
+
+    scratch.release(local)
+    thread.join(5)
+    assert scratch.waiting_fetches() == 0
+    assert os.path.exists(result[0])
+    assert scratch.used == 6
+
+
+def test_source_bigger_than_the_space_goes_through_alone(tmp_path):
+    source = write(tmp_path / "big.mp3", 20)
+    scratch = ScratchSpace(str(tmp_path / "scratch"), 10)
+
+    local = scratch.fetch(source, 20)
+    assert scratch.used == 20
+    scratch.release(local)
+
+
+def test_close_wakes_waiting_fetches_and_removes_copies(tmp_path):
+    first = write(tmp_path / "a.mp3", 6)
+    second = write(tmp_path / "b.mp3", 6)
+    scratch = ScratchSpace(str(tmp_path / "scratch"), 10)
+
+    local = scratch.fetch(first, 6)
+    thread, result = start_fetch(scratch, second, 6)
+    wait_for(lambda: scratch.waiting_fetches() == 1)
+
+    scratch.close()
+    thread.join(5)
+    assert isinstance(result[0], OSError)
+    assert not os.path.exists(local)
+    assert scratch.used == 0
+
+    with pytest.raises(OSError):
+        scratch.fetch(first, 6)